@@ -4,8 +4,12 @@ import os
 from os import path as op
 import re
 import sys
+import time
 
+from . import profiling
 
+
+profiling.start()
 CONFIG = configparser.ConfigParser()
 CONFIG.optionxform = lambda optionstr: str(optionstr)
 MODULES = ['env', 'install']
@@ -29,7 +33,7 @@ def get_config_str(name: str, default: str = ''):
 
 def get_config_dict(name: str) -> dict[str, str]:
     res = get_config(name)
-    return res if isinstance(res, dict) else {}
+    return dict(res) if isinstance(res, (dict, configparser.SectionProxy)) else {}
 
 
 def load_config(filename: str, init: dict[str, str] | None = None):
@@ -47,6 +51,7 @@ def load_config(filename: str, init: dict[str, str] | None = None):
 
 
 def init(parent_module: str = '__main__', env: dict[str, str] | None = None, config: str = 'config.ini'):
+    started = time.time()
     parent = sys.modules[parent_module]
     initial = {
         'APPNAME': getattr(parent, 'APPNAME', ''),
@@ -74,11 +79,33 @@ def init(parent_module: str = '__main__', env: dict[str, str] | None = None, con
         elif not os.environ.get(var):
             os.environ[var] = val
     logging.basicConfig(level=logging.INFO)
+    profiling.record('init', started)
 
 
 logger = logging.getLogger(__name__)
 
 
+def file_sha256(filename: str):
+    import hashlib
+
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as src:
+        while chunk := src.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def format_table(rows: list[tuple[str, ...]], numeric: bool = False):
+    """Return *rows* (the first one is the header) as lines of aligned columns.
+
+    With *numeric*, the columns after the first are right-aligned.
+    """
+    widths = [max(len(row[col]) for row in rows) for col in range(len(rows[0]))]
+    return ['  '.join(cell.rjust(width) if numeric and col else cell.ljust(width)
+                      for col, (cell, width) in enumerate(zip(row, widths))).rstrip() for row in rows]
+
+
 from .base import get_parser, main
+profiling.record('import', profiling.IMPORTED)
 
 __all__ = ['get_parser', 'main', 'init', 'load_config', 'get_config', 'CONFIG', 'MODULES']
\ No newline at end of file
@@ -1,39 +1,171 @@
 import argparse
+import ast
 import importlib
+import importlib.util
+import json
 import logging
+import os
 from os import path as op
+import sys
+from types import ModuleType
 from typing import Any, Callable
 
-from . import get_config_str, logger, MODULES
-from .modules import env
+from . import get_config_str, logger, MODULES, profiling
+
+
+MANIFEST_FILE = '.runlib-commands.json'
+
+
+def _module_names(module: str):
+    return (f'{__package__}.{module}', f'{__package__}.modules.{module}')
+
+
+def import_module(module: str) -> ModuleType | None:
+    """Import runlib module *module* (as listed in MODULES), logging and returning None on failure."""
+    try:
+        return importlib.import_module(f'..{module}', __name__)
+    except ImportError:
+        try:
+            return importlib.import_module(f'..modules.{module}', __name__)
+        except ImportError as exc:
+            logger.error('Error loading module %s: %s', module, str(exc))
+    return None
+
+
+def _find_source(module: str):
+    for name in _module_names(module):
+        try:
+            spec = importlib.util.find_spec(name)
+        except (ImportError, ValueError):
+            continue
+        if spec and spec.origin and spec.origin.endswith('.py'):
+            return spec.origin
+    return None
+
+
+def _read_commands(filename: str) -> dict[str, str] | None:
+    """Read a literal ``COMMANDS`` dict from *filename* without importing it."""
+    try:
+        with open(filename, 'rb') as src:
+            tree = ast.parse(src.read(), filename)
+    except (OSError, SyntaxError, ValueError):
+        return None
+    commands: dict[str, str] | None = None
+    has_setup = False
+    for node in tree.body:
+        if isinstance(node, ast.FunctionDef) and node.name == 'setup_parser':
+            has_setup = True
+        elif isinstance(node, ast.Assign) and any(
+                isinstance(target, ast.Name) and target.id == 'COMMANDS' for target in node.targets):
+            try:
+                value = ast.literal_eval(node.value)
+            except ValueError:
+                return None
+            if not isinstance(value, dict):
+                return None
+            commands = {str(cmd): str(help_str) for cmd, help_str in value.items()}
+    return commands if has_setup else {}
+
+
+def _load_manifest(filename: str) -> dict[str, Any]:
+    try:
+        with open(filename) as manifest:
+            data = json.load(manifest)
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def _save_manifest(filename: str, data: dict[str, Any]):
+    if not op.isdir(op.dirname(filename)):
+        return
+    tmpname = f'{filename}.{os.getpid()}'
+    try:
+        with open(tmpname, 'w') as manifest:
+            json.dump(data, manifest, indent=1, sort_keys=True)
+        os.replace(tmpname, filename)
+    except OSError as exc:
+        logger.debug('Cannot write command manifest: %s', exc)
+
+
+def get_commands(venv_dir: str | None = None) -> dict[str, tuple[str, str]]:
+    """Return ``{command: (module, help)}`` for all configured modules.
+
+    Commands are read from module sources and cached in a manifest inside the venv, keyed by
+    source file mtimes, so no module is imported unless its ``COMMANDS`` is not a plain literal.
+    """
+    manifest_file = op.join(venv_dir, MANIFEST_FILE) if venv_dir else ''
+    manifest = _load_manifest(manifest_file) if manifest_file else {}
+    changed = False
+    res: dict[str, tuple[str, str]] = {}
+    for module in MODULES:
+        source = _find_source(module)
+        try:
+            mtime = os.stat(source).st_mtime_ns if source else None
+        except OSError:
+            mtime = None
+        entry = manifest.get(module)
+        if mtime is None or not entry or entry.get('file') != source or entry.get('mtime') != mtime:
+            commands = _read_commands(source) if source else None
+            if commands is None:
+                mod = import_module(module)
+                if not mod:
+                    continue
+                commands = dict(mod.COMMANDS) if hasattr(mod, 'COMMANDS') and hasattr(mod, 'setup_parser') else {}
+            elif mtime is not None:
+                manifest[module] = {'file': source, 'mtime': mtime, 'commands': commands}
+                changed = True
+        else:
+            commands = entry['commands']
+        res.update((cmd, (module, help_str)) for cmd, help_str in commands.items())
+    if changed:
+        _save_manifest(manifest_file, manifest)
+    return res
+
+
+class _LazySubParsersAction(argparse._SubParsersAction):
+    """Subparsers action importing the module owning a command only when it is chosen."""
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.lazy: dict[str, str] = {}
+
+    def setup(self, cmd: str):
+        module = self.lazy.pop(cmd, None)
+        if module is None:
+            return
+        mod = import_module(module)
+        if mod is None or not hasattr(mod, 'setup_parser'):
+            raise argparse.ArgumentError(self, f'cannot load module {module} for command {cmd}')
+        mod.setup_parser(cmd, self._name_parser_map[cmd])
+
+    def __call__(self, parser: argparse.ArgumentParser, namespace: argparse.Namespace,
+                 values: Any, option_string: str | None = None):
+        if values:
+            self.setup(values[0])
+        super().__call__(parser, namespace, values, option_string)
 
 
 def get_parser():
     rootdir = get_config_str('ROOTDIR')
+    venv_dir = op.join(rootdir, get_config_str('VENV.DIR'))
 
     parser = argparse.ArgumentParser(description=get_config_str('APPNAME'))
     parser.set_defaults(use_venv=True)
     parser.add_argument('-l', '--loglevel',
                         choices=('ERROR', 'WARNING', 'NOTICE', 'INFO', 'DEBUG'),
                         default='INFO', help='Logging level')
-    parser.add_argument('--venv', default=op.join(rootdir, get_config_str('VENV.DIR')),
+    parser.add_argument('--venv', default=venv_dir,
                         help='alternative virtualenv location')
+    parser.add_argument('--profile', action='store_true', default=False,
+                        help='profile startup and the command, write reports to var/profile/')
 
-    subparsers = parser.add_subparsers(dest='cmd', help='command')
+    subparsers = parser.add_subparsers(dest='cmd', help='command', action=_LazySubParsersAction)
     subparsers.required = True
 
-    for module in MODULES:
-        try:
-            mod = importlib.import_module(f'..{module}', __name__)
-        except ImportError:
-            try:
-                mod = importlib.import_module(f'..modules.{module}', __name__)
-            except ImportError as exc:
-                logger.error('Error loading module %s: %s', module, str(exc))
-                continue
-        if hasattr(mod, 'COMMANDS') and hasattr(mod, 'setup_parser'):
-            for cmd, help_str in mod.COMMANDS.items():
-                mod.setup_parser(cmd, subparsers.add_parser(cmd, help=help_str))
+    for cmd, (module, help_str) in get_commands(venv_dir).items():
+        subparsers.add_parser(cmd, help=help_str)
+        subparsers.lazy[cmd] = module
 
     return parser, subparsers
 
@@ -46,16 +178,26 @@ def main(parser: argparse.ArgumentParser | None = None, before: Callable[[argpar
             return f'''"{'" "'.join(val)}"'''
         return f'{arg}: {val!r}'
 
+    if not profiling.active() and profiling.requested(sys.argv[1:]):
+        sys.exit(profiling.wrap())
     if not parser:
-        parser = get_parser()[0]
-    args = parser.parse_args()
+        with profiling.phase('parser'):
+            parser = get_parser()[0]
+    with profiling.phase('parse'):
+        args = parser.parse_args()
     logging.getLogger().setLevel(getattr(logging, args.loglevel))
     if args.use_venv:
-        env.ensure_venv(args.venv)
+        from .modules import env
+
+        with profiling.phase('venv'):
+            env.ensure_venv(args.venv)
     if before:
         before(args)
     logger.info('Calling command: %s with args: %s', args.cmd,
                 ' '.join(show_arg(arg, val)
                          for arg, val in vars(args).items()
-                         if val and arg not in ('call', 'cmd', 'venv', 'loglevel', 'use_venv')))
-    args.call(args)
+                         if val and arg not in ('call', 'cmd', 'venv', 'loglevel', 'use_venv', 'profile')))
+    if profiling.active():
+        profiling.run_command(args.call, args, get_config_str('ROOTDIR'))
+    else:
+        args.call(args)
@@ -0,0 +1,159 @@
+"""Content-addressed store of ``BUILD_CMD`` outputs.
+
+Entries are keyed by the build command, the declared output paths and the contents of the files
+matched by the input globs. A hit replaces the outputs in the project tree with copies of the
+stored ones (never hardlinks: builds often rewrite their outputs in place).
+"""
+import glob
+import hashlib
+import json
+import os
+from os import path as op
+import shutil
+import tempfile
+import time
+from typing import Any
+
+from . import file_sha256, get_config_str, logger
+from .venvcache import META_SUFFIX, parse_size
+
+
+def store_dir():
+    return op.expanduser(get_config_str('INSTALL.BUILD_CACHE_DIR', '~/.cache/runlib/builds'))
+
+
+def store_budget():
+    try:
+        return parse_size(get_config_str('INSTALL.BUILD_CACHE_SIZE', '1G'))
+    except ValueError as exc:
+        logger.warning('%s, build cache disabled', exc)
+        return 0
+
+
+def expand(rootdir: str, patterns: list[str]):
+    """Return the sorted files (relative to *rootdir*) matched by *patterns*, directories taken whole."""
+    res: set[str] = set()
+    for pattern in patterns:
+        for match in glob.glob(pattern, root_dir=rootdir, recursive=True):
+            if op.isdir(op.join(rootdir, match)):
+                for dirpath, _, filenames in os.walk(op.join(rootdir, match)):
+                    res.update(op.relpath(op.join(dirpath, filename), rootdir) for filename in filenames)
+            else:
+                res.add(op.normpath(match))
+    return sorted(res)
+
+
+def cache_key(rootdir: str, command: str, inputs: list[str], outputs: list[str]):
+    digest = hashlib.sha256(f'{command}\n{" ".join(outputs)}\n'.encode('utf-8'))
+    for name in expand(rootdir, inputs):
+        filename = op.join(rootdir, name)
+        if not op.isfile(filename):
+            continue
+        digest.update(f'{name}\0{file_sha256(filename)}\n'.encode('utf-8'))
+    return digest.hexdigest()[:32]
+
+
+def _read_meta(key: str) -> dict[str, Any] | None:
+    try:
+        with open(op.join(store_dir(), key + META_SUFFIX)) as meta:
+            return json.load(meta)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_meta(key: str, meta: dict[str, Any]):
+    with open(op.join(store_dir(), key + META_SUFFIX), 'w') as meta_file:
+        json.dump(meta, meta_file)
+
+
+def _copy_files(src: str, dst: str, names: list[str]):
+    size = 0
+    for name in names:
+        target = op.join(dst, name)
+        os.makedirs(op.dirname(target), exist_ok=True)
+        shutil.copy2(op.join(src, name), target, follow_symlinks=False)
+        size += os.lstat(target).st_size
+    return size
+
+
+def restore(key: str, rootdir: str, outputs: list[str]):
+    """Replace the *outputs* in *rootdir* with cached entry *key*; return its metadata, or None on a miss.
+
+    The entry is copied next to the outputs first, so a damaged or vanishing entry leaves them untouched.
+    """
+    meta = _read_meta(key)
+    entry = op.join(store_dir(), key)
+    if not meta or not op.isdir(entry):
+        return None
+    tmp_dir = None
+    try:
+        tmp_dir = tempfile.mkdtemp(prefix='.runlib-build-', dir=rootdir)
+        _copy_files(entry, tmp_dir, meta['files'])
+        for pattern in outputs:
+            for match in glob.glob(pattern, root_dir=rootdir, recursive=True):
+                target = op.join(rootdir, match)
+                if op.isdir(target) and not op.islink(target):
+                    shutil.rmtree(target)
+                elif op.lexists(target):
+                    os.unlink(target)
+        for name in meta['files']:
+            os.makedirs(op.dirname(op.join(rootdir, name)), exist_ok=True)
+            os.replace(op.join(tmp_dir, name), op.join(rootdir, name))
+    except OSError as exc:
+        logger.warning('Cannot restore cached build %s: %s', key[:12], exc)
+        return None
+    finally:
+        if tmp_dir:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    meta['used'] = time.time()
+    try:
+        _write_meta(key, meta)
+    except OSError as exc:
+        logger.warning('Cannot update cached build %s: %s', key[:12], exc)
+    return meta
+
+
+def store(key: str, rootdir: str, outputs: list[str], build_time: float):
+    """Add the *outputs* just built in *rootdir* to the store and evict over the budget."""
+    budget = store_budget()
+    if not budget:
+        return
+    root = store_dir()
+    entry = op.join(root, key)
+    tmp_entry = f'{entry}.{os.getpid()}.tmp'
+    names = expand(rootdir, outputs)
+    if not names:
+        logger.warning('Build produced no files matching BUILD_OUTPUTS, not caching it')
+        return
+    try:
+        os.makedirs(root, exist_ok=True)
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+        size = _copy_files(rootdir, tmp_entry, names)
+        shutil.rmtree(entry, ignore_errors=True)
+        os.rename(tmp_entry, entry)
+        _write_meta(key, {'files': names, 'size': size, 'build_time': round(build_time, 3), 'used': time.time()})
+    except OSError as exc:
+        logger.warning('Cannot store build outputs in cache: %s', exc)
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+        return
+    evict(budget)
+
+
+def evict(budget: int):
+    """Remove least recently used store entries until the store fits in *budget* bytes."""
+    root = store_dir()
+    entries: list[tuple[float, int, str]] = []
+    for name in os.listdir(root):
+        if not name.endswith(META_SUFFIX):
+            continue
+        key = name[:-len(META_SUFFIX)]
+        meta = _read_meta(key) or {}
+        entries.append((meta.get('used', 0), meta.get('size', 0), key))
+    total = sum(size for _, size, _ in entries)
+    for _, size, key in sorted(entries)[:-1]:
+        if total <= budget:
+            break
+        logger.info('Evicting cached build: %s', key)
+        shutil.rmtree(op.join(root, key), ignore_errors=True)
+        os.unlink(op.join(root, key + META_SUFFIX))
+        total -= size
@@ -0,0 +1,46 @@
+echo "*** Relinking (blue-green) ***" >&2
+dstroot="{subdir}"
+dstdir="_installed_"
+stage="{stage}"
+envdir="{venv_dir}"
+blue_green=1
+
+cd "$dstroot"
+root=$PWD
+old_release=
+[[ -d "$stage" ]] && old_release=$(readlink -f "$stage")
+if which systemctl >/dev/null 2>&1 && [[ $(find "$dstdir/" -name '*.service' -print -quit) ]]; then
+    echo "Release has systemd units: they cannot run in two slots at once, use a plain relink" >&2
+    echo "$stage is left unchanged" >&2
+    exit 1
+fi
+set -e
+echo " ** Prepare cmd **" >&2
+{prepare_cmd}
+echo " ** Upgrade cmd **" >&2
+{upgrade_cmd}
+mkdir -p var/run
+old_slot=$(readlink var/run/uwsgi.socket | sed -n 's/^uwsgi\.\(.*\)\.socket$/\1/p')
+[[ $old_slot = blue ]] && new_slot=green || new_slot=blue
+export RUNLIB_SLOT=$new_slot
+echo " ** Start cmd **" >&2
+{start_cmd}
+echo " ** Ready cmd **" >&2
+if ! ./ctl ready; then
+    echo "Release in slot $new_slot is not ready, stopping it; $stage is left unchanged" >&2
+    {stop_cmd}
+    exit 1
+fi
+echo " ** Switch cmd **" >&2
+ln -sfn "uwsgi.$new_slot.socket" var/run/uwsgi.socket.new
+mv -Tfv var/run/uwsgi.socket.new var/run/uwsgi.socket
+ln -sfn "$real_dst" "$root/$stage.new"
+mv -Tfv "$root/$stage.new" "$root/$stage"
+{switch_cmd}
+set +e
+if [[ $old_release ]]; then
+    cd "$old_release"
+    export RUNLIB_SLOT=$old_slot
+    echo " ** Stop cmd **" >&2
+    {stop_cmd}
+fi
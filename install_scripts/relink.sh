@@ -7,6 +7,7 @@ envdir="{venv_dir}"
 cd "$dstroot"
 if [[ -d "$stage" ]]; then
     cd "$stage"
+    echo " ** Stop cmd **" >&2
     {stop_cmd}
     cd - >/dev/null
 fi
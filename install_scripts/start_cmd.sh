@@ -5,6 +5,8 @@ if which systemctl >/dev/null && [[ ${services[0]} ]]; then
     systemctl --user daemon-reload
     systemctl --user enable *.service
     systemctl --user start *.service
+elif ./ctl supervise -h >/dev/null 2>&1; then
+    ./ctl supervise start
 else
     ./ctl uwsgi start
 fi
@@ -2,6 +2,8 @@ services=($(find . -name '*.service'))
 if which systemctl >/dev/null && [[ ${services[0]} ]]; then
     systemctl --user status *.service
     systemctl --user stop *.service
+elif ./ctl supervise -h >/dev/null 2>&1; then
+    ./ctl supervise stop || ./ctl uwsgi stop
 else
     ./ctl uwsgi stop
 fi
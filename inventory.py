@@ -0,0 +1,81 @@
+"""In-process inventory of the packages installed in a virtualenv.
+
+Reads ``*.dist-info`` metadata from the venv's site-packages with ``importlib.metadata``
+and caches the result in the venv, keyed by the site-packages directory mtimes.
+"""
+import glob
+from importlib import metadata
+import json
+import os
+from os import path as op
+import re
+
+from . import logger
+
+
+CACHE_FILE = '.runlib-inventory.json'
+
+
+def canonical(name: str):
+    """Return PEP 503 normalized package *name*."""
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+
+def site_packages(envpath: str):
+    return sorted(glob.glob(op.join(envpath, 'lib', 'python*', 'site-packages')))
+
+
+def _scan_dirs(dirs: list[str]):
+    res: dict[str, tuple[str, str]] = {}
+    for dist in metadata.distributions(path=dirs):
+        name = dist.metadata['Name']
+        if name:
+            res.setdefault(canonical(name), (dist.version, name))
+    return res
+
+
+def installed(envpath: str) -> dict[str, tuple[str, str]]:
+    """Return ``{canonical name: (version, name)}`` for packages installed in *envpath*."""
+    dirs = site_packages(envpath)
+    mtimes = {}
+    for dirname in dirs:
+        try:
+            mtimes[dirname] = os.stat(dirname).st_mtime_ns
+        except OSError:
+            pass
+    cache_file = op.join(envpath, CACHE_FILE)
+    try:
+        with open(cache_file) as cache:
+            data = json.load(cache)
+        if data['mtimes'] == mtimes:
+            return {key: (version, name) for key, (version, name) in data['packages'].items()}
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    packages = _scan_dirs(dirs)
+    try:
+        tmpname = f'{cache_file}.{os.getpid()}'
+        with open(tmpname, 'w') as cache:
+            json.dump({'mtimes': mtimes, 'packages': packages}, cache)
+        os.replace(tmpname, cache_file)
+    except OSError as exc:
+        logger.debug('Cannot write inventory cache: %s', exc)
+    return packages
+
+
+def dependencies(envpath: str, names: set[str]) -> set[str]:
+    """Return canonical names of *names* and everything they transitively require in *envpath*."""
+    dists = {canonical(dist.metadata['Name'] or ''): dist
+             for dist in metadata.distributions(path=site_packages(envpath))}
+    res: set[str] = set()
+    pending = [canonical(name) for name in names]
+    while pending:
+        key = pending.pop()
+        if key in res or key not in dists:
+            continue
+        res.add(key)
+        for req in dists[key].requires or ():
+            if 'extra ==' not in req.partition(';')[2]:
+                match = re.match(r'\s*([A-Za-z0-9][A-Za-z0-9._-]*)', req)
+                if match:
+                    pending.append(canonical(match.group(1)))
+    return res
@@ -0,0 +1,317 @@
+"""HTTP load generator for the running app, and back-to-back comparison of deployed releases."""
+import asyncio
+from collections import Counter
+import json
+import math
+import os
+from os import path as op
+import random
+import signal
+import subprocess
+import sys
+from typing import Any, TYPE_CHECKING
+from urllib.parse import SplitResult, urlsplit
+if TYPE_CHECKING:
+    import argparse
+
+from .. import format_table, get_config_str, logger, readiness, MODULES
+from . import uwsgi
+
+
+COMMANDS = {'bench': 'Load test the running app'}
+
+PERCENTILES = (50, 90, 99, 99.9)
+BENCH_SLOT = 'bench'
+FAILURES = (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError)
+
+
+def parse_requests(lines: list[str]) -> list[tuple[str, str, float]]:
+    """Parse ``[METHOD] PATH [WEIGHT]`` lines into ``(method, path, weight)`` tuples."""
+    res = []
+    for line in lines:
+        parts = line.split()
+        if not parts:
+            continue
+        method = 'GET' if parts[0].startswith('/') else parts.pop(0).upper()
+        if not parts or not parts[0].startswith('/') or len(parts) > 2:
+            raise ValueError(f'Invalid request {line!r}, expected "[METHOD] PATH [WEIGHT]"')
+        res.append((method, parts[0], float(parts[1]) if len(parts) > 1 else 1.0))
+    return res
+
+
+def normalize_target(target: str):
+    """Return *target* as a URL: a bare path is a uwsgi socket, a bare host:port an HTTP server."""
+    if '://' in target:
+        return target
+    return f'uwsgi+unix://{target}' if target.startswith('/') else f'http://{target}'
+
+
+def default_target(rootdir: str):
+    if 'uwsgi' in MODULES:
+        return f'uwsgi+unix://{op.join(rootdir, "var", "run", uwsgi.FRONT_SOCKET)}'
+    return f'http://{get_config_str("SERVE.BIND", "127.0.0.1:8000")}'
+
+
+async def _open(url: SplitResult):
+    if url.scheme.endswith('+unix'):
+        return await asyncio.open_unix_connection(url.path)
+    return await asyncio.open_connection(url.hostname or 'localhost', url.port or 80)
+
+
+async def _http(conn: tuple[asyncio.StreamReader, asyncio.StreamWriter], host: str, method: str, path: str):
+    """Send one HTTP/1.1 request on *conn*; return the status and whether the connection can be reused."""
+    reader, writer = conn
+    writer.write(f'{method} {path} HTTP/1.1\r\nHost: {host}\r\nContent-Length: 0\r\n\r\n'.encode('latin-1'))
+    await writer.drain()
+    version, status_str, *_ = (await reader.readuntil(b'\r\n')).decode('latin-1').split(maxsplit=2) + ['']
+    status = int(status_str)
+    headers = {}
+    while (line := await reader.readuntil(b'\r\n')) != b'\r\n':
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip().lower()
+    keep_alive = headers.get('connection', 'keep-alive' if version == 'HTTP/1.1' else 'close') == 'keep-alive'
+    if method == 'HEAD' or status in (204, 304) or status < 200:
+        pass
+    elif 'chunked' in headers.get('transfer-encoding', ''):
+        while size := int((await reader.readuntil(b'\r\n')).split(b';')[0], 16):
+            await reader.readexactly(size + 2)
+        while await reader.readuntil(b'\r\n') != b'\r\n':
+            pass
+    elif 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    else:
+        while await reader.read(65536):
+            pass
+        keep_alive = False
+    return status, keep_alive
+
+
+async def _uwsgi(url: SplitResult, method: str, path: str):
+    """Send one request over the uwsgi protocol (one connection per request) and return its status."""
+    reader, writer = await _open(url)
+    try:
+        path, _, query = path.partition('?')
+        host = url.hostname or 'localhost'
+        writer.write(readiness.uwsgi_packet({
+            'REQUEST_METHOD': method, 'REQUEST_URI': path + (f'?{query}' if query else ''), 'PATH_INFO': path,
+            'QUERY_STRING': query, 'SERVER_PROTOCOL': 'HTTP/1.1', 'SERVER_NAME': host,
+            'SERVER_PORT': str(url.port or ''), 'HTTP_HOST': host, 'CONTENT_LENGTH': '0'}))
+        await writer.drain()
+        status = (await reader.readline()).split()
+        while await reader.read(65536):
+            pass
+    finally:
+        writer.close()
+    if len(status) < 2 or not status[1].isdigit():
+        raise ValueError('Invalid uwsgi response')
+    return int(status[1])
+
+
+async def _client(url: SplitResult, mix: list[tuple[str, str, float]], timeout: float, record_from: float,
+                  stop_at: float, results: list[tuple[int | str, float]]):
+    """Send requests picked from *mix* back to back until *stop_at*, recording those started after *record_from*."""
+    loop = asyncio.get_running_loop()
+    requests = [(method, path) for method, path, _ in mix]
+    weights = [weight for _, _, weight in mix]
+    host = 'localhost' if url.scheme.endswith('+unix') else url.netloc
+    conn = None
+    while (started := loop.time()) < stop_at:
+        method, path = random.choices(requests, weights)[0]
+        status: int | str
+        try:
+            if url.scheme.startswith('uwsgi'):
+                status = await asyncio.wait_for(_uwsgi(url, method, path), timeout)
+            else:
+                if conn is None:
+                    conn = await asyncio.wait_for(_open(url), timeout)
+                status, keep_alive = await asyncio.wait_for(_http(conn, host, method, path), timeout)
+                if not keep_alive:
+                    conn[1].close()
+                    conn = None
+        except FAILURES as exc:
+            status = type(exc).__name__
+            if conn is not None:
+                conn[1].close()
+                conn = None
+            await asyncio.sleep(0.01)
+        if started >= record_from:
+            results.append((status, loop.time() - started))
+    if conn is not None:
+        conn[1].close()
+
+
+def percentile(values: list[float], pct: float):
+    """Return the nearest-rank *pct* percentile of sorted *values* (None if there are none)."""
+    if not values:
+        return None
+    return values[max(0, math.ceil(pct / 100 * len(values)) - 1)]
+
+
+def summarize(results: list[tuple[int | str, float]], elapsed: float) -> dict[str, Any]:
+    """Return request count, errors (failures and 4xx/5xx), req/s, status counts and latency percentiles."""
+    latencies = sorted(latency for status, latency in results if isinstance(status, int))
+    latency_ms = {'mean': sum(latencies) / len(latencies) if latencies else None}
+    latency_ms.update((f'p{pct:g}', percentile(latencies, pct)) for pct in PERCENTILES)
+    latency_ms['max'] = latencies[-1] if latencies else None
+    return {
+        'requests': len(results),
+        'errors': sum(1 for status, _ in results if not isinstance(status, int) or status >= 400),
+        'elapsed': round(elapsed, 3),
+        'rps': round(len(results) / elapsed, 1) if elapsed > 0 else 0.0,
+        'statuses': dict(sorted(Counter(str(status) for status, _ in results).items())),
+        'latency_ms': {name: None if value is None else round(value * 1000, 3) for name, value in latency_ms.items()},
+    }
+
+
+def run(target: str, mix: list[tuple[str, str, float]], concurrency: int, duration: float, warmup: float,
+        timeout: float) -> dict[str, Any]:
+    """Load *target* with *concurrency* clients for *warmup* + *duration* seconds and summarize the measured part."""
+    url = urlsplit(target)
+    if url.scheme not in ('http', 'http+unix', 'uwsgi', 'uwsgi+unix'):
+        raise ValueError(f'Unsupported target {target!r}')
+    results: list[tuple[int | str, float]] = []
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        record_from = loop.time() + warmup
+        await asyncio.gather(*(_client(url, mix, timeout, record_from, record_from + duration, results)
+                               for _ in range(concurrency)))
+        return loop.time() - record_from
+
+    logger.info('Benchmarking %s: %s clients, %gs (+%gs warmup)', target, concurrency, duration, warmup)
+    elapsed = asyncio.run(main())
+    return {'target': target, 'concurrency': concurrency, **summarize(results, elapsed)}
+
+
+def _ms(value: float | None):
+    return '-' if value is None else f'{value:.2f}'
+
+
+def _format(report: dict[str, Any]):
+    return '\n'.join([
+        f'{report["target"]}: {report["requests"]} requests in {report["elapsed"]:.1f}s, '
+        f'{report["rps"]:.1f} req/s, {report["errors"]} errors',
+        'status: ' + '  '.join(f'{status}: {count}' for status, count in report['statuses'].items()),
+        'latency ms: ' + '  '.join(f'{name} {_ms(value)}' for name, value in report['latency_ms'].items())])
+
+
+def release_dir(rootdir: str, revision: str):
+    """Return the release directory of *revision*: a path, or a name in ``versions/``."""
+    if op.isdir(revision):
+        return op.realpath(revision)
+    parent = op.dirname(rootdir)
+    for versions in ((parent,) if op.basename(parent) == 'versions' else ()) + (op.join(rootdir, 'versions'),):
+        if op.isdir(op.join(versions, revision)):
+            return op.join(versions, revision)
+    raise ValueError(f'Release not found: {revision}')
+
+
+def bench_release(release: str, target: str, run_args: dict[str, Any], start_timeout: float):
+    """Start *release* in the bench slot, load test it and stop it again."""
+    uses_uwsgi = 'uwsgi' in MODULES
+    fmt = {'root': release, 'port': get_config_str('BENCH.PORT', '8765')}
+    start = get_config_str('BENCH.START_CMD', './ctl uwsgi start' if uses_uwsgi else './ctl serve -b 127.0.0.1:{port}')
+    stop = get_config_str('BENCH.STOP_CMD', './ctl uwsgi stop' if uses_uwsgi else '')
+    target = normalize_target(target.format(**fmt))
+    env = {**os.environ, uwsgi.SLOT_ENV: BENCH_SLOT}
+    pidfile = uwsgi.runtime_files(release, BENCH_SLOT)[0] if uses_uwsgi else None
+    logger.info('Starting %s', release)
+    proc = subprocess.Popen(start.format(**fmt), shell=True, cwd=release, env=env, start_new_session=True)
+    try:
+        if readiness.wait_for(lambda: proc.poll() not in (None, 0) or readiness.probe(target), start_timeout,
+                              f'{op.basename(release)} to become ready') is None or proc.poll() not in (None, 0):
+            raise RuntimeError(f'{release} did not start')
+        return run(target, **run_args)
+    finally:
+        pid = readiness.read_pid(pidfile) if pidfile else None
+        if stop:
+            subprocess.run(stop.format(**fmt), shell=True, cwd=release, env=env)
+        if pid:
+            readiness.wait_for(lambda: not readiness.pid_alive(pid), start_timeout, f'{op.basename(release)} to stop')
+        if proc.poll() is None:
+            os.killpg(proc.pid, signal.SIGTERM)
+            try:
+                proc.wait(start_timeout)
+            except subprocess.TimeoutExpired:
+                os.killpg(proc.pid, signal.SIGKILL)
+                proc.wait()
+        readiness.wait_for(lambda: readiness.socket_released(target), start_timeout, f'{target} to be released')
+
+
+def compare(old: dict[str, Any], new: dict[str, Any]):
+    """Return ``(rows, regression)``: metric rows with the relative change, and the worst regression in %."""
+    def change(before: float | None, after: float | None):
+        return None if not before or after is None else (after - before) / before * 100
+
+    rows = [('req/s', old['rps'], new['rps'], change(old['rps'], new['rps'])),
+            ('errors', old['errors'], new['errors'], None)]
+    rows.extend((f'{name} ms', value, new['latency_ms'][name], change(value, new['latency_ms'][name]))
+                for name, value in old['latency_ms'].items())
+    rps_drop = -(change(old['rps'], new['rps']) or 0)
+    p99_rise = change(old['latency_ms']['p99'], new['latency_ms']['p99']) or 0
+    return rows, max(rps_drop, p99_rise, 0)
+
+
+def _format_compare(names: tuple[str, str], rows: list[tuple[str, Any, Any, float | None]]):
+    table = [('METRIC', *names, 'CHANGE')]
+    table.extend((metric, *('-' if value is None else f'{value:g}' for value in (old, new)),
+                  '-' if delta is None else f'{delta:+.1f}%') for metric, old, new, delta in rows)
+    return '\n'.join(format_table(table, numeric=True))
+
+
+def cmd_bench(args: 'argparse.Namespace'):
+    rootdir = get_config_str('ROOTDIR')
+    lines = args.request or get_config_str('BENCH.REQUESTS').splitlines()
+    try:
+        run_args = {
+            'mix': parse_requests(lines) or [('GET', '/', 1.0)],
+            'concurrency': args.concurrency or int(get_config_str('BENCH.CONCURRENCY', '10')),
+            'duration': args.duration or float(get_config_str('BENCH.DURATION', '10')),
+            'warmup': args.warmup if args.warmup is not None else float(get_config_str('BENCH.WARMUP', '2')),
+            'timeout': args.timeout or float(get_config_str('BENCH.TIMEOUT', '10')),
+        }
+        if not args.compare:
+            report = run(normalize_target(args.target or get_config_str('BENCH.TARGET') or default_target(rootdir)),
+                         **run_args)
+            print(json.dumps(report) if args.json else _format(report))
+            return
+        uses_uwsgi = 'uwsgi' in MODULES
+        target = args.target or get_config_str(
+            'BENCH.RELEASE_TARGET',
+            f'uwsgi+unix://{{root}}/var/run/uwsgi.{BENCH_SLOT}.socket' if uses_uwsgi else 'http://127.0.0.1:{port}')
+        releases = [release_dir(rootdir, revision) for revision in args.compare]
+        reports = [bench_release(release, target, run_args, float(get_config_str('BENCH.START_TIMEOUT', '60')))
+                   for release in releases]
+    except (ValueError, RuntimeError, OSError) as exc:
+        logger.error('Benchmark failed: %s', exc)
+        sys.exit(1)
+    rows, regression = compare(*reports)
+    names = (op.basename(releases[0]), op.basename(releases[1]))
+    if args.json:
+        print(json.dumps({'releases': dict(zip(names, reports)), 'regression': round(regression, 1)}))
+    else:
+        print('\n\n'.join([*(_format(report) for report in reports), _format_compare(names, rows)]))
+    max_regression = args.max_regression if args.max_regression is not None else \
+        float(get_config_str('BENCH.MAX_REGRESSION', '0')) or None
+    if max_regression is not None and regression > max_regression:
+        logger.error('%s is %.1f%% slower than %s (limit: %g%%)', names[1], regression, names[0], max_regression)
+        sys.exit(1)
+
+
+def setup_parser(cmd: str, parser: 'argparse.ArgumentParser'):
+    parser.add_argument('target', nargs='?',
+                        help='http://host:port, http+unix:///socket, uwsgi://host:port or uwsgi+unix:///socket '
+                             '(default: BENCH.TARGET, the uwsgi socket or SERVE.BIND); with --compare, a template '
+                             'with {root} and {port}')
+    parser.add_argument('-c', '--concurrency', type=int, help='Concurrent connections (default: 10)')
+    parser.add_argument('-d', '--duration', type=float, help='Measured seconds (default: 10)')
+    parser.add_argument('-w', '--warmup', type=float, help='Unmeasured seconds before that (default: 2)')
+    parser.add_argument('-r', '--request', action='append',
+                        help='Request "[METHOD] PATH [WEIGHT]", repeatable (default: BENCH.REQUESTS lines or GET /)')
+    parser.add_argument('-t', '--timeout', type=float, help='Request timeout in seconds (default: 10)')
+    parser.add_argument('--json', action='store_true', default=False, help='Print the report as JSON')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+                        help='Start two releases (versions/<revision> or paths) in turn and compare them')
+    parser.add_argument('--max-regression', type=float, metavar='PCT',
+                        help='With --compare, fail if NEW loses more than PCT%% req/s or p99 latency')
+    parser.set_defaults(call=cmd_bench, use_venv=False)
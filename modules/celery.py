@@ -1,41 +1,197 @@
+import os
 from os import path as op
+import re
+import shlex
+import signal
 import subprocess
-from typing import TYPE_CHECKING
+import sys
+from typing import Any, TYPE_CHECKING
 if TYPE_CHECKING:
     import argparse
 
-from .. import get_config_str
+from .. import format_table, get_config_dict, get_config_str, logger, readiness
 
 
 COMMANDS = {'celery': 'Celery ops'}
 
+READY_RE = re.compile(rb'@\S+ ready\.')
+
+
+def _use_beat():
+    return get_config_str('CELERY.BEAT', 'y').strip().lower() in ('1', 'y', 'yes', 'true')
+
+
+def workers() -> dict[str, dict[str, str]]:
+    """Return ``{name: options}`` for ``CELERY.WORKERS`` (default: a single ``worker``).
+
+    Worker options (QUEUES, POOL, CONCURRENCY, AUTOSCALE, PREFETCH, ARGS) are read from the
+    ``[CELERY]`` section, overridden by the worker's own ``[CELERY_<name>]`` section.
+    """
+    config = get_config_dict('CELERY.')
+    names = [name for name in re.split(r'[\s,]+', config.get('WORKERS', '')) if name] or ['worker']
+    return {name: {**config, **get_config_dict(f'CELERY_{name}.')} for name in names}
+
+
+def _csv(value: str):
+    return ','.join(elem for elem in re.split(r'[\s,]+', value) if elem)
+
+
+def worker_args(name: str, options: dict[str, str]):
+    """Return celery worker command line options for worker *name*."""
+    res = ['-n', f'{name}@%h']
+    if options.get('QUEUES'):
+        res.extend(['-Q', _csv(options['QUEUES'])])
+    if options.get('POOL'):
+        res.extend(['-P', options['POOL']])
+    if options.get('AUTOSCALE'):
+        res.append(f'--autoscale={_csv(options["AUTOSCALE"])}')
+    elif options.get('CONCURRENCY'):
+        res.extend(['-c', options['CONCURRENCY']])
+    if options.get('PREFETCH'):
+        res.append(f'--prefetch-multiplier={options["PREFETCH"]}')
+    res.extend(shlex.split(options.get('ARGS', '')))
+    return res
+
+
+def services(ctl: list[str]) -> dict[str, dict[str, Any]]:
+    """Services run by ``ctl supervise``: the workers (warm shutdown on SIGTERM) and, if enabled, beat."""
+    res: dict[str, dict[str, Any]] = {
+        f'celery-{name}': {'command': ctl + ['celery', 'worker', name],
+                           'stop_signal': signal.SIGTERM, 'reload_signal': signal.SIGHUP}
+        for name in workers()}
+    if _use_beat():
+        res['celery-beat'] = {'command': ctl + ['celery', 'beat'], 'stop_signal': signal.SIGTERM, 'reload_signal': None}
+    return res
+
+
+def _running_pid(pidfile: str):
+    pid = readiness.read_pid(pidfile)
+    return pid if pid and readiness.pid_alive(pid) else None
+
+
+def _log_size(logfile: str):
+    try:
+        return os.path.getsize(logfile)
+    except OSError:
+        return 0
+
+
+def _start(objname: str, loglevel: str, pidfiles: dict[str, str], logfiles: dict[str, str],
+           commands: dict[str, list[str]], timeout: float):
+    """Launch detached *commands* concurrently and wait until the workers log that they are ready.
+
+    The ready line is logged at INFO, so workers log at INFO even when a less verbose *loglevel* is given.
+    """
+    loglevel = 'DEBUG' if loglevel == 'DEBUG' else 'INFO'
+    procs: dict[str, subprocess.Popen[bytes]] = {}
+    offsets: dict[str, int] = {}
+    for name, extra in commands.items():
+        if _running_pid(pidfiles[name]):
+            logger.info('Celery %s already running', name)
+            continue
+        offsets[name] = _log_size(logfiles[name])
+        procs[name] = subprocess.Popen([
+            'celery', '-A', objname, 'beat' if name == 'beat' else 'worker', f'--loglevel={loglevel}',
+            f'--pidfile={pidfiles[name]}', f'--logfile={logfiles[name]}', *extra, '--detach'])
+    failed = [name for name, proc in procs.items() if proc.wait() != 0]
+    pending = {name for name in procs if name not in failed}
+
+    def check():
+        for name in list(pending):
+            pid = readiness.read_pid(pidfiles[name])
+            if name == 'beat':
+                ready = bool(pid and readiness.pid_alive(pid))
+            else:
+                try:
+                    with open(logfiles[name], 'rb') as log:
+                        log.seek(offsets[name])
+                        ready = bool(READY_RE.search(log.read()))
+                except OSError:
+                    ready = False
+                if not ready and pid and not readiness.pid_alive(pid):
+                    failed.append(name)
+                    pending.discard(name)
+                    continue
+            if ready:
+                logger.info('Celery %s ready (pid %s)', name, pid)
+                pending.discard(name)
+        return not pending
+
+    if readiness.wait_for(check, timeout, f'celery {" ".join(sorted(pending))} to become ready') is None:
+        failed.extend(pending)
+    if failed:
+        logger.error('Celery start failed: %s (see var/log)', ' '.join(failed))
+        sys.exit(1)
+
+
+def _stop(pidfiles: dict[str, str], timeout: float):
+    """Send SIGTERM (warm shutdown) to all running processes at once and wait for them to exit."""
+    pids = {name: pid for name, pidfile in pidfiles.items() if (pid := _running_pid(pidfile))}
+    for name, pid in pids.items():
+        logger.info('Stopping celery %s (pid %s)', name, pid)
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    if readiness.wait_for(lambda: not any(readiness.pid_alive(pid) for pid in pids.values()), timeout,
+                          f'celery {" ".join(pids)} to stop') is None:
+        sys.exit(1)
+
+
+def _print_status(pidfiles: dict[str, str], options: dict[str, dict[str, str]]):
+    rows = [('NAME', 'STATE', 'PID', 'UPTIME', 'RSS MB', 'PROCS', 'QUEUES')]
+    for name, pidfile in pidfiles.items():
+        pid = _running_pid(pidfile)
+        if not pid:
+            rows.append((name, 'stopped', '-', '-', '-', '-', options.get(name, {}).get('QUEUES', '')))
+            continue
+        pids = [pid] + readiness.child_pids(pid)
+        rss = sum(readiness.memory_usage(proc).get('rss', 0) for proc in pids)
+        uptime = readiness.process_uptime(pid)
+        rows.append((name, 'running', str(pid), '-' if uptime is None else f'{uptime:.0f}s', f'{rss / 2**20:.1f}',
+                     str(len(pids)), options.get(name, {}).get('QUEUES', '')))
+    print('\n'.join(format_table(rows)))
+
 
 def cmd_celery(args: 'argparse.Namespace'):
     here = get_config_str('ROOTDIR')
     objname = get_config_str('CELERY.OBJECT', 'app.celery')
-    use_beat = get_config_str('CELERY.BEAT', 'y').strip().lower() in ('1', 'y', 'yes', 'true')
+    use_beat = _use_beat()
+    options = workers()
 
     piddir = op.join(here, 'var', 'run')
     logdir = op.join(here, 'var', 'log')
-    pidfiles = {'worker': op.join(piddir, 'celery-worker.pid'), 'beat': op.join(logdir, 'celery-beat.pid')}
-    logfiles = {'worker': op.join(logdir, 'celery-worker.log'), 'beat': op.join(logdir, 'celery-beat.log')}
-    if args.operation == 'start':
-        subprocess.check_call([
-            'celery', '-A', objname, 'multi', 'start', 'worker',
-            f'--loglevel={args.loglevel}', f'--pidfile={pidfiles["worker"]}', f'--logfile={logfiles["worker"]}'])
+    names = list(options) + (['beat'] if use_beat else [])
+    pidfiles = {name: op.join(piddir, f'celery-{name}.pid') for name in names}
+    logfiles = {name: op.join(logdir, f'celery-{name}.log') for name in names}
+    beat_args = ['--max-interval', '30', '-s', f'{op.join(piddir, "celery-beat")}']
+    if args.operation in ('worker', 'beat'):
+        name = args.name or ('beat' if args.operation == 'beat' else next(iter(options)))
+        if args.operation == 'worker' and name not in options:
+            logger.error('Unknown celery worker: %s (configured: %s)', name, ' '.join(options))
+            sys.exit(1)
+        os.makedirs(piddir, mode=0o755, exist_ok=True)
+        call = ['celery', '-A', objname, args.operation, f'--loglevel={args.loglevel}',
+                f'--pidfile={pidfiles.get(name, op.join(piddir, f"celery-{name}.pid"))}']
+        call.extend(beat_args if args.operation == 'beat' else worker_args(name, options[name]))
+        sys.stdout.flush()
+        os.execvp(call[0], call)
+    elif args.operation == 'start':
+        os.makedirs(piddir, mode=0o755, exist_ok=True)
+        os.makedirs(logdir, mode=0o755, exist_ok=True)
+        commands = {name: worker_args(name, worker) for name, worker in options.items()}
         if use_beat:
-            subprocess.check_call([
-                'celery', '-A', objname, 'beat',
-                f'--loglevel={args.loglevel}', f'--pidfile={pidfiles["beat"]}', f'--logfile={logfiles["beat"]}',
-                '--max-interval', '30', '-s', f'{op.join(piddir, "celery-beat")}', '--detach'])
+            commands['beat'] = beat_args
+        _start(objname, args.loglevel, pidfiles, logfiles, commands,
+               float(get_config_str('CELERY.READY_TIMEOUT', '60')))
+    elif args.operation == 'stop':
+        _stop(pidfiles, float(get_config_str('CELERY.STOP_TIMEOUT', '60')))
     else:
-        if use_beat:
-            subprocess.check_call(['pkill', '-F', pidfiles["beat"]])
-        subprocess.check_call([
-            'celery', '-A', objname, 'multi', 'stop', 'worker',
-            f'--pidfile={pidfiles["worker"]}', f'--logfile={logfiles["worker"]}'])
+        _print_status(pidfiles, options)
 
 
 def setup_parser(cmd: str, parser: 'argparse.ArgumentParser'):
-    parser.add_argument('operation', choices=('start', 'stop'))
+    parser.add_argument('operation', choices=('start', 'stop', 'status', 'worker', 'beat'),
+                        help='start/stop/status of detached processes, or run a worker or beat in the foreground')
+    parser.add_argument('name', nargs='?', help='Worker name for the worker operation (default: the first one)')
     parser.set_defaults(call=cmd_celery)
@@ -1,4 +1,6 @@
 import importlib
+import os
+from os import path as op
 import subprocess
 import sys
 from typing import TYPE_CHECKING
@@ -6,6 +8,7 @@ if TYPE_CHECKING:
     import argparse
 
 from .. import logger
+from . import zygote
 
 
 COMMANDS = {'admin': 'Django admin CLI utility', 'manage': 'Django manage.py utility',
@@ -26,6 +29,28 @@ def cmd_manage(args: list[str]):
     manager.main()
 
 
+def zygote_commands():
+    """Import manage.py (and set Django up if DJANGO_SETTINGS_MODULE is set) for the zygote."""
+    importlib.import_module('manage')
+    if os.environ.get('DJANGO_SETTINGS_MODULE'):
+        import django
+        from django.core.management import get_commands
+
+        django.setup()
+        get_commands()
+    return {'manage': cmd_manage}
+
+
+def zygote_watch():
+    """Return the directories Django looks for management commands in, so a new command restarts the zygote."""
+    if not os.environ.get('DJANGO_SETTINGS_MODULE'):
+        return []
+    from django.apps import apps
+
+    return [path for app in apps.get_app_configs()
+            for path in (op.join(app.path, 'management'), op.join(app.path, 'management', 'commands'))]
+
+
 def cmd_run(args: 'argparse.Namespace'):
     cmd_manage(['runserver'] + args.arg)
 
@@ -36,6 +61,9 @@ def setup_parser(cmd: str, parser: 'argparse.ArgumentParser'):
         parser.set_defaults(call=cmd_admin)
     elif cmd == 'manage':
         def dfl(args: 'argparse.Namespace'):
+            code = zygote.call('manage', args.arg)
+            if code is not None:
+                sys.exit(code)
             return cmd_manage(args.arg)
 
         parser.add_argument('arg', nargs='*')
@@ -1,17 +1,85 @@
+from concurrent.futures import ProcessPoolExecutor
+import compileall
+import functools
+import hashlib
+import json
 import os
 from os import path as op
+import re
+from shlex import quote
+import py_compile
 import subprocess
 import sys
+import sysconfig
+import tempfile
+import time
 from typing import TYPE_CHECKING
 import venv
 if TYPE_CHECKING:
     import argparse
 
 
-from .. import get_config_str, logger
+from .. import file_sha256, get_config_str, inventory, logger, profiling, requirements, venvcache
+from ..inventory import canonical
 
 
 COMMANDS = {'env': 'Virtualenv management'}
+LOCK_STAMP_FILE = '.runlib-lock-stamp'
+UNLOCKED_PACKAGES = {'pip', 'setuptools', 'wheel'}
+INVALIDATION_MODES = {mode.name.lower().replace('_', '-'): mode for mode in py_compile.PycInvalidationMode}
+COMPILE_SKIP_DIRS = {'.git', '__pycache__'}
+COMPILE_SKIP_RELEASE_DIRS = ('node_modules', 'var')
+WHEELHOUSE_MANIFEST = 'SHA256SUMS'
+HASH_OPTION_RE = re.compile(r'[ \t]*(?:\\\n[ \t]*)?--hash=\S+')
+
+
+def wheelhouse_dir():
+    wheelhouse = op.join(get_config_str('ROOTDIR'), get_config_str('VENV.WHEELHOUSE', '.wheelhouse'))
+    return wheelhouse if op.isdir(wheelhouse) else None
+
+
+def wheelhouse_args():
+    """Return pip options installing offline from the shipped wheelhouse, if there is one."""
+    wheelhouse = wheelhouse_dir()
+    if wheelhouse:
+        logger.info('Installing from wheelhouse: %s', wheelhouse)
+        return ['--no-index', '--find-links', wheelhouse]
+    return []
+
+
+def _wheelhouse_files(wheelhouse: str):
+    return sorted(name for name in os.listdir(wheelhouse) if name not in (WHEELHOUSE_MANIFEST, '.complete'))
+
+
+def write_wheelhouse_manifest(wheelhouse: str, source: str):
+    """Record the sha256 of the wheels in *wheelhouse* and of the requirements file *source* they come from.
+
+    Locally built wheels (sdist-only packages) and ``pip download --platform`` picks are not the
+    archives hashed in the lockfile, so installs from the wheelhouse are checked against this instead.
+    """
+    lines = [f'# source: {file_sha256(source)}\n']
+    lines.extend(f'{file_sha256(op.join(wheelhouse, name))}  {name}\n' for name in _wheelhouse_files(wheelhouse))
+    with open(op.join(wheelhouse, WHEELHOUSE_MANIFEST), 'w') as manifest:
+        manifest.write(''.join(lines))
+
+
+def check_wheelhouse(wheelhouse: str, source: str):
+    """Raise ValueError unless *wheelhouse* matches its manifest and was built from *source*."""
+    try:
+        with open(op.join(wheelhouse, WHEELHOUSE_MANIFEST)) as manifest:
+            lines = manifest.read().splitlines()
+    except OSError as exc:
+        raise ValueError(f'Cannot read wheelhouse manifest: {exc}') from exc
+    if not lines or lines[0] != f'# source: {file_sha256(source)}':
+        raise ValueError(f'Wheelhouse {wheelhouse} was not built from {source}')
+    expected = {name: digest for digest, name in (line.split('  ', 1) for line in lines[1:] if line)}
+    found = _wheelhouse_files(wheelhouse)
+    if sorted(expected) != found:
+        raise ValueError(f'Wheelhouse {wheelhouse} files differ from its manifest: '
+                         f'{" ".join(sorted(set(expected).symmetric_difference(found)))}')
+    for name in found:
+        if file_sha256(op.join(wheelhouse, name)) != expected[name]:
+            raise ValueError(f'Wheelhouse file {name} does not match its manifest hash')
 
 
 def _find_or_create_venv(envpath: str):
@@ -20,13 +88,19 @@ def _find_or_create_venv(envpath: str):
     if not envpath.startswith('/'):
         envpath = op.join(rootdir, envpath)
     if not op.isdir(envpath):
+        req_file = op.join(rootdir, get_config_str('VENV.REQUIREMENTS', 'requirements.txt'))
+        key = venvcache.cache_key(req_file) if venvcache.store_budget() else None
+        if key and venvcache.restore(key, envpath):
+            return envpath
         logger.info('Virtual env not found, creating.')
         venv.create(envpath, with_pip=True)
-        subprocess.check_call([op.join(envpath, 'bin', 'python'), '-m', 'pip', 'install', '--upgrade', 'pip'])
-        req_file = op.join(rootdir, 'requirements.txt')
+        pip_install = [op.join(envpath, 'bin', 'python'), '-m', 'pip', 'install'] + wheelhouse_args()
+        subprocess.check_call(pip_install + ['--upgrade', 'pip'])
         if op.isfile(req_file):
-            subprocess.check_call([op.join(envpath, 'bin', 'python'), '-m', 'pip', 'install', 'wheel'])
-            subprocess.check_call([op.join(envpath, 'bin', 'python'), '-m', 'pip', 'install', '-r', req_file])
+            subprocess.check_call(pip_install + ['wheel'])
+            subprocess.check_call(pip_install + ['-r', req_file])
+        if key:
+            venvcache.store(key, envpath)
     return envpath
 
 
@@ -41,11 +115,79 @@ def _add_path(var: str | None, *args: str):
     return ':'.join(res)
 
 
+LAUNCHER_TEMPLATE = """#!/bin/sh
+# Generated by runlib on venv entry, do not edit.
+ROOTDIR={rootdir}
+VENV={envpath}
+DEFAULT_SCRIPT={script}
+SCRIPT="${{RUNLIB_SCRIPT:-$DEFAULT_SCRIPT}}"
+FINGERPRINT={fingerprint}
+unset RUNLIB_SCRIPT
+if [ "$(cd "${{0%/*}}" 2>/dev/null && pwd -P)" = {bindir} ] \\
+        && [ "$(cd "${{SCRIPT%/*}}" 2>/dev/null && pwd -P)" = "$ROOTDIR" ] \\
+        && [ "$(stat -L -c '%n:%s:%Y' {fingerprint_files} 2>/dev/null)" = "$FINGERPRINT" ]; then
+    PATH="$VENV/bin${{PATH:+:$PATH}}"
+    PYTHONPATH="$ROOTDIR${{PYTHONPATH:+:$PYTHONPATH}}"
+    VIRTUAL_ENV="$VENV"
+    export PATH PYTHONPATH VIRTUAL_ENV
+    unset PYTHONHOME
+    exec {interpreter} "$SCRIPT" "$@"
+fi
+exec python3 "$SCRIPT" "$@"
+"""
+
+
+def _fingerprint(*files: str):
+    """Fingerprint *files* the way ``stat -L -c '%n:%s:%Y'`` prints them."""
+    res: list[str] = []
+    for filename in files:
+        stat = os.stat(filename)
+        res.append(f'{filename}:{stat.st_size}:{int(stat.st_mtime)}')
+    return '\n'.join(res)
+
+
+def update_launcher(envpath: str):
+    """Write the ``bin/ctl`` launcher shim, letting the entry script exec straight into the venv."""
+    if not op.isfile(sys.argv[0]):
+        return
+    rootdir = get_config_str('ROOTDIR')
+    script = op.realpath(sys.argv[0])
+    interpreter = op.join(envpath, 'bin', 'python')
+    launcher = op.join(envpath, 'bin', 'ctl')
+    files = (op.join(rootdir, get_config_str('CONFIG', 'config.ini')), interpreter)
+    try:
+        content = LAUNCHER_TEMPLATE.format(
+            rootdir=quote(rootdir), envpath=quote(envpath), script=quote(script),
+            fingerprint=quote(_fingerprint(*files)), fingerprint_files=' '.join(quote(name) for name in files),
+            bindir=quote(op.realpath(op.join(envpath, 'bin'))), interpreter=quote(interpreter))
+    except OSError as exc:
+        logger.debug('Cannot fingerprint launcher files: %s', exc)
+        return
+    try:
+        with open(launcher) as current:
+            if current.read() == content:
+                return
+    except OSError:
+        pass
+    logger.debug('Writing launcher: %s', launcher)
+    try:
+        tmpname = f'{launcher}.{os.getpid()}'
+        with open(tmpname, 'w') as shim:
+            shim.write(content)
+        os.chmod(tmpname, 0o755)
+        os.replace(tmpname, launcher)
+    except OSError as exc:
+        logger.warning('Cannot write launcher %s: %s', launcher, exc)
+
+
 def ensure_venv(envpath: str):
     current_env = os.environ.get('VIRTUAL_ENV', '')
-    if not current_env or current_env != envpath:
+    if current_env and current_env == envpath:
+        update_launcher(envpath)
+    else:
         logger.info('Not in venv, entering.')
         envpath = _find_or_create_venv(envpath)
+        update_launcher(envpath)
         interpreter = op.join(envpath, 'bin', 'python')
         if interpreter == sys.executable:
             raise RuntimeError(f'Already using interpreter: {interpreter}')
@@ -55,6 +197,7 @@ def ensure_venv(envpath: str):
         env['VIRTUAL_ENV'] = envpath
         env.pop('PYTHONHOME', None)
 
+        env.update(profiling.exec_env())
         logger.debug('Calling: %s with args: %r', interpreter, sys.argv)
         os.execle(interpreter, 'python', *sys.argv, env)
 
@@ -81,81 +224,269 @@ export PATH={os.environ["PATH"]}\n'''
         os.close(wsync)
 
 
-def subcmd_freeze(req_filename: str, requirements: dict[str, tuple[str, str]], req_lines: list[tuple[str, str, str]]):
-    for line in subprocess.check_output(['pip', 'freeze']).decode('utf-8').split('\n'):
-        name, _, version = line.strip().partition('==')
-        lower = name.lower()
-        if lower in requirements:
-            logger.debug('Found requirement: %s==%s', name, version)
-            requirements[lower] = (version, name)
-    with open(req_filename, 'w') as req_file:
-        for line, name, version in req_lines:
-            if name:
-                lower = name.lower()
-                version, orig = requirements.get(lower, (None, None))
-                if version is not None:
-                    req_file.write(f'{orig}=={version}\n' if version else f'{orig}\n')
-                else:
-                    req_file.write(f'{name}\n')
-            else:
-                req_file.write(line)
-
-
-def subcmd_add(req_filename: str, requirements: dict[str, tuple[str, str]], req_lines: list[tuple[str, str, str]], pkg: str, update: bool = False):
-    name = pkg.partition('==')[0]
-
-    added = True
-    idx = 0
-    for idx, (line, lname, lversion) in enumerate(req_lines):
-        if name.lower() <= lname.lower():
-            if name.lower() == lname.lower():
-                logger.info('Package already present in requirements, upgrading')
-                prev_entry = lname if not lversion else f'{lname}=={lversion}'
-                req_lines[idx] = (line.replace(prev_entry, pkg), lname, lversion)
-                added = False
-            break
-    if not update:
-        subprocess.check_call(['python', '-m', 'pip', 'install', '--upgrade', pkg])
-    with open(req_filename, 'w') as req_file:
-        if idx > 0:
-            req_file.write(''.join(line for line, _, _ in req_lines[:idx]))
-        if added:
-            req_file.write(f'{pkg}\n')
-        req_file.write(''.join(line for line, _, _ in req_lines[idx:]))
+def _write_changed(files: dict[str, list[requirements.Requirement]], changed: set[str]):
+    for filename in files:
+        if filename in changed:
+            logger.debug('Writing requirements file: %s', filename)
+            requirements.write(filename, files[filename])
+
+
+def subcmd_freeze(files: dict[str, list[requirements.Requirement]], packages: dict[str, tuple[str, str]]):
+    changed = set[str]()
+    for filename, lines in files.items():
+        for idx, req in enumerate(lines):
+            if req.name and req.key in packages:
+                version, name = packages[req.key]
+                logger.debug('Found requirement: %s==%s', name, version)
+                frozen = req.replace_spec(spec=f'=={version}')
+                if frozen.line != req.line:
+                    lines[idx] = frozen
+                    changed.add(filename)
+    _write_changed(files, changed)
+
+
+def subcmd_list(files: dict[str, list[requirements.Requirement]], packages: dict[str, tuple[str, str]],
+                show_all: bool = False):
+    reqs = requirements.entries(files)
+    if not reqs and not show_all:
+        print("(requirements empty)")
+        return
+    for key, (_, req) in reqs.items():
+        installed_version = packages.get(key, (None, None))[0]
+        line = req.format()
+        if installed_version is None:
+            line += ' (not installed)'
+        elif (req.version and req.version != installed_version) or (not req.version and show_all):
+            line += f' (installed: {installed_version})'
+        print(line)
+    if show_all:
+        for key, (version, name) in sorted(packages.items()):
+            if key not in reqs:
+                print(f'{name}=={version} (not in requirements)')
+
+
+def subcmd_add(req_filename: str, files: dict[str, list[requirements.Requirement]],
+               packages: dict[str, tuple[str, str]], pkgs: list[str], update: bool = False):
+    reqs = requirements.entries(files)
+    changed = set[str]()
+    to_install: list[requirements.Requirement] = []
+    for pkg in pkgs:
+        req = requirements.parse(pkg)
+        filename = reqs[req.key][0] if req.key in reqs else op.abspath(req_filename)
+        if not requirements.add(files.setdefault(filename, []), req):
+            logger.info('Package %s already present in requirements, upgrading', req.name)
+        changed.add(filename)
+        if req.version and not req.extras and packages.get(req.key, (None, None))[0] == req.version:
+            logger.info('Package %s==%s already installed', req.name, req.version)
+        else:
+            to_install.append(req)
+    if not update and to_install:
+        subprocess.check_call(['python', '-m', 'pip', 'install', '--upgrade'] + [req.format() for req in to_install])
+        installed = inventory.installed(sys.prefix)
+        for req in to_install:
+            if req.key not in installed:
+                logger.warning('Package %s not found in virtualenv after installing', req.name)
+    _write_changed(files, changed)
     if update:
         os.execlp('python', 'python', '-m', 'pip', 'install', '-r', req_filename)
 
 
-def subcmd_rm(req_filename: str, requirements: dict[str, tuple[str, str]], req_lines: list[tuple[str, str, str]], pkg: str, update: bool = False):
-    if pkg.lower() not in requirements:
-        logger.warning('Package not found: %s', pkg)
-    else:
-        subprocess.check_call(['python', '-m', 'pip', 'uninstall', pkg])
-        with open(req_filename, 'w') as req_file:
-            req_file.write(''.join(
-                line
-                for line, name, _ in req_lines
-                if name.lower() != pkg.lower()))
+def subcmd_rm(req_filename: str, files: dict[str, list[requirements.Requirement]],
+              packages: dict[str, tuple[str, str]], pkgs: list[str], update: bool = False):
+    reqs = requirements.entries(files)
+    changed = set[str]()
+    to_uninstall: list[str] = []
+    for pkg in pkgs:
+        key = canonical(pkg)
+        if key not in reqs:
+            logger.warning('Package not found: %s', pkg)
+            continue
+        filename, req = reqs[key]
+        requirements.remove(files[filename], key)
+        changed.add(filename)
+        if key in packages:
+            to_uninstall.append(req.name)
+        else:
+            logger.warning('Package %s is not installed, removing from requirements only', pkg)
+    if to_uninstall:
+        subprocess.check_call(['python', '-m', 'pip', 'uninstall'] + to_uninstall)
+    _write_changed(files, changed)
     if update:
         os.execlp('python', 'python', '-m', 'pip', 'install', '-r', req_filename)
 
 
+def _lock_stamp(lock_filename: str):
+    digest = hashlib.sha256(f'{sys.version}\n{op.realpath(sys.base_prefix)}\n'.encode('utf-8'))
+    with open(lock_filename, 'rb') as lock_file:
+        digest.update(lock_file.read())
+    return digest.hexdigest()
+
+
+def _requirements_hash(files: dict[str, list[requirements.Requirement]]):
+    digest = hashlib.sha256()
+    for lines in files.values():
+        for req in lines:
+            if req.name or (req.line.strip() and not req.line.lstrip().startswith('#') and not req.include):
+                digest.update(f'{req.format() if req.name else req.line.strip()}\n'.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def subcmd_lock(req_filename: str, lock_filename: str, files: dict[str, list[requirements.Requirement]]):
+    report = json.loads(subprocess.check_output([
+        'python', '-m', 'pip', 'install', '--dry-run', '--ignore-installed', '--quiet', '--report', '-',
+        '-r', req_filename]))
+    entries: list[tuple[str, str, list[str]]] = []
+    for item in report.get('install', []):
+        name, version = item['metadata']['name'], item['metadata']['version']
+        info = item.get('download_info', {})
+        archive = info.get('archive_info')
+        if item.get('is_direct') or archive is None:
+            entries.append((f'{name} @ {info["url"]}', name, []))
+            continue
+        hashes = archive.get('hashes') or dict([archive['hash'].split('=', 1)] if archive.get('hash') else [])
+        entries.append((f'{name}=={version}', name, [f'{algo}:{value}' for algo, value in sorted(hashes.items())]))
+    hashed = all(hashes for _, _, hashes in entries)
+    if not hashed:
+        logger.warning('Some requirements have no archive hash (local or VCS), writing lockfile without hashes')
+    lines = [f'# Generated by "ctl env lock", do not edit.\n# requirements: {_requirements_hash(files)}\n']
+    for spec, _, hashes in sorted(entries, key=lambda entry: canonical(entry[1])):
+        lines.append(''.join([spec] + [f' \\\n    --hash={elem}' for elem in hashes if hashed]) + '\n')
+    requirements.write(lock_filename, [requirements.Requirement(line) for line in lines])
+    logger.info('Locked %s packages in %s', len(entries), lock_filename)
+
+
+def _prune(envpath: str, lock_data: str):
+    """Uninstall packages that are neither in the lockfile nor needed by pip and its tooling."""
+    locked = {canonical(match.group(1)) for match in re.finditer(r'^([A-Za-z0-9][A-Za-z0-9._-]*)\s*(?:==| @ )',
+                                                                  lock_data, re.MULTILINE)}
+    kept = locked | inventory.dependencies(envpath, UNLOCKED_PACKAGES)
+    extra = [name for key, (_, name) in inventory.installed(envpath).items() if key not in kept]
+    if extra:
+        logger.info('Removing packages not in lockfile: %s', ' '.join(extra))
+        subprocess.check_call(['python', '-m', 'pip', 'uninstall', '--yes'] + extra)
+
+
+def subcmd_update(req_filename: str, lock_filename: str, envpath: str,
+                  files: dict[str, list[requirements.Requirement]], force: bool = False, prune: bool = False):
+    """Install the lockfile (or requirements) into the venv; with *prune*, uninstall packages not in the lockfile."""
+    wheelhouse = wheelhouse_dir()
+    try:
+        if wheelhouse:
+            check_wheelhouse(wheelhouse, lock_filename if op.isfile(lock_filename) else req_filename)
+    except ValueError as exc:
+        logger.error('%s', exc)
+        sys.exit(1)
+    if not op.isfile(lock_filename):
+        os.execlp('python', 'python', '-m', 'pip', 'install', *wheelhouse_args(), '-r', req_filename)
+    with open(lock_filename) as lock_file:
+        lock_data = lock_file.read()
+    if f'# requirements: {_requirements_hash(files)}\n' not in lock_data:
+        logger.warning('Lockfile %s is out of date with requirements, installing from %s; run "env lock"',
+                       lock_filename, req_filename)
+        os.execlp('python', 'python', '-m', 'pip', 'install', *wheelhouse_args(), '-r', req_filename)
+    stamp_filename = op.join(envpath, LOCK_STAMP_FILE)
+    stamp = _lock_stamp(lock_filename)
+    try:
+        with open(stamp_filename) as stamp_file:
+            if not force and stamp_file.read().strip() == stamp:
+                logger.info('Virtual env up to date with %s', lock_filename)
+                if prune:
+                    _prune(envpath, lock_data)
+                return
+    except OSError:
+        pass
+    cmd = ['python', '-m', 'pip', 'install', '--no-deps'] + wheelhouse_args()
+    if wheelhouse:
+        # The wheelhouse was verified against its own manifest; the locked hashes are of index archives
+        with tempfile.NamedTemporaryFile('w', prefix='runlib-lock-', suffix='.txt') as unhashed:
+            unhashed.write(HASH_OPTION_RE.sub('', lock_data))
+            unhashed.flush()
+            subprocess.check_call(cmd + ['-r', unhashed.name])
+    else:
+        subprocess.check_call(cmd + (['--require-hashes'] if '--hash=' in lock_data else []) + ['-r', lock_filename])
+    if prune:
+        _prune(envpath, lock_data)
+    tmpname = f'{stamp_filename}.{os.getpid()}'
+    with open(tmpname, 'w') as stamp_file:
+        stamp_file.write(f'{stamp}\n')
+    os.replace(tmpname, stamp_filename)
+
+
+def subcmd_clone(src: str, envpath: str):
+    """Clone the venv at *src* to *envpath* with hardlinks (or reflinks), relocating its scripts."""
+    src = op.realpath(src)
+    if op.isdir(envpath):
+        logger.info('Virtual env %s already exists, not cloning', envpath)
+        return
+    if not op.isfile(op.join(src, 'bin', 'python')):
+        logger.warning('No virtual env to clone in %s', src)
+        return
+    logger.info('Cloning virtual env from %s', src)
+    tmpname = f'{envpath}.{os.getpid()}.tmp'
+    venvcache.clone_tree(src, tmpname)
+    venvcache.relocate(tmpname, src, envpath)
+    os.rename(tmpname, envpath)
+
+
+def _sources(root: str, skip: set[str]):
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [name for name in dirnames
+                       if name not in COMPILE_SKIP_DIRS and op.realpath(op.join(dirpath, name)) not in skip]
+        yield from (op.join(dirpath, name) for name in filenames if name.endswith('.py'))
+
+
+def compile_tree(files: list[str], optimize: list[int], mode: py_compile.PycInvalidationMode, workers: int):
+    """Byte-compile *files* on a pool of *workers* processes; return the number of failures."""
+    compile_file = functools.partial(compileall.compile_file, quiet=1, optimize=optimize, invalidation_mode=mode)
+    if workers <= 1 or len(files) < 2 * workers:
+        return sum(not compile_file(filename) for filename in files)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return sum(not ok for ok in executor.map(compile_file, files, chunksize=max(1, len(files) // (workers * 8))))
+
+
+def subcmd_compile(rootdir: str, envpath: str, workers: int, invalidation: str | None = None):
+    """Precompile the release (hash-based pycs by default) and the venv site-packages (timestamp pycs).
+
+    Release pycs use *invalidation* or VENV.COMPILE_INVALIDATION (default ``checked-hash``; the relink
+    passes ``unchecked-hash`` for immutable versioned releases), site-packages keep timestamp pycs so
+    only packages installed or changed since the last run compile. Both are compiled for each
+    VENV.COMPILE_OPTIMIZE level (default ``0``).
+    """
+    try:
+        optimize = sorted({int(level) for level in re.split(r'[\s,]+', get_config_str('VENV.COMPILE_OPTIMIZE', '0'))
+                           if level}) or [0]
+        mode = INVALIDATION_MODES[invalidation or get_config_str('VENV.COMPILE_INVALIDATION', 'checked-hash')]
+    except (ValueError, KeyError) as exc:
+        logger.error('Invalid VENV.COMPILE_OPTIMIZE or VENV.COMPILE_INVALIDATION, not compiling: %s', exc)
+        return
+    if any(level not in (0, 1, 2) for level in optimize):
+        logger.error('Optimization levels must be 0, 1 or 2, not compiling: %s', optimize)
+        return
+    workers = workers or os.cpu_count() or 1
+    site_dirs = list(dict.fromkeys(op.realpath(sysconfig.get_paths(vars={'base': envpath, 'platbase': envpath})[key])
+                                   for key in ('purelib', 'platlib')))
+    release_skip = {op.realpath(op.join(rootdir, name)) for name in COMPILE_SKIP_RELEASE_DIRS}
+    trees = [('release', [rootdir], mode, {op.realpath(envpath)} | release_skip),
+             ('site-packages', site_dirs, py_compile.PycInvalidationMode.TIMESTAMP, set())]
+    for name, roots, tree_mode, skip in trees:
+        started = time.monotonic()
+        files = [filename for root in roots if op.isdir(root) for filename in _sources(root, skip)]
+        failed = compile_tree(files, optimize, tree_mode, workers)
+        logger.info('Bytecode for %s: %d sources up to date in %.1fs (optimize: %s, %s pycs, %d workers)%s',
+                    name, len(files), time.monotonic() - started, ' '.join(map(str, optimize)),
+                    tree_mode.name.lower().replace('_', '-'), workers, f', {failed} failed' if failed else '')
+
+
 def cmd_env(args: 'argparse.Namespace'):
     rootdir = get_config_str('ROOTDIR')
 
     req_filename = op.join(rootdir, get_config_str('VENV.REQUIREMENTS', 'requirements.txt'))
-    req_lines: list[tuple[str, str, str]] = []
-    requirements: dict[str, tuple[str, str]] = {}
+    lock_filename = op.join(rootdir, get_config_str('VENV.LOCKFILE', 'requirements.lock'))
     try:
-        with open(req_filename) as req_file:
-            for line in req_file:
-                record = line.strip().partition('#')[0]
-                name, _, version = record.partition('==')
-                req_lines.append((line, name, version))
-                if name:
-                    requirements[name.lower()] = (version, name)
+        files = requirements.load(req_filename)
     except IOError as exc:
         logger.warning('Cannot read requirements file: %s', exc)
+        files = {op.abspath(req_filename): []}
 
     command = args.command or 'shell'
     if command == 'shell':
@@ -166,17 +497,24 @@ def cmd_env(args: 'argparse.Namespace'):
         except subprocess.CalledProcessError as exc:
             logger.error('Called process returned %s', exc.returncode)
     elif command == 'update':
-        os.execlp('python', 'python', '-m', 'pip', 'install', '-r', req_filename)
+        subcmd_update(req_filename, lock_filename, args.venv, files, args.force, args.prune)
+    elif command == 'clone':
+        subcmd_clone(args.src, args.venv)
+    elif command == 'compile':
+        subcmd_compile(rootdir, args.venv, args.jobs, args.invalidation)
+    elif command == 'lock':
+        subcmd_lock(req_filename, lock_filename, files)
     elif command == 'list':
-        print("\n".join(
-            f'{orig}=={version}' if version else name
-            for name, (version, orig) in requirements.items()) if requirements else "(requirements empty)")
+        subcmd_list(files, inventory.installed(args.venv), args.all)
     elif command == 'freeze':
-        subcmd_freeze(req_filename, requirements, req_lines)
-    elif command == 'add':
-        subcmd_add(req_filename, requirements, req_lines, args.pkg.strip(), args.update)
-    elif command == 'rm':
-        subcmd_rm(req_filename, requirements, req_lines, args.pkg.strip(), args.update)
+        subcmd_freeze(files, inventory.installed(args.venv))
+    elif command in ('add', 'rm'):
+        subcmd = subcmd_add if command == 'add' else subcmd_rm
+        try:
+            subcmd(req_filename, files, inventory.installed(args.venv), [pkg.strip() for pkg in args.pkg], args.update)
+        except ValueError as exc:
+            logger.error('%s', exc)
+            sys.exit(1)
 
 
 def setup_parser(cmd: str, parser: 'argparse.ArgumentParser'):
@@ -185,13 +523,25 @@ def setup_parser(cmd: str, parser: 'argparse.ArgumentParser'):
     parser_shell.add_argument('arg', nargs='*')
     parser_run = parser_sub.add_parser('run', help='Run a command in virtualenv')
     parser_run.add_argument('arg', nargs='+')
-    parser_sub.add_parser('update', help='Update virtualenv')
-    parser_add = parser_sub.add_parser('add', help='Add a package')
-    parser_add.add_argument('pkg')
+    parser_update = parser_sub.add_parser('update', help='Update virtualenv (from lockfile if present)')
+    parser_update.add_argument('--force', '-f', action='store_true', help='Reinstall even if lockfile is unchanged')
+    parser_update.add_argument('--prune', action='store_true',
+                               help='Uninstall packages not in the lockfile')
+    parser_sub.add_parser('lock', help='Write a fully pinned, hash-verified lockfile')
+    parser_clone = parser_sub.add_parser('clone', help='Create virtualenv by cloning another one')
+    parser_clone.add_argument('src', help='Virtualenv to clone')
+    parser_clone.set_defaults(use_venv=False)
+    parser_compile = parser_sub.add_parser('compile', help='Precompile the app and site-packages to bytecode')
+    parser_compile.add_argument('-j', '--jobs', type=int, default=0, help='Worker processes (default: CPU count)')
+    parser_compile.add_argument('--invalidation', choices=sorted(INVALIDATION_MODES),
+                                help='Release pyc invalidation (default: VENV.COMPILE_INVALIDATION, checked-hash)')
+    parser_add = parser_sub.add_parser('add', help='Add packages')
+    parser_add.add_argument('pkg', nargs='+')
     parser_add.add_argument('--update', '-u', action='store_true', help='Update packages after adding')
-    parser_rm = parser_sub.add_parser('rm', help='Remove a package')
-    parser_rm.add_argument('pkg')
+    parser_rm = parser_sub.add_parser('rm', help='Remove packages')
+    parser_rm.add_argument('pkg', nargs='+')
     parser_rm.add_argument('--update', '-u', action='store_true', help='Update packages after removing')
-    parser_sub.add_parser('list', help='List packages')
+    parser_list = parser_sub.add_parser('list', help='List packages')
+    parser_list.add_argument('--all', '-a', action='store_true', help='Also list installed packages not in requirements')
     parser_sub.add_parser('freeze', help='Freeze existing requirements')
     parser.set_defaults(command='shell', call=cmd_env)
@@ -1,4 +1,5 @@
 import logging
+import os
 from os import path as op
 import sys
 from typing import TYPE_CHECKING
@@ -6,6 +7,7 @@ if TYPE_CHECKING:
     import argparse
 
 from .. import logger, get_config_str
+from . import zygote
 
 
 COMMANDS = {'flask': 'Flask CLI utility', 'run': 'Flask dev server'}
@@ -18,6 +20,17 @@ def cmd_flask(args: list[str]):
     flask.cli.main()
 
 
+def zygote_commands():
+    """Import Flask and load the app (FLASK_APP) for the zygote."""
+    import flask.cli
+
+    try:
+        flask.cli.ScriptInfo(app_import_path=os.environ.get('FLASK_APP')).load_app()
+    except flask.cli.NoAppException as exc:
+        logger.warning('Cannot preload the Flask app: %s', exc)
+    return {'flask': cmd_flask}
+
+
 def cmd_run(args: 'argparse.Namespace'):
     if args.debug:
         logger.setLevel(logging.DEBUG)
@@ -32,6 +45,9 @@ def cmd_run(args: 'argparse.Namespace'):
 def setup_parser(cmd: str, parser: 'argparse.ArgumentParser'):
     if cmd == 'flask':
         def dfl(args: 'argparse.Namespace'):
+            code = zygote.call('flask', args.arg)
+            if code is not None:
+                sys.exit(code)
             return cmd_flask(args.arg)
 
         parser.add_argument('arg', nargs='*')
@@ -1,15 +1,26 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, ExitStack
+import copy
+import functools
+import hashlib
 from io import StringIO
+import logging
 import os
 from os import path as op
 import re
 from shlex import quote
+import shlex
+import shutil
 import subprocess
+import sys
+import tempfile
+import threading
 import time
-from typing import Any, Callable, TYPE_CHECKING
+from typing import Any, Callable, Iterator, TYPE_CHECKING
 if TYPE_CHECKING:
     import argparse
 
-from .. import logger, get_config_dict, get_config_str, CONFIG
+from .. import logger, file_sha256, format_table, get_config_dict, get_config_str, timings, CONFIG
 
 
 COMMANDS = {
@@ -17,11 +28,15 @@ COMMANDS = {
     'start': 'Start app',
     'stop': 'Stop app',
     'restart': 'Restart app',
-    'reload': 'Reload app'
+    'reload': 'Reload app',
+    'ready': 'Wait until the app passes its readiness check',
 }
 
 
 SCRIPTS_SUBDIR = 'install_scripts'
+STATS_RE = re.compile(rb'sent ([\d,]+) bytes +received ([\d,]+) bytes')
+BANNER_RE = re.compile(rb' \*\* (\w+) cmd \*\*$')
+MANIFEST_FILE = '.runlib-manifest'
 SCRIPTS_DIR = op.join(op.dirname(op.dirname(__file__)), SCRIPTS_SUBDIR)
 
 
@@ -34,16 +49,127 @@ def get_revision():
     res = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True)
     if res.returncode == 0:
         return res.stdout[:7].decode('utf-8')
-    return time.strftime('%Y%m$d')
-
-
-def _do_rsync(src: str, dst: str, excl: list[str], incl: list[str]):
-    cmd = ['rsync', '-a', '--update', '--delete', '--filter=:- .gitignore']
-    cmd.extend(f'--exclude={elem}' for elem in excl if elem)
-    cmd.extend(f'--include={elem}' for elem in incl if elem)
+    return time.strftime('%Y%m%d')
+
+
+_output = threading.local()
+_output_lock = threading.Lock()
+
+
+class _PrefixFilter(logging.Filter):
+    """Prefix log records with the deploy target handled by the current thread."""
+
+    def filter(self, record: logging.LogRecord):
+        prefix = getattr(_output, 'prefix', '')
+        if prefix:
+            record.msg = f'{prefix}{record.msg}'
+        return True
+
+
+def _scan_line(line: bytes, subphases: ExitStack):
+    """Start a subphase on relink step banners in command output."""
+    banner = BANNER_RE.match(line)
+    if banner:
+        subphases.close()
+        subphases.enter_context(timings.phase(banner.group(1).decode('utf-8').lower()))
+
+
+def _read_stats(log_file: str, record: dict[str, Any]):
+    """Record the transfer totals rsync wrote to *log_file*."""
+    try:
+        with open(log_file, 'rb') as log:
+            stats = STATS_RE.findall(log.read())
+    except OSError:
+        return
+    if stats:
+        record['bytes_sent'], record['bytes_received'] = (int(val.replace(b',', b'')) for val in stats[-1])
+
+
+def _run(cmd: list[str] | str, phase: str | None = None, stats_file: str | None = None, **kwargs: Any):
+    """Like subprocess.run, recording failures and timings for the current target.
+
+    With an output prefix (parallel deploys), output lines are prefixed and stdin is closed so that
+    prompts fail instead of waiting unseen. Otherwise stdin and stdout are left alone; with timings
+    on, stderr is relayed as it arrives while relink step banners are picked out of it.
+    """
+    prefix = getattr(_output, 'prefix', '')
+    name = cmd.split()[0] if isinstance(cmd, str) else cmd[0]
+    with timings.phase(phase or op.basename(name)) as record:
+        if prefix:
+            with ExitStack() as subphases, subprocess.Popen(
+                    cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, **kwargs) as proc:
+                assert proc.stdout
+                for line in proc.stdout:
+                    _scan_line(line, subphases)
+                    with _output_lock:
+                        sys.stdout.buffer.write(prefix.encode('utf-8') + line)
+                        sys.stdout.flush()
+            res = subprocess.CompletedProcess(cmd, proc.returncode)
+        elif timings.enabled():
+            with ExitStack() as subphases, subprocess.Popen(cmd, stderr=subprocess.PIPE, **kwargs) as proc:
+                assert proc.stderr
+                pending = b''
+                while chunk := os.read(proc.stderr.fileno(), 65536):
+                    sys.stderr.buffer.write(chunk)
+                    sys.stderr.flush()
+                    lines = (pending + chunk).split(b'\n')
+                    pending = lines.pop()
+                    for line in lines:
+                        _scan_line(line, subphases)
+            res = subprocess.CompletedProcess(cmd, proc.returncode)
+        else:
+            res = subprocess.run(cmd, **kwargs)
+        if stats_file:
+            _read_stats(stats_file, record)
+        record['returncode'] = res.returncode
+    if res.returncode and hasattr(_output, 'failures'):
+        _output.failures.append(f'{op.basename(name)}: {res.returncode}')
+    return res
+
+
+def _rsync_filter(excl: list[str], incl: list[str]):
+    return (['--filter=:- .gitignore'] + [f'--exclude={elem}' for elem in excl if elem]
+            + [f'--include={elem}' for elem in incl if elem])
+
+
+def _do_rsync(src: str, dst: str, excl: list[str], incl: list[str], rsh: list[str] | None = None,
+              link_dest: str | None = None):
+    cmd = ['rsync', '-a', '--update', '--delete']
+    if rsh:
+        cmd.append(f'--rsh={sjoin(rsh)}')
+    if link_dest:
+        cmd.append(f'--link-dest={link_dest}')
+    cmd.extend(_rsync_filter(excl, incl))
     cmd.extend([src, dst])
     logger.info('Running: %s %s', cmd[0], ' '.join(f'"{arg}"' if ' ' in arg else arg for arg in cmd[1:]))
-    return subprocess.run(cmd)
+    if not timings.enabled():
+        return _run(cmd, 'rsync')
+    with tempfile.NamedTemporaryFile(prefix='runlib-rsync-', suffix='.log') as log_file:
+        return _run(cmd[:1] + [f'--log-file={log_file.name}'] + cmd[1:], 'rsync', stats_file=log_file.name)
+
+
+@contextmanager
+def ssh_master(host: str, ssh_cmd: list[str]) -> Iterator[list[str]]:
+    """Keep one multiplexed ssh connection to *host* open, yielding the ssh command using it.
+
+    The control socket lives in a private temporary directory; the master is stopped and the
+    directory removed on exit. If the master can't be started, plain *ssh_cmd* is yielded.
+    """
+    sockdir = tempfile.mkdtemp(prefix='runlib-ssh-')
+    control = ssh_cmd + ['-o', f'ControlPath={op.join(sockdir, "master")}']
+    try:
+        res = subprocess.run(control + ['-M', '-o', 'ControlPersist=yes', '-fN', host])
+        if res.returncode != 0:
+            logger.warning('Cannot start ssh master connection to %s, connecting per command', host)
+            yield ssh_cmd
+            return
+        logger.debug('SSH master connection to %s started', host)
+        try:
+            yield control
+        finally:
+            subprocess.run(control + ['-O', 'exit', host], capture_output=True)
+    finally:
+        shutil.rmtree(sockdir, ignore_errors=True)
 
 
 def _install_config(host: str | None = None):
@@ -63,6 +189,151 @@ def _get_scripts_loc(rootdir: str):
     return scripts_loc
 
 
+def _is_true(value: str):
+    return value.strip().lower() in ('1', 'y', 'yes', 'true')
+
+
+def _wheelhouse_root(rootdir: str):
+    return op.join(rootdir, get_config_str('VENV.DIR'), 'wheelhouse')
+
+
+def build_wheelhouse(rootdir: str, config: dict[str, str]) -> str | None:
+    """Build (or reuse) a local wheelhouse for the target platform when WHEELHOUSE is enabled.
+
+    Wheels are built from the lockfile if present, otherwise from requirements, into a directory
+    under the venv keyed by their content and the WHEEL_PLATFORM / WHEEL_PYTHON target options.
+    """
+    from . import env
+
+    if not _is_true(config.get('WHEELHOUSE', '')):
+        return None
+    venv_dir = op.join(rootdir, get_config_str('VENV.DIR'))
+    lock_file = op.join(rootdir, get_config_str('VENV.LOCKFILE', 'requirements.lock'))
+    req_file = lock_file if op.isfile(lock_file) else op.join(rootdir, get_config_str('VENV.REQUIREMENTS'))
+    if not op.isfile(req_file):
+        return None
+    platform, python = config.get('WHEEL_PLATFORM', ''), config.get('WHEEL_PYTHON', '')
+    digest = hashlib.sha256(f'{platform}\n{python}\n'.encode('utf-8'))
+    with open(req_file, 'rb') as reqs:
+        digest.update(reqs.read())
+    wheelhouse = op.join(_wheelhouse_root(rootdir), digest.hexdigest()[:16])
+    if op.isfile(op.join(wheelhouse, '.complete')) and op.isfile(op.join(wheelhouse, env.WHEELHOUSE_MANIFEST)):
+        logger.info('Using wheelhouse: %s', wheelhouse)
+        os.utime(wheelhouse)
+        return wheelhouse
+    interpreter = op.join(venv_dir, 'bin', 'python')
+    pip = [interpreter if op.isfile(interpreter) else sys.executable, '-m', 'pip']
+    logger.info('Building wheelhouse from %s', req_file)
+    if platform or python:
+        cmd = pip + ['download', '--only-binary=:all:', '-d', wheelhouse]
+        cmd.extend(['--platform', platform] if platform else [])
+        cmd.extend(['--python-version', python] if python else [])
+    else:
+        cmd = pip + ['wheel', '-w', wheelhouse]
+    shutil.rmtree(wheelhouse, ignore_errors=True)
+    if _run(cmd + ['pip', 'wheel'], 'wheelhouse').returncode or _run(cmd + ['-r', req_file], 'wheelhouse').returncode:
+        raise RuntimeError(f'Building wheelhouse from {req_file} failed')
+    env.write_wheelhouse_manifest(wheelhouse, req_file)
+    open(op.join(wheelhouse, '.complete'), 'w').close()
+    return wheelhouse
+
+
+def evict_wheelhouses(rootdir: str, keep: set[str], count: int = 3):
+    """Remove wheelhouses beyond the *count* most recently used ones, never those in *keep*."""
+    root = _wheelhouse_root(rootdir)
+    try:
+        names = sorted(os.listdir(root), key=lambda name: os.stat(op.join(root, name)).st_mtime, reverse=True)
+    except OSError:
+        return
+    for name in names[count:]:
+        if op.join(root, name) not in keep:
+            shutil.rmtree(op.join(root, name), ignore_errors=True)
+
+
+def run_build(rootdir: str, command: str, inputs: list[str], outputs: list[str]):
+    """Run the build *command*, or restore its *outputs* from the build cache if its *inputs* are unchanged.
+
+    Caching is on when both BUILD_INPUTS and BUILD_OUTPUTS are configured.
+    """
+    from .. import buildcache
+
+    key = None
+    if inputs and outputs and buildcache.store_budget():
+        with timings.phase('build_cache') as record:
+            key = buildcache.cache_key(rootdir, command, inputs, outputs)
+            started = time.monotonic()
+            meta = buildcache.restore(key, rootdir, outputs)
+            elapsed = time.monotonic() - started
+            record['hit'] = bool(meta)
+            if meta:
+                record['saved'] = round(meta['build_time'] - elapsed, 3)
+        if meta:
+            logger.info('Build cache hit (%s): restored %d files in %.1fs instead of building, saved %.1fs',
+                        key[:12], len(meta['files']), elapsed, meta['build_time'] - elapsed)
+            return
+        logger.info('Build cache miss (%s)', key[:12])
+    logger.info('Calling build cmd')
+    started = time.monotonic()
+    res = _run(command, 'build', shell=True)
+    elapsed = time.monotonic() - started
+    logger.info('Build cmd done in %.1fs', elapsed)
+    if key and not res.returncode:
+        buildcache.store(key, rootdir, outputs, elapsed)
+
+
+def _build_wheelhouse_or_exit(rootdir: str, config: dict[str, str]):
+    try:
+        return build_wheelhouse(rootdir, config)
+    except (RuntimeError, OSError) as exc:
+        logger.error('%s', exc)
+        sys.exit(1)
+
+
+def _release_files(src: str, excl: list[str], incl: list[str]):
+    """Return the files rsync ships from *src* with these filters, from a dry run into an empty directory."""
+    with tempfile.TemporaryDirectory(prefix='runlib-manifest-') as empty:
+        res = subprocess.run(['rsync', '-a', '--dry-run', '--8-bit-output', '--out-format=%n',
+                              *_rsync_filter(excl, incl), src, f'{empty}/'], stdout=subprocess.PIPE, check=True)
+    return sorted(name for name in map(os.fsdecode, res.stdout.splitlines()) if not name.endswith('/'))
+
+
+def release_manifest(trees: dict[str, tuple[str, list[str], list[str]]]):
+    """Return ``(digest, manifest)``: a content hash of the release and its per-file listing.
+
+    *trees* maps release paths (``''`` for the release root) to the local directory rsync copies
+    there and its excludes and includes; files are listed as rsync selects them.
+    """
+    lines: list[str] = []
+    for path, (root, excl, incl) in trees.items():
+        prefix = f'{path.strip("/")}/' if path.strip('/') else ''
+        for name in _release_files(f'{root.rstrip("/")}/', excl, incl):
+            filename = op.join(root, name)
+            if op.islink(filename):
+                digest = hashlib.sha256(os.readlink(filename).encode('utf-8')).hexdigest()
+                mode = 'l'
+            elif op.isfile(filename):
+                digest = file_sha256(filename)
+                mode = 'x' if os.access(filename, os.X_OK) else 'f'
+            else:
+                continue
+            lines.append(f'{digest} {mode} {prefix}{name}\n')
+    manifest = ''.join(lines)
+    return hashlib.sha256(manifest.encode('utf-8')).hexdigest(), manifest
+
+
+def _probe_releases(subdir: str, filter_cmd: Callable[[str], list[str]], digest: str):
+    """Return the release dir matching *digest* and the currently installed one on the target."""
+    probe = f'''cd {quote(subdir)} 2>/dev/null || exit 0
+for manifest in versions/*/{MANIFEST_FILE}; do
+    if [ "$(head -1 "$manifest" 2>/dev/null)" = {quote(digest)} ]; then echo "match ${{manifest%/*}}"; break; fi
+done
+[ -d _installed_ ] && echo "installed $(readlink _installed_)"
+exit 0'''
+    res = subprocess.run(filter_cmd(probe), capture_output=True)
+    found = dict(line.partition(' ')[::2] for line in res.stdout.decode('utf-8').splitlines())
+    return found.get('match'), found.get('installed')
+
+
 def do_install(rootdir: str, dest: str, subdir: str, revision: str, filter_cmd: Callable[[str], list[str]], options: dict[str, Any]):
     venv_dir = get_config_str('VENV.DIR')
     rootdir, dest = rootdir.rstrip('/'), dest.rstrip('/')
@@ -75,22 +346,43 @@ def do_install(rootdir: str, dest: str, subdir: str, revision: str, filter_cmd:
         for src, dst in options['moves'].items()}
 
     if options.get('build'):
-        logger.info('Calling build cmd')
-        subprocess.run(options['build'], shell=True)
-        logger.info('Build cmd done')
+        run_build(rootdir, options['build'], options['build_inputs'], options['build_outputs'])
+    wheel_dir = get_config_str('VENV.WHEELHOUSE', '.wheelhouse').strip('/')
+    trees = {'': (rootdir, excludes + list(moves.keys()), includes)}
+    trees.update({dst[len('_installed_/'):]: (src, excludes, includes + [src])
+                  for src, dst in moves.items() if op.isdir(src)})
+    if options.get('wheelhouse'):
+        trees[wheel_dir] = (options['wheelhouse'], ['.complete'], [])
+    with timings.phase('manifest'):
+        digest, manifest = release_manifest(trees)
+    with timings.phase('probe'):
+        matching, previous = _probe_releases(subdir, filter_cmd, digest)
+    if matching and not options.get('replace'):
+        logger.info('Release identical to installed %s, skipping transfer', matching)
+        _run(filter_cmd(f'ln -svfn {quote(matching)} {quote(subdir)}/_installed_'), 'link')
+        return
     with open(op.join(SCRIPTS_DIR, 'install.sh')) as install_script:
         cmd = install_script.read().format(subdir=subdir, revision=revision, **{
             key: quote(str(val)) for key, val in options.items()})
-    subprocess.run(filter_cmd(cmd))
-
-    _do_rsync(f'{rootdir}/', f'{dest}/_installed_/', excludes + list(moves.keys()), includes)
+    _run(filter_cmd(cmd), 'install.sh')
+
+    rsh = options.get('rsh')
+    link_dest = f'../{op.basename(previous)}/' if previous and previous.startswith('versions/') else None
+    _do_rsync(f'{rootdir}/', f'{dest}/_installed_/', excludes + list(moves.keys()), includes, rsh, link_dest)
+    with tempfile.TemporaryDirectory(prefix='runlib-manifest-') as tmpdir:
+        with open(op.join(tmpdir, MANIFEST_FILE), 'w') as manifest_file:
+            manifest_file.write(f'{digest}\n{manifest}')
+        _do_rsync(op.join(tmpdir, MANIFEST_FILE), f'{dest}/_installed_/{MANIFEST_FILE}', [], [], rsh)
+    if options.get('wheelhouse'):
+        _do_rsync(f'{options["wheelhouse"]}/', f'{dest}/_installed_/{wheel_dir}/', ['.complete'], [], rsh,
+                  f'../../{op.basename(previous)}/{wheel_dir}/' if link_dest and previous else None)
     if moves:
         cmd = '\n'.join(
             f'mkdir -pv "$(dirname {quote(subdir)}/{quote(dst)})"'
             for dst in moves.values())
-        subprocess.run(filter_cmd(cmd))
+        _run(filter_cmd(cmd), 'mkdir')
     for src, dst in moves.items():
-        _do_rsync(src, op.join(dest, dst), excludes, includes + [src])
+        _do_rsync(src, op.join(dest, dst), excludes, includes + [src], rsh)
 
 
 def do_relink(
@@ -99,23 +391,29 @@ def do_relink(
     stage: str,
     commands: tuple[str, str, str],
     install_env: dict[str, str] | None = None,
+    switch_cmd: str | None = None,
 ):
+    """Prepare the installed release and make it the *stage*, restarting the app.
+
+    With *switch_cmd* given (may be empty), relink blue-green: the new release is started in the
+    free slot next to the running one and switched to only once it passes its readiness check.
+    """
     start_cmd, upgrade_cmd, stop_cmd = commands
     venv_dir = get_config_str('VENV.DIR')
-    req_file = get_config_str('VENV.REQUIREMENTS')
-    logger.info('Relinking installed app: %s to %s', subdir, stage)
+    logger.info('Relinking installed app%s: %s to %s', ' (blue-green)' if switch_cmd is not None else '', subdir, stage)
     with open(op.join(SCRIPTS_DIR, 'prepare.sh')) as prepare_script:
-        prepare_cmd = prepare_script.read().format(venv_dir=quote(venv_dir), req_file=quote(req_file))
+        prepare_cmd = prepare_script.read().format(venv_dir=quote(venv_dir))
     if install_env:
+        config = copy.deepcopy(CONFIG)
         try:
-            CONFIG['ENVIRONMENT'].update(install_env)
+            config['ENVIRONMENT'].update(install_env)
         except KeyError:
-            CONFIG['ENVIRONMENT'] = install_env
-        config_location = CONFIG['MAIN']['CONFIG']
+            config['ENVIRONMENT'] = install_env
+        config_location = config['MAIN']['CONFIG']
         with StringIO() as sfile:
-            del CONFIG['MAIN']['ROOTDIR']
-            del CONFIG['MAIN']['CONFIG']
-            CONFIG.write(sfile)
+            del config['MAIN']['ROOTDIR']
+            del config['MAIN']['CONFIG']
+            config.write(sfile)
             config_data = sfile.getvalue()
         delim = '__EOF'
         while f'\n{delim}\n' in config_data:
@@ -130,48 +428,191 @@ def do_relink(
         'stop_cmd': stop_cmd,
         'prepare_cmd': prepare_cmd,
         'upgrade_cmd': upgrade_cmd,
-        'start_cmd': start_cmd
+        'start_cmd': start_cmd,
+        'switch_cmd': switch_cmd or '',
     }
-    with open(op.join(SCRIPTS_DIR, 'relink.sh')) as relink_script:
+    script = 'relink.sh' if switch_cmd is None else 'bluegreen.sh'
+    with open(op.join(SCRIPTS_DIR, script)) as relink_script:
         cmd = relink_script.read().format(**script_vars)
-    subprocess.run(filter_cmd(cmd))
+    _run(filter_cmd(cmd), script)
 
 
-def cmd_install(args: 'argparse.Namespace'):
-    rootdir = get_config_str('ROOTDIR')
-    scripts_loc = _get_scripts_loc(rootdir)
-    host, _, subdir = args.dest.rpartition(':')
-    subdir = subdir.rstrip('/')
-    if host:
-        filter_cmd: Callable[[str], list[str]] = lambda cmd: ['ssh', host, 'bash', '-c', quote(cmd)]
-    else:
-        filter_cmd: Callable[[str], list[str]] = lambda cmd: ['bash', '-c', cmd]
+def _timed(func: Callable[['argparse.Namespace'], None]):
+    """Record phase timings of command *func* when ``--timings`` or ``--trace`` is given."""
+    @functools.wraps(func)
+    def wrapper(args: 'argparse.Namespace'):
+        with timings.session(func.__name__[4:], getattr(args, 'timings', None), getattr(args, 'trace', None)):
+            return func(args)
+    return wrapper
+
+
+def _expand_dests(dests: list[str]):
+    res: list[str] = []
+    for dest in dests:
+        if dest.startswith('@'):
+            group = get_config_str(f'HOSTS.{dest[1:]}')
+            if not group:
+                raise ValueError(f'Unknown host group: {dest[1:]}')
+            res.extend(elem for elem in re.split(r'\s+', group) if elem)
+        else:
+            res.append(dest)
+    return list(dict.fromkeys(res))
+
 
+def _install_target(dest: str, args: 'argparse.Namespace', scripts_loc: str):
+    host, _, subdir = dest.rpartition(':')
     config = _install_config(host)
     install_env = {var[4:]: value for var, value in config.items() if var.startswith('ENV_')}
     install_env['INSTALL_HOST'] = host or ''
-    install_conf = {
-        'build': config.get('BUILD_CMD', get_config_str('MAIN.BUILD_CMD')) if not args.skip_build else None,
-        'clean': args.clean,
-        'replace': args.replace,
-        'excludes': re.split(r'\s+', config.get('EXCLUDE', '')),
-        'includes': re.split(r'\s+', config.get('INCLUDE', '')),
-        'moves': {src.strip(): dst.strip()
-                  for elem in re.split(r'\n\s*', config.get('MOVE', ''))
-                  for src, _, dst in (elem.partition(':'),) if src}
+    return {
+        'dest': dest,
+        'host': host,
+        'subdir': subdir.rstrip('/'),
+        'config': config,
+        'install_env': install_env,
+        'install_conf': {
+            'build': config.get('BUILD_CMD', get_config_str('MAIN.BUILD_CMD')) if not args.skip_build else None,
+            'build_inputs': [elem for elem in re.split(r'\s+', config.get('BUILD_INPUTS', '')) if elem],
+            'build_outputs': [elem for elem in re.split(r'\s+', config.get('BUILD_OUTPUTS', '')) if elem],
+            'clean': args.clean,
+            'replace': args.replace,
+            'excludes': re.split(r'\s+', config.get('EXCLUDE', '')),
+            'includes': re.split(r'\s+', config.get('INCLUDE', '')),
+            'moves': {src.strip(): dst.strip()
+                      for elem in re.split(r'\n\s*', config.get('MOVE', ''))
+                      for src, _, dst in (elem.partition(':'),) if src}
+        },
+        'commands': (
+            args.start_cmd or config.get('START_CMD', f'. {scripts_loc}/start_cmd.sh'),
+            args.upgrade_cmd or config.get('UPGRADE_CMD', ''),
+            args.stop_cmd or config.get('STOP_CMD', f'. {scripts_loc}/stop_cmd.sh')),
+        'switch_cmd': (config.get('SWITCH_CMD', '')
+                       if args.blue_green or _is_true(config.get('BLUE_GREEN', '')) else None),
+        'stack': ExitStack(),
+        'rsh': None,
+        'results': {},
     }
-    os.chdir(rootdir)
-    revision = args.revision or get_revision()
-
-    do_install(rootdir, args.dest, subdir, revision, filter_cmd, install_conf)
-    if args.relink:
-        start_cmd = args.start_cmd or config.get('START_CMD', f'. {scripts_loc}/start_cmd.sh')
-        upgrade_cmd = args.upgrade_cmd or config.get('UPGRADE_CMD', '')
-        stop_cmd = args.stop_cmd or config.get('STOP_CMD', f'. {scripts_loc}/stop_cmd.sh')
-        do_relink(subdir, filter_cmd, stage=args.relink,
-                  commands=(start_cmd, upgrade_cmd, stop_cmd), install_env=install_env)
 
 
+def _deploy_phase(target: dict[str, Any], phase: str, rootdir: str, revision: str, args: 'argparse.Namespace',
+                  prefix: bool = False):
+    """Run *phase* (install or relink) for *target*, recording its status and timing."""
+    host = target['host']
+    _output.prefix = f'[{target["dest"]}] ' if prefix else ''
+    _output.failures = []
+    timings.set_host(target['dest'])
+    started = time.monotonic()
+    try:
+        if host and target['rsh'] is None:
+            target['rsh'] = target['stack'].enter_context(
+                ssh_master(host, shlex.split(target['config'].get('SSH_CMD', 'ssh'))))
+        rsh = target['rsh']
+        if rsh:
+            filter_cmd: Callable[[str], list[str]] = lambda cmd: rsh + [host, 'bash', '-c', quote(cmd)]
+        else:
+            filter_cmd: Callable[[str], list[str]] = lambda cmd: ['bash', '-c', cmd]
+        with timings.phase(phase):
+            if phase == 'install':
+                target['install_conf']['rsh'] = rsh
+                do_install(rootdir, target['dest'], target['subdir'], revision, filter_cmd, target['install_conf'])
+            else:
+                do_relink(target['subdir'], filter_cmd, stage=args.relink, commands=target['commands'],
+                          install_env=target['install_env'], switch_cmd=target['switch_cmd'])
+        status = 'ok' if not _output.failures else f'failed ({", ".join(_output.failures)})'
+    except Exception as exc:
+        logger.error('%s failed: %s', phase.capitalize(), exc)
+        status = f'error ({exc})'
+    finally:
+        _output.prefix = ''
+    target['results'][phase] = (status, time.monotonic() - started)
+    return status == 'ok'
+
+
+def _fan_out(targets: list[dict[str, Any]], phases: tuple[str, ...], jobs: int, *args: Any):
+    def deploy(target: dict[str, Any]):
+        for phase in phases:
+            if not _deploy_phase(target, phase, *args, prefix=True):
+                return False
+        return True
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        return dict(zip((target['dest'] for target in targets), pool.map(deploy, targets)))
+
+
+def _print_summary(targets: list[dict[str, Any]], phases: tuple[str, ...]):
+    rows = [('HOST', 'STATUS') + tuple(phase.upper() for phase in phases) + ('TOTAL',)]
+    for target in targets:
+        results = target['results']
+        failed = [status for status, _ in results.values() if status != 'ok']
+        status = failed[0] if failed else ('ok' if len(results) == len(phases) else 'skipped')
+        times = [f'{results[phase][1]:.1f}s' if phase in results else '-' for phase in phases]
+        total = sum(elapsed for _, elapsed in results.values())
+        rows.append((target['dest'], status, *times, f'{total:.1f}s'))
+    print('\n'.join(format_table(rows)))
+
+
+@_timed
+def cmd_install(args: 'argparse.Namespace'):
+    rootdir = get_config_str('ROOTDIR')
+    scripts_loc = _get_scripts_loc(rootdir)
+    try:
+        dests = _expand_dests(args.dest)
+    except ValueError as exc:
+        logger.error('%s', exc)
+        sys.exit(1)
+    targets = [_install_target(dest, args, scripts_loc) for dest in dests]
+    os.chdir(rootdir)
+    revision = args.revision or get_revision()
+    phases = ('install', 'relink') if args.relink else ('install',)
+
+    with ExitStack() as stack:
+        for target in targets:
+            stack.enter_context(target['stack'])
+        if len(targets) == 1:
+            wheelhouse = targets[0]['install_conf']['wheelhouse'] = _build_wheelhouse_or_exit(
+                rootdir, targets[0]['config'])
+            try:
+                for phase in phases:
+                    if not _deploy_phase(targets[0], phase, rootdir, revision, args):
+                        sys.exit(1)
+            finally:
+                evict_wheelhouses(rootdir, {wheelhouse} if wheelhouse else set())
+            return
+
+        builds = {(conf['build'], tuple(conf['build_inputs']), tuple(conf['build_outputs'])): None
+                  for conf in (target['install_conf'] for target in targets)}
+        for build, inputs, outputs in builds:
+            if build:
+                run_build(rootdir, build, list(inputs), list(outputs))
+        for target in targets:
+            target['install_conf']['build'] = None
+            target['install_conf']['wheelhouse'] = _build_wheelhouse_or_exit(rootdir, target['config'])
+        jobs = args.jobs or int(get_config_str('INSTALL.JOBS', '4'))
+        prefix_filter = _PrefixFilter()
+        logger.addFilter(prefix_filter)
+        try:
+            if args.relink and args.rolling:
+                installed = _fan_out(targets, ('install',), jobs, rootdir, revision, args)
+                ready = [target for target in targets if installed[target['dest']]]
+                for idx in range(0, len(ready), args.rolling):
+                    batch = ready[idx:idx + args.rolling]
+                    logger.info('Relinking: %s', ' '.join(target['dest'] for target in batch))
+                    if not all(_fan_out(batch, ('relink',), len(batch), rootdir, revision, args).values()):
+                        logger.error('Rolling relink failed, not relinking remaining hosts')
+                        break
+            else:
+                _fan_out(targets, phases, jobs, rootdir, revision, args)
+        finally:
+            logger.removeFilter(prefix_filter)
+            evict_wheelhouses(rootdir, {wheelhouse for target in targets
+                                        if (wheelhouse := target['install_conf']['wheelhouse'])})
+    _print_summary(targets, phases)
+    if any(status != 'ok' for target in targets for status, _ in target['results'].values()) \
+            or any(len(target['results']) != len(phases) for target in targets):
+        sys.exit(1)
+
+
+@_timed
 def cmd_start(args: 'argparse.Namespace'):
     scripts_loc = _get_scripts_loc(get_config_str('ROOTDIR'))
     config = _install_config(get_config_str('ENVIRONMENT.INSTALL_HOST'))
@@ -179,9 +620,10 @@ def cmd_start(args: 'argparse.Namespace'):
     if args.arg:
         start_cmd += f' {sjoin(args.arg)}'
     logger.info('Starting app: %r', start_cmd)
-    subprocess.run(['bash', '-c', start_cmd])
+    _run(['bash', '-c', start_cmd], 'start_cmd')
 
 
+@_timed
 def cmd_stop(args: 'argparse.Namespace'):
     scripts_loc = _get_scripts_loc(get_config_str('ROOTDIR'))
     config = _install_config(get_config_str('ENVIRONMENT.INSTALL_HOST'))
@@ -189,42 +631,137 @@ def cmd_stop(args: 'argparse.Namespace'):
     if args:
         stop_cmd += f' {sjoin(args.arg)}'
     logger.info('Stopping app: %r', stop_cmd)
-    subprocess.run(['bash', '-c', stop_cmd])
+    _run(['bash', '-c', stop_cmd], 'stop_cmd')
+
+
+def _readiness_config(config: dict[str, str]):
+    """Return readiness options; inside a blue-green relink they refer to the slot being started."""
+    from . import uwsgi
+
+    rootdir = get_config_str('ROOTDIR')
+    slot = uwsgi.current_slot(rootdir)
+    pidfile, socket = uwsgi.runtime_files(rootdir, slot)
+    ready_check = config.get('READY_CHECK', '')
+    if os.environ.get(uwsgi.SLOT_ENV):
+        ready_check = config.get('SLOT_READY_CHECK', f'uwsgi+unix://{socket}')
+    timeouts: dict[str, float] = {}
+    for name in ('STOP_TIMEOUT', 'READY_TIMEOUT'):
+        try:
+            timeouts[name.lower()] = float(config.get(name, '30'))
+        except ValueError:
+            logger.error('Invalid %s: %r (expected seconds)', name, config[name])
+            sys.exit(1)
+    return {
+        'pidfile': op.join(rootdir, config.get('PIDFILE', pidfile).replace('{slot}', slot)),
+        'socket': config.get('SOCKET', '').replace('{slot}', slot),
+        'ready_check': ready_check.replace('{slot}', slot),
+        **timeouts,
+    }
 
 
+def wait_stopped(options: dict[str, Any], pid: int | None):
+    """Wait for the old process *pid* to exit and its socket to be released."""
+    from .. import readiness
+
+    with timings.phase('wait_stopped'):
+        if pid and readiness.wait_for(lambda: not readiness.pid_alive(pid), options['stop_timeout'],
+                                      f'pid {pid} to exit') is None:
+            return False
+        if options['socket'] and readiness.wait_for(
+                lambda: readiness.socket_released(options['socket']), options['stop_timeout'],
+                f'{options["socket"]} to be released') is None:
+            return False
+    return True
+
+
+def wait_ready(options: dict[str, Any]):
+    """Wait for the READY_CHECK probe to pass, if one is configured."""
+    from .. import readiness
+
+    if not options['ready_check']:
+        return True
+    with timings.phase('wait_ready'):
+        return readiness.wait_for(lambda: readiness.probe(options['ready_check']), options['ready_timeout'],
+                                  f'{options["ready_check"]} to become ready') is not None
+
+
+@_timed
 def cmd_restart(args: 'argparse.Namespace'):
+    from .. import readiness
+
     config = _install_config(get_config_str('ENVIRONMENT.INSTALL_HOST'))
+    options = _readiness_config(config)
     restart_cmd = config.get('RESTART_CMD')
+    started = time.monotonic()
     if restart_cmd:
         if args.arg:
             restart_cmd += f' {sjoin(args.arg)}'
         logger.info('Restarting app: %r', restart_cmd)
-        subprocess.run(['bash', '-c', restart_cmd])
+        _run(['bash', '-c', restart_cmd], 'restart_cmd')
     else:
         logger.debug('No specific restart command, using stop/start')
+        pid = readiness.read_pid(options['pidfile'])
         cmd_stop(args)
-        time.sleep(1)
+        if not wait_stopped(options, pid if pid and readiness.pid_alive(pid) else None):
+            logger.error('App did not stop, not starting it again')
+            sys.exit(1)
         cmd_start(args)
+    if not wait_ready(options):
+        sys.exit(1)
+    logger.info('App restarted, downtime: %.2fs%s', time.monotonic() - started,
+                '' if options['ready_check'] else ' (no READY_CHECK configured)')
 
 
+@_timed
 def cmd_reload(args: 'argparse.Namespace'):
     config = _install_config(get_config_str('ENVIRONMENT.INSTALL_HOST'))
     reload_cmd = config.get('RELOAD_CMD')
     if reload_cmd:
+        options = _readiness_config(config)
         if args.arg:
             reload_cmd += f' {sjoin(args.arg)}'
         logger.info('Reloading app: %r', reload_cmd)
-        subprocess.run(['bash', '-c', reload_cmd])
+        started = time.monotonic()
+        _run(['bash', '-c', reload_cmd], 'reload_cmd')
+        if not wait_ready(options):
+            sys.exit(1)
+        logger.info('App reloaded in %.2fs', time.monotonic() - started)
     else:
         logger.debug('No specific reload command, using restart')
         cmd_restart(args)
 
 
+def cmd_ready(args: 'argparse.Namespace'):
+    from .. import readiness
+
+    options = _readiness_config(_install_config(get_config_str('ENVIRONMENT.INSTALL_HOST')))
+    if args.timeout is not None:
+        options['ready_timeout'] = args.timeout
+    if not options['ready_check']:
+        logger.warning('No READY_CHECK configured, assuming the app is ready')
+        return
+    elapsed = readiness.wait_for(lambda: readiness.probe(options['ready_check']), options['ready_timeout'],
+                                 f'{options["ready_check"]} to become ready')
+    if elapsed is None:
+        sys.exit(1)
+    logger.info('App ready (%s) after %.2fs', options['ready_check'], elapsed)
+
+
 def setup_parser(cmd: str, parser: 'argparse.ArgumentParser'):
+    if cmd in ('install', 'start', 'stop', 'restart', 'reload'):
+        parser.add_argument('--timings', metavar='FILE', help='Write JSON phase timings to FILE ("-" for stderr)')
+        parser.add_argument('--trace', metavar='FILE', help='Write Chrome trace / Perfetto events to FILE')
     if cmd == 'install':
-        parser.add_argument('dest', help='Install destination (scp uri)')
+        parser.add_argument('dest', nargs='+',
+                            help='Install destinations (scp uri) or @group from the [HOSTS] config section')
+        parser.add_argument('-j', '--jobs', type=int, help='Hosts deployed concurrently (default: INSTALL.JOBS or 4)')
+        parser.add_argument('--rolling', type=int, metavar='N',
+                            help='Install to all hosts, then relink N hosts at a time, stopping on failure')
         parser.add_argument('-b', '--skip-build', action='store_true', default=False, help='Skip build step')
         parser.add_argument('--relink', action='store', nargs='?', const='current', help='Relink to installed version and restart. Argument is used as stage name (default: current)')
+        parser.add_argument('--blue-green', action='store_true', default=False,
+                            help='Start the new release next to the old one and switch to it once ready '
+                                 '(default: INSTALL.BLUE_GREEN)')
         parser.add_argument('--stop-cmd', help='Stop command (bash)')
         parser.add_argument('--upgrade-cmd', help='Upgrade command run before start (bash)')
         parser.add_argument('--start-cmd', help='Start command (bash)')
@@ -245,3 +782,7 @@ def setup_parser(cmd: str, parser: 'argparse.ArgumentParser'):
     elif cmd == 'reload':
         parser.add_argument('arg', nargs='*')
         parser.set_defaults(call=cmd_reload, use_venv=False)
+    elif cmd == 'ready':
+        parser.add_argument('-t', '--timeout', type=float,
+                            help='Seconds to wait (default: INSTALL.READY_TIMEOUT or 30)')
+        parser.set_defaults(call=cmd_ready, use_venv=False)
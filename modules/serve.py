@@ -0,0 +1,316 @@
+"""Pre-fork WSGI server for small deployments without uwsgi.
+
+The master loads the app (copy-on-write, like ``uwsgi start --preload``) and forks the workers.
+Each worker binds its own ``SO_REUSEPORT`` socket, so the kernel spreads connections between them,
+and serves them from a thread pool. After ``--max-requests`` a worker stops accepting, drains its
+backlog, finishes in-flight requests and exits; the master forks a replacement.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import gc
+import os
+import random
+import selectors
+import signal
+import socket
+import sys
+import threading
+import time
+from typing import Any, Callable, TYPE_CHECKING
+from wsgiref.simple_server import ServerHandler, WSGIRequestHandler, WSGIServer
+if TYPE_CHECKING:
+    import argparse
+
+from .. import get_config_str, logger, preload
+
+
+COMMANDS = {'serve': 'Serve the WSGI app with pre-forked workers'}
+
+def services(ctl: list[str]) -> dict[str, dict[str, Any]]:
+    """Services run by ``ctl supervise``: the pre-fork server (SIGHUP restarts the workers)."""
+    return {'serve': {'command': ctl + ['serve'], 'stop_signal': signal.SIGTERM, 'reload_signal': signal.SIGHUP}}
+
+
+def mounted(app: Callable[..., Any], mountpoint: str):
+    """Return *app* served under *mountpoint*, moving the prefix from PATH_INFO to SCRIPT_NAME."""
+    mountpoint = mountpoint.rstrip('/')
+    if not mountpoint:
+        return app
+
+    def dispatch(environ: dict[str, Any], start_response: Callable[..., Any]):
+        path = environ.get('PATH_INFO', '')
+        if path != mountpoint and not path.startswith(mountpoint + '/'):
+            start_response('404 Not Found', [('Content-Type', 'text/plain')])
+            return [b'Not Found']
+        environ['SCRIPT_NAME'] = environ.get('SCRIPT_NAME', '') + mountpoint
+        environ['PATH_INFO'] = path[len(mountpoint):]
+        return app(environ, start_response)
+    return dispatch
+
+
+class _RequestHandler(WSGIRequestHandler):
+    """wsgiref request handler flagging the environ as multithreaded and multiprocess."""
+
+    def handle(self):
+        self.raw_requestline = self.rfile.readline(65537)
+        if len(self.raw_requestline) > 65536:
+            self.send_error(414)
+            return
+        if not self.parse_request():
+            return
+        handler = ServerHandler(self.rfile, self.wfile, self.get_stderr(), self.get_environ(),
+                                multithread=True, multiprocess=True)
+        handler.request_handler = self  # type: ignore[attr-defined]
+        handler.run(self.server.get_app())  # type: ignore[attr-defined]
+
+    def log_message(self, format: str, *args: Any):
+        logger.debug('%s %s', self.address_string(), format % args)
+
+
+def _listen(host: str, port: int, backlog: int = 1024):
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+
+def _worker(app: Callable[..., Any], host: str, port: int, threads: int, max_requests: int, control: int):
+    """Serve until SIGTERM, asking the master on *control* to be replaced after *max_requests* connections."""
+    stop = threading.Event()
+    wakeup_r, wakeup_w = os.pipe()
+    os.set_blocking(wakeup_w, False)
+    signal.set_wakeup_fd(wakeup_w)
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    for signum in (signal.SIGINT, signal.SIGHUP):
+        signal.signal(signum, signal.SIG_IGN)
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+
+    server = WSGIServer((host, port), _RequestHandler, bind_and_activate=False)
+    server.server_name, server.server_port = socket.getfqdn(host), port
+    server.setup_environ()
+    server.set_app(app)
+    sock = _listen(host, port)
+    os.write(control, f'ready {os.getpid()}\n'.encode())
+    slots = threading.BoundedSemaphore(threads)
+    limit = max_requests + random.randint(0, max_requests // 10) if max_requests else 0
+
+    def handle(conn: socket.socket, addr: Any):
+        try:
+            conn.settimeout(60)
+            _RequestHandler(conn, addr, server)
+        except Exception as exc:
+            logger.debug('Request from %s failed: %s', addr, exc)
+        finally:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            conn.close()
+            slots.release()
+
+    def accept(pool: ThreadPoolExecutor):
+        conn, addr = sock.accept()
+        conn.setblocking(True)
+        pool.submit(handle, conn, addr)
+
+    handled = 0
+    with ThreadPoolExecutor(max_workers=threads) as pool, selectors.DefaultSelector() as selector:
+        sock.setblocking(False)
+        selector.register(sock, selectors.EVENT_READ)
+        selector.register(wakeup_r, selectors.EVENT_READ)
+        while not stop.is_set():
+            if not slots.acquire(timeout=1.0):
+                continue
+            ready = [key.fileobj for key, _ in selector.select()]
+            if wakeup_r in ready:
+                os.read(wakeup_r, 512)
+            try:
+                accept(pool)
+            except (BlockingIOError, InterruptedError):
+                slots.release()
+                continue
+            handled += 1
+            if handled == limit:
+                # Keep serving until the replacement listens and the master sends SIGTERM.
+                os.write(control, f'retire {os.getpid()}\n'.encode())
+        # Serve what is already queued on this socket before closing it, so it isn't reset.
+        while True:
+            slots.acquire()
+            try:
+                accept(pool)
+            except (BlockingIOError, InterruptedError):
+                slots.release()
+                break
+        sock.close()
+    return handled
+
+
+def _spawn(app: Callable[..., Any], host: str, port: int, threads: int, max_requests: int, control: int):
+    pid = os.fork()
+    if pid:
+        return pid
+    code = 0
+    try:
+        handled = _worker(app, host, port, threads, max_requests, control)
+        logger.debug('Worker %s exiting after %s requests', os.getpid(), handled)
+    except BaseException as exc:
+        logger.error('Worker %s failed: %s', os.getpid(), exc)
+        code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(code)
+
+
+def _reap(children: dict[int, dict[str, Any]], stopping: bool):
+    """Forget exited workers; return how many of them failed right after starting."""
+    failed = 0
+    while True:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if not pid:
+            break
+        child = children.pop(pid, None)
+        code = os.waitstatus_to_exitcode(status)
+        if child and code and not stopping:
+            logger.warning('Worker %s exited with %s', pid, code)
+            if child['state'] == 'starting':
+                failed += 1
+    return failed
+
+
+def _retire_oldest(children: dict[int, dict[str, Any]]):
+    retiring = [pid for pid, child in children.items() if child['state'] == 'retiring']
+    if retiring:
+        pid = min(retiring, key=lambda pid: children[pid]['started'])
+        children[pid]['state'] = 'stopping'
+        os.kill(pid, signal.SIGTERM)
+
+
+def serve(app: Callable[..., Any], host: str, port: int, workers: int, threads: int, max_requests: int,
+          stop_timeout: float = 30):
+    """Fork *workers* serving *app* on *host*:*port* until SIGTERM/SIGINT; return False if they failed to start.
+
+    A worker asking to be recycled (or all of them, on SIGHUP) is only stopped once its replacement
+    is listening, so the port never runs out of accepting sockets.
+    """
+    _listen(host, port).close()
+    children: dict[int, dict[str, Any]] = {}
+    pending: list[int] = []
+    wakeup_r, wakeup_w = os.pipe()
+    control_r, control_w = os.pipe()
+    for fd in (wakeup_r, wakeup_w, control_r):
+        os.set_blocking(fd, False)
+    signal.set_wakeup_fd(wakeup_w)
+    for signum in (signal.SIGCHLD, signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+        signal.signal(signum, lambda signum, frame: pending.append(signum))
+    selector = selectors.DefaultSelector()
+    selector.register(wakeup_r, selectors.EVENT_READ)
+    selector.register(control_r, selectors.EVENT_READ)
+    messages = b''
+    stopping = False
+    deadline = None
+    failures = 0
+    logger.info('Serving on http://%s:%s with %s workers x %s threads (pid %s)',
+                f'[{host}]' if ':' in host else host, port, workers, threads, os.getpid())
+    try:
+        while True:
+            while pending:
+                signum = pending.pop(0)
+                if signum == signal.SIGCHLD:
+                    failed = _reap(children, stopping)
+                    failures = failures + failed if failed else 0
+                    if failures >= 5:
+                        logger.error('Workers keep failing on startup, stopping')
+                        stopping = True
+                elif signum == signal.SIGHUP and not stopping:
+                    logger.info('Restarting workers')
+                    for child in children.values():
+                        if child['state'] in ('starting', 'running'):
+                            child['state'] = 'retiring'
+                else:
+                    stopping = True
+            if stopping:
+                if deadline is None:
+                    logger.info('Stopping workers')
+                    deadline = time.monotonic() + stop_timeout
+                    for pid in children:
+                        os.kill(pid, signal.SIGTERM)
+                if not children:
+                    return failures < 5
+                if time.monotonic() >= deadline:
+                    logger.warning('Workers did not stop in %.0fs, killing them', stop_timeout)
+                    for pid in children:
+                        os.kill(pid, signal.SIGKILL)
+                    deadline = time.monotonic() + stop_timeout
+            else:
+                while sum(child['state'] in ('starting', 'running') for child in children.values()) < workers:
+                    pid = _spawn(app, host, port, threads, max_requests, control_w)
+                    children[pid] = {'state': 'starting', 'started': time.monotonic()}
+            timeout = max(0.0, deadline - time.monotonic()) if deadline is not None else None
+            for key, _ in selector.select(timeout):
+                try:
+                    while data := os.read(key.fd, 512):
+                        if key.fd == control_r:
+                            messages += data
+                except BlockingIOError:
+                    pass
+            *lines, messages = messages.split(b'\n')
+            for line in lines:
+                event, _, pid_str = line.decode().partition(' ')
+                child = children.get(int(pid_str))
+                if not child or stopping:
+                    continue
+                if event == 'ready' and child['state'] == 'starting':
+                    child['state'] = 'running'
+                    _retire_oldest(children)
+                elif event == 'retire' and child['state'] == 'running':
+                    child['state'] = 'retiring'
+    finally:
+        signal.set_wakeup_fd(-1)
+        selector.close()
+        for fd in (wakeup_r, wakeup_w, control_r, control_w):
+            os.close(fd)
+
+
+def cmd_serve(args: 'argparse.Namespace'):
+    rootdir = get_config_str('ROOTDIR')
+    mount = args.app or get_config_str('SERVE.APP') or get_config_str('uwsgi.mount', '/=app:app')
+    bind = args.bind or get_config_str('SERVE.BIND', '127.0.0.1:8000')
+    host, _, port = bind.rpartition(':')
+    workers = args.workers or int(get_config_str('SERVE.WORKERS') or os.cpu_count() or 1)
+    threads = args.threads or int(get_config_str('SERVE.THREADS', '4'))
+    max_requests = args.max_requests if args.max_requests is not None else \
+        int(get_config_str('SERVE.MAX_REQUESTS', '0'))
+
+    os.chdir(rootdir)
+    sys.path.insert(0, rootdir)
+    mountpoint, _, spec = mount.rpartition('=')
+    try:
+        app = mounted(preload.load(spec), mountpoint)
+    except (ImportError, AttributeError, OSError) as exc:
+        logger.error('Cannot load WSGI app %r: %s', spec, exc)
+        sys.exit(1)
+    gc.collect()
+    gc.freeze()
+    try:
+        ok = serve(app, host.strip('[]') or '0.0.0.0', int(port), workers, threads, max_requests,
+                   float(get_config_str('SERVE.STOP_TIMEOUT', '30')))
+    except OSError as exc:
+        logger.error('Cannot listen on %s: %s', bind, exc)
+        sys.exit(1)
+    if not ok:
+        sys.exit(1)
+
+
+def setup_parser(cmd: str, parser: 'argparse.ArgumentParser'):
+    parser.add_argument('-a', '--app', help='App mount (default: SERVE.APP, uwsgi.mount or /=app:app)')
+    parser.add_argument('-b', '--bind', help='host:port to listen on (default: SERVE.BIND or 127.0.0.1:8000)')
+    parser.add_argument('-w', '--workers', type=int, help='Worker processes (default: SERVE.WORKERS or CPU count)')
+    parser.add_argument('-t', '--threads', type=int, help='Threads per worker (default: SERVE.THREADS or 4)')
+    parser.add_argument('--max-requests', type=int,
+                        help='Recycle a worker after this many requests, 0 to disable (default: SERVE.MAX_REQUESTS)')
+    parser.set_defaults(call=cmd_serve)
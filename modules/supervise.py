@@ -0,0 +1,348 @@
+"""Lightweight supervisor owning the app's services as child processes.
+
+Services come from the ``services(ctl)`` hook of the configured modules (``uwsgi``, ``celery``)
+and from the ``[SUPERVISE]`` config section: ``SERVICES`` limits and orders them, and any other
+key names a service whose value is its shell command (overriding a module's command). Children
+are reaped on SIGCHLD and restarted with exponential backoff; SIGHUP reloads them and status is
+served as JSON on a unix socket under ``var/run``.
+"""
+import json
+import os
+from os import path as op
+import re
+import selectors
+import signal
+import socket
+import subprocess
+import sys
+import time
+from typing import Any, TYPE_CHECKING
+if TYPE_CHECKING:
+    import argparse
+
+from .. import base, format_table, get_config_dict, get_config_str, logger, readiness, MODULES
+from .uwsgi import current_slot
+
+
+COMMANDS = {'supervise': 'Run app services under a supervisor'}
+
+BACKOFF_START = 1.0
+
+
+def _runtime_file(rootdir: str, ext: str):
+    slot = current_slot(rootdir)
+    return op.join(rootdir, 'var', 'run', f'supervise.{slot}.{ext}' if slot else f'supervise.{ext}')
+
+
+def service_specs() -> dict[str, dict[str, Any]]:
+    """Return ``{name: {'command', 'stop_signal', 'reload_signal'}}`` for the configured services."""
+    ctl = [sys.executable, op.realpath(sys.argv[0])]
+    specs: dict[str, dict[str, Any]] = {}
+    for module_name in dict.fromkeys(MODULES):
+        module = base.import_module(module_name)
+        hook = getattr(module, 'services', None)
+        if hook:
+            specs.update(hook(ctl))
+    config = get_config_dict('SUPERVISE.')
+    names = [name for name in re.split(r'\s+', config.pop('SERVICES', '')) if name]
+    for name, command in config.items():
+        if name not in ('SOCKET', 'STOP_TIMEOUT', 'BACKOFF_MAX'):
+            spec = specs.setdefault(name, {'stop_signal': signal.SIGTERM, 'reload_signal': None})
+            spec['command'] = ['bash', '-c', f'exec {command}']
+    names = names or list(specs)
+    for name in names:
+        if name not in specs:
+            raise ValueError(f'Unknown service: {name}')
+    return {name: specs[name] for name in names}
+
+
+def _spawn(rootdir: str, name: str, service: dict[str, Any]):
+    logfile = op.join(rootdir, 'var', 'log', f'{name}.log')
+    with open(logfile, 'ab') as log:
+        service['proc'] = subprocess.Popen(
+            service['spec']['command'], cwd=rootdir, stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT,
+            start_new_session=True)
+    service.update(state='running', started=time.time(), next_start=None)
+    logger.info('Started %s (pid %s)', name, service['proc'].pid)
+
+
+def _signal(name: str, service: dict[str, Any], signum: int):
+    proc = service.get('proc')
+    if proc and proc.returncode is None:
+        logger.info('Sending %s to %s (pid %s)', signal.Signals(signum).name, name, proc.pid)
+        try:
+            os.kill(proc.pid, signum)
+        except ProcessLookupError:
+            pass
+
+
+def _reap(services: dict[str, dict[str, Any]], stopping: bool, backoff_max: float):
+    by_pid = {service['proc'].pid: name for name, service in services.items()
+              if service.get('proc') and service['proc'].returncode is None}
+    while True:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            return
+        if not pid:
+            return
+        name = by_pid.get(pid)
+        if not name:
+            continue
+        service = services[name]
+        service['proc'].returncode = code = os.waitstatus_to_exitcode(status)
+        service['last_exit'] = f'signal {signal.Signals(-code).name}' if code < 0 else f'exit {code}'
+        uptime = time.time() - service['started']
+        if stopping or service['state'] == 'stopping':
+            service['state'] = 'stopped'
+            logger.info('%s stopped (%s)', name, service['last_exit'])
+            continue
+        if service['state'] == 'restarting':
+            service.update(state='backoff', next_start=time.monotonic())
+            continue
+        delay = BACKOFF_START if uptime > backoff_max else service['backoff']
+        service.update(state='backoff', next_start=time.monotonic() + delay, backoff=min(delay * 2, backoff_max))
+        service['restarts'] += 1
+        logger.warning('%s exited (%s) after %.1fs, restarting in %.0fs', name, service['last_exit'], uptime, delay)
+
+
+def _reload(services: dict[str, dict[str, Any]], names: list[str], restart: bool):
+    """Send the reload signal to *names* (all if empty), restarting services without one."""
+    for name in names or services:
+        service = services[name]
+        signum = None if restart else service['spec']['reload_signal']
+        if signum:
+            _signal(name, service, signum)
+        elif service['state'] == 'running':
+            service['state'] = 'restarting'
+            _signal(name, service, service['spec']['stop_signal'])
+        elif service['state'] == 'backoff':
+            service.update(next_start=time.monotonic(), backoff=BACKOFF_START)
+
+
+def _status(services: dict[str, dict[str, Any]]):
+    res = {}
+    for name, service in services.items():
+        proc = service.get('proc')
+        running = proc is not None and proc.returncode is None
+        res[name] = {
+            'state': service['state'],
+            'pid': proc.pid if running else None,
+            'uptime': round(time.time() - service['started'], 1) if running else None,
+            'restarts': service['restarts'],
+            'last_exit': service.get('last_exit'),
+        }
+    return {'pid': os.getpid(), 'services': res}
+
+
+def _handle_client(conn: socket.socket, services: dict[str, dict[str, Any]], state: dict[str, Any]):
+    conn.settimeout(1.0)
+    try:
+        words = conn.makefile('rb').readline(4096).decode('utf-8', 'replace').split()
+        command, names = (words[0], words[1:]) if words else ('status', [])
+        unknown = [name for name in names if name not in services]
+        if unknown:
+            reply: dict[str, Any] = {'error': f'Unknown service: {" ".join(unknown)}'}
+        elif command == 'status':
+            reply = _status(services)
+        elif command in ('reload', 'restart'):
+            _reload(services, names, command == 'restart')
+            reply = {'ok': command}
+        elif command == 'stop':
+            state['stopping'] = True
+            reply = {'ok': command}
+        else:
+            reply = {'error': f'Unknown command: {command}'}
+        conn.sendall(json.dumps(reply).encode('utf-8') + b'\n')
+    except OSError as exc:
+        logger.debug('Status client error: %s', exc)
+    finally:
+        conn.close()
+
+
+def run(rootdir: str, specs: dict[str, dict[str, Any]], sock_path: str, stop_timeout: float, backoff_max: float):
+    """Run *specs* until SIGTERM/SIGINT or a ``stop`` request, then stop them and return."""
+    os.makedirs(op.join(rootdir, 'var', 'run'), mode=0o755, exist_ok=True)
+    os.makedirs(op.join(rootdir, 'var', 'log'), mode=0o755, exist_ok=True)
+    services = {name: {'spec': spec, 'state': 'backoff', 'next_start': 0.0, 'restarts': 0, 'backoff': BACKOFF_START,
+                       'started': time.time()} for name, spec in specs.items()}
+    state: dict[str, Any] = {'stopping': False}
+    pending: list[int] = []
+    wakeup_r, wakeup_w = os.pipe()
+    os.set_blocking(wakeup_r, False)
+    os.set_blocking(wakeup_w, False)
+    signal.set_wakeup_fd(wakeup_w)
+    for signum in (signal.SIGCHLD, signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+        signal.signal(signum, lambda signum, frame: pending.append(signum))
+
+    if op.exists(sock_path):
+        os.unlink(sock_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(sock_path)
+    server.listen(16)
+    server.setblocking(False)
+    pidfile = _runtime_file(rootdir, 'pid')
+    with open(pidfile, 'w') as pid_file:
+        pid_file.write(f'{os.getpid()}\n')
+    selector = selectors.DefaultSelector()
+    selector.register(wakeup_r, selectors.EVENT_READ)
+    selector.register(server, selectors.EVENT_READ)
+    logger.info('Supervising: %s (status socket: %s)', ' '.join(services), sock_path)
+    deadline = None
+    try:
+        while True:
+            while pending:
+                signum = pending.pop(0)
+                if signum == signal.SIGCHLD:
+                    _reap(services, state['stopping'], backoff_max)
+                elif signum == signal.SIGHUP:
+                    _reload(services, [], False)
+                else:
+                    state['stopping'] = True
+            if state['stopping']:
+                if deadline is None:
+                    logger.info('Stopping services')
+                    deadline = time.monotonic() + stop_timeout
+                    for name, service in services.items():
+                        if service['state'] in ('running', 'restarting'):
+                            service['state'] = 'stopping'
+                            _signal(name, service, service['spec']['stop_signal'])
+                        elif service['state'] == 'backoff':
+                            service['state'] = 'stopped'
+                if all(service['state'] == 'stopped' for service in services.values()):
+                    return
+                if time.monotonic() >= deadline:
+                    for name, service in services.items():
+                        _signal(name, service, signal.SIGKILL)
+                    deadline = time.monotonic() + stop_timeout
+            else:
+                now = time.monotonic()
+                for name, service in services.items():
+                    if service['state'] == 'backoff' and service['next_start'] is not None \
+                            and service['next_start'] <= now:
+                        try:
+                            _spawn(rootdir, name, service)
+                        except OSError as exc:
+                            logger.error('Cannot start %s: %s', name, exc)
+                            service['backoff'] = min(service['backoff'] * 2, backoff_max)
+                            service['next_start'] = now + service['backoff']
+            waits = [service['next_start'] - time.monotonic() for service in services.values()
+                     if service['state'] == 'backoff' and service['next_start'] is not None]
+            if deadline is not None:
+                waits.append(deadline - time.monotonic())
+            timeout = max(0.0, min(waits)) if waits else None
+            for key, _ in selector.select(timeout):
+                if key.fileobj == wakeup_r:
+                    try:
+                        while os.read(wakeup_r, 512):
+                            pass
+                    except BlockingIOError:
+                        pass
+                else:
+                    try:
+                        conn, _ = server.accept()
+                    except BlockingIOError:
+                        continue
+                    _handle_client(conn, services, state)
+    finally:
+        signal.set_wakeup_fd(-1)
+        selector.close()
+        server.close()
+        for filename in (sock_path, pidfile):
+            try:
+                os.unlink(filename)
+            except OSError:
+                pass
+        logger.info('Supervisor stopped')
+
+
+def request(sock_path: str, command: str, timeout: float = 5.0) -> dict[str, Any]:
+    """Send *command* to the supervisor listening on *sock_path* and return its JSON reply."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(sock_path)
+        sock.sendall(command.encode('utf-8') + b'\n')
+        reply = json.loads(sock.makefile('rb').readline() or b'{}')
+    if 'error' in reply:
+        raise ValueError(reply['error'])
+    return reply
+
+
+def _print_status(status: dict[str, Any]):
+    rows = [('SERVICE', 'STATE', 'PID', 'UPTIME', 'RESTARTS', 'LAST EXIT')]
+    for name, service in status['services'].items():
+        rows.append((name, service['state'], str(service['pid'] or '-'),
+                     '-' if service['uptime'] is None else f'{service["uptime"]:.0f}s',
+                     str(service['restarts']), service['last_exit'] or '-'))
+    print(f'supervisor pid: {status["pid"]}')
+    print('\n'.join(format_table(rows)))
+
+
+def cmd_supervise(args: 'argparse.Namespace'):
+    rootdir = get_config_str('ROOTDIR')
+    sock_path = op.join(rootdir, get_config_str('SUPERVISE.SOCKET') or _runtime_file(rootdir, 'sock'))
+    stop_timeout = float(get_config_str('SUPERVISE.STOP_TIMEOUT', '30'))
+    command = args.command
+    try:
+        if command == 'run':
+            try:
+                specs = service_specs()
+            except ValueError as exc:
+                logger.error('%s', exc)
+                sys.exit(1)
+            if not specs:
+                logger.error('No services configured')
+                sys.exit(1)
+            run(rootdir, specs, sock_path, stop_timeout, float(get_config_str('SUPERVISE.BACKOFF_MAX', '60')))
+        elif command == 'start':
+            if readiness.probe(f'unix://{sock_path}'):
+                logger.error('Supervisor already running')
+                sys.exit(1)
+            os.makedirs(op.join(rootdir, 'var', 'log'), mode=0o755, exist_ok=True)
+            with open(op.join(rootdir, 'var', 'log', 'supervise.log'), 'ab') as log:
+                proc = subprocess.Popen([sys.executable, op.realpath(sys.argv[0]), 'supervise', 'run'], cwd=rootdir,
+                                        stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT,
+                                        start_new_session=True)
+            if readiness.wait_for(lambda: proc.poll() is not None or readiness.probe(f'unix://{sock_path}'),
+                                  10, 'supervisor to start') is None or proc.returncode is not None:
+                logger.error('Supervisor failed to start, see var/log/supervise.log')
+                sys.exit(1)
+            logger.info('Supervisor started (pid %s)', proc.pid)
+        elif command == 'stop':
+            try:
+                pid = request(sock_path, 'status')['pid']
+            except (FileNotFoundError, ConnectionRefusedError):
+                logger.error('Supervisor not running (no %s)', sock_path)
+                sys.exit(1)
+            request(sock_path, 'stop')
+            if readiness.wait_for(lambda: not readiness.pid_alive(pid), stop_timeout * 2 + 5,
+                                  f'supervisor (pid {pid}) to exit') is None:
+                sys.exit(1)
+            logger.info('Supervisor stopped')
+        elif command == 'status':
+            status = request(sock_path, 'status')
+            if args.json:
+                print(json.dumps(status))
+            else:
+                _print_status(status)
+        else:
+            request(sock_path, ' '.join([command] + args.service))
+            logger.info('%s requested: %s', command.capitalize(), ' '.join(args.service) or 'all services')
+    except (OSError, ValueError) as exc:
+        logger.error('Supervisor request failed (%s): %s', sock_path, exc)
+        sys.exit(1)
+
+
+def setup_parser(cmd: str, parser: 'argparse.ArgumentParser'):
+    parser_sub = parser.add_subparsers(dest='command', help='Supervisor operation')
+    parser_sub.required = True
+    parser_sub.add_parser('run', help='Run the supervisor in the foreground')
+    parser_sub.add_parser('start', help='Start the supervisor in the background')
+    parser_sub.add_parser('stop', help='Stop all services and the supervisor')
+    parser_status = parser_sub.add_parser('status', help='Show service status')
+    parser_status.add_argument('--json', action='store_true', default=False, help='Print JSON')
+    for name, help_str in (('reload', 'Reload services (SIGHUP where supported, restart otherwise)'),
+                           ('restart', 'Restart services')):
+        parser_cmd = parser_sub.add_parser(name, help=help_str)
+        parser_cmd.add_argument('service', nargs='*', help='Service names (default: all)')
+    parser.set_defaults(call=cmd_supervise, use_venv=False)
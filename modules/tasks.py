@@ -0,0 +1,250 @@
+"""Task runner for the ``[TASKS]`` config section (``ctl task``).
+
+Each ``<name> = <command>`` entry is a task; ``<name>.deps``, ``<name>.inputs`` and
+``<name>.outputs`` list the tasks it depends on and the files (globs relative to the project root,
+``**`` allowed, directories taken whole) it reads and writes. Independent tasks run in parallel.
+A task is skipped when its command and the contents of its inputs, and of its dependencies'
+outputs, hash to the same key as on its last success and its outputs exist. Tasks without inputs
+always run. Keys and file digests are cached in the virtualenv.
+"""
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+import hashlib
+import json
+import os
+from os import path as op
+import re
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, TYPE_CHECKING
+if TYPE_CHECKING:
+    import argparse
+
+from .. import file_sha256, format_table, get_config_dict, get_config_str, logger
+from ..buildcache import expand
+
+
+COMMANDS = {'task': 'Run tasks from the [TASKS] config section'}
+
+CACHE_FILE = '.runlib-tasks.json'
+ATTRIBUTES = ('deps', 'inputs', 'outputs')
+
+_output_lock = threading.Lock()
+_cache_lock = threading.Lock()
+
+
+def _split(value: str):
+    return [elem for elem in re.split(r'[\s,]+', value) if elem]
+
+
+def load_tasks() -> dict[str, dict[str, Any]]:
+    """Return ``{name: {'command', 'deps', 'inputs', 'outputs'}}`` from the ``[TASKS]`` section."""
+    config = get_config_dict('TASKS.')
+    res: dict[str, dict[str, Any]] = {}
+    for key, value in config.items():
+        if '.' not in key:
+            res[key] = {'command': value.strip(), 'deps': [], 'inputs': [], 'outputs': []}
+    for key, value in config.items():
+        name, _, attr = key.rpartition('.')
+        if not name:
+            continue
+        if name not in res:
+            raise ValueError(f'Option {key} for undefined task {name}')
+        if attr not in ATTRIBUTES:
+            raise ValueError(f'Unknown task option: {key} (expected: {", ".join(ATTRIBUTES)})')
+        res[name][attr] = _split(value)
+    for name, task in res.items():
+        for dep in task['deps']:
+            if dep not in res:
+                raise ValueError(f'Task {name} depends on undefined task {dep}')
+    return res
+
+
+def closure(tasks: dict[str, dict[str, Any]], names: list[str]):
+    """Return *names* and their dependencies in dependency order, raising ValueError on cycles."""
+    res: list[str] = []
+    visiting: list[str] = []
+
+    def visit(name: str):
+        if name in res:
+            return
+        if name in visiting:
+            raise ValueError(f'Dependency cycle: {" -> ".join(visiting[visiting.index(name):] + [name])}')
+        visiting.append(name)
+        for dep in tasks[name]['deps']:
+            visit(dep)
+        visiting.pop()
+        res.append(name)
+
+    for name in names:
+        if name not in tasks:
+            raise ValueError(f'Unknown task: {name} (defined: {", ".join(tasks) or "none"})')
+        visit(name)
+    return res
+
+
+def _digest(filename: str, files: dict[str, list[Any]]):
+    """Return the sha256 of *filename*, reusing the cached one while its mtime and size match."""
+    stat = os.stat(filename)
+    cached = files.get(filename)
+    if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+        return cached[2]
+    digest = file_sha256(filename)
+    with _cache_lock:
+        files[filename] = [stat.st_mtime_ns, stat.st_size, digest]
+    return digest
+
+
+def task_key(rootdir: str, tasks: dict[str, dict[str, Any]], name: str, cache: dict[str, Any]):
+    """Return the cache key of task *name*, or None if it declares no inputs."""
+    task = tasks[name]
+    if not task['inputs']:
+        return None
+    patterns = task['inputs'] + [pattern for dep in task['deps'] for pattern in tasks[dep]['outputs']]
+    digest = hashlib.sha256(f'{task["command"]}\n'.encode('utf-8'))
+    for filename in expand(rootdir, patterns):
+        try:
+            file_digest = _digest(op.join(rootdir, filename), cache['files'])
+        except OSError:
+            file_digest = '-'
+        digest.update(f'{filename}\0{file_digest}\n'.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def load_cache(filename: str) -> dict[str, Any]:
+    try:
+        with open(filename) as cache_file:
+            data = json.load(cache_file)
+    except (OSError, ValueError):
+        data = {}
+    if not isinstance(data, dict):
+        data = {}
+    data.setdefault('tasks', {})
+    data.setdefault('files', {})
+    return data
+
+
+def save_cache(filename: str, cache: dict[str, Any]):
+    if not op.isdir(op.dirname(filename)):
+        return
+    tmpname = f'{filename}.{os.getpid()}'
+    with _cache_lock:
+        cache['files'] = {name: val for name, val in cache['files'].items() if op.exists(name)}
+        try:
+            with open(tmpname, 'w') as cache_file:
+                json.dump(cache, cache_file, indent=1, sort_keys=True)
+            os.replace(tmpname, filename)
+        except OSError as exc:
+            logger.warning('Cannot write task cache: %s', exc)
+
+
+def _run_command(rootdir: str, command: str, prefix: str):
+    """Run *command* in *rootdir*, prefixing each output line; return its exit code."""
+    with subprocess.Popen(command, shell=True, cwd=rootdir, stdin=subprocess.DEVNULL,
+                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT) as proc:
+        assert proc.stdout
+        for line in proc.stdout:
+            with _output_lock:
+                sys.stdout.buffer.write(prefix.encode('utf-8') + line)
+                sys.stdout.flush()
+    return proc.returncode
+
+
+def _run_task(rootdir: str, tasks: dict[str, dict[str, Any]], name: str, cache: dict[str, Any],
+              force: bool, prefix: str):
+    started = time.time()
+    key = task_key(rootdir, tasks, name, cache)
+    if not force and key is not None and cache['tasks'].get(name) == key \
+            and all(expand(rootdir, [pattern]) for pattern in tasks[name]['outputs']):
+        return 'cached', time.time() - started
+    logger.info('%sRunning: %s', prefix, tasks[name]['command'])
+    returncode = _run_command(rootdir, tasks[name]['command'], prefix)
+    if returncode:
+        return f'exit {returncode}', time.time() - started
+    with _cache_lock:
+        if key is None:
+            cache['tasks'].pop(name, None)
+        else:
+            cache['tasks'][name] = key
+    return 'ok', time.time() - started
+
+
+def run(rootdir: str, tasks: dict[str, dict[str, Any]], names: list[str], cache_file: str,
+        jobs: int, force: bool = False, keep_going: bool = False) -> dict[str, tuple[str, float]]:
+    """Run tasks *names* (in dependency order) with up to *jobs* in parallel, caching keys in *cache_file*.
+
+    Return ``{name: (status, seconds)}``; status is ``ok``, ``cached``, ``exit <code>`` or ``skipped``
+    (a dependency failed, or an earlier failure stopped the run without *keep_going*).
+    """
+    cache = load_cache(cache_file)
+    width = max(len(name) for name in names)
+    results: dict[str, tuple[str, float]] = {}
+    pending = list(names)
+    running: dict[Future[tuple[str, float]], str] = {}
+    failed = False
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        while pending or running:
+            for name in list(pending):
+                deps = [results.get(dep, ('', 0.0))[0] for dep in tasks[name]['deps']]
+                if (failed and not keep_going) or any(status not in ('', 'ok', 'cached') for status in deps):
+                    results[name] = ('skipped', 0.0)
+                    pending.remove(name)
+                elif all(deps) and len(running) < jobs:
+                    prefix = f'[{name}]'.ljust(width + 3)
+                    running[executor.submit(_run_task, rootdir, tasks, name, cache, force, prefix)] = name
+                    pending.remove(name)
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except OSError as exc:
+                    logger.error('Task %s: %s', name, exc)
+                    results[name] = ('error', 0.0)
+                if results[name][0] == 'ok':
+                    save_cache(cache_file, cache)
+                elif results[name][0] != 'cached':
+                    failed = True
+    return {name: results[name] for name in names}
+
+
+def _print_summary(results: dict[str, tuple[str, float]]):
+    rows = [('TASK', 'STATUS', 'TIME')]
+    rows.extend((name, status, f'{elapsed:.1f}s') for name, (status, elapsed) in results.items())
+    print('\n'.join(format_table(rows)))
+
+
+def cmd_task(args: 'argparse.Namespace'):
+    rootdir = get_config_str('ROOTDIR')
+    try:
+        tasks = load_tasks()
+        names = closure(tasks, args.name)
+    except ValueError as exc:
+        logger.error('%s', exc)
+        sys.exit(1)
+    cache_file = op.join(args.venv, CACHE_FILE)
+    if not args.name:
+        cache = load_cache(cache_file)
+        for name, task in tasks.items():
+            key = task_key(rootdir, tasks, name, cache)
+            state = 'no inputs' if key is None else ('cached' if cache['tasks'].get(name) == key else 'stale')
+            deps = f' (after: {", ".join(task["deps"])})' if task['deps'] else ''
+            print(f'{name}: {task["command"]}{deps}  [{state}]')
+        return
+    results = run(rootdir, tasks, names, cache_file, args.jobs or os.cpu_count() or 1, args.force, args.keep_going)
+    _print_summary(results)
+    if any(status not in ('ok', 'cached') for status, _ in results.values()):
+        sys.exit(1)
+
+
+def setup_parser(cmd: str, parser: 'argparse.ArgumentParser'):
+    parser.add_argument('name', nargs='*', help='Tasks to run with their dependencies (none: list tasks)')
+    parser.add_argument('-j', '--jobs', type=int, help='Tasks run in parallel (default: CPU count)')
+    parser.add_argument('-f', '--force', action='store_true', default=False,
+                        help='Run the tasks even if their inputs are unchanged')
+    parser.add_argument('-k', '--keep-going', action='store_true', default=False,
+                        help='Keep starting tasks not depending on a failed one')
+    parser.set_defaults(call=cmd_task)
@@ -1,21 +1,157 @@
+import json
 import os
 from os import path as op
+import re
+import signal
+import socket as socket_mod
 import subprocess
 import sys
-from typing import TYPE_CHECKING
+import time
+from typing import Any, TYPE_CHECKING
 if TYPE_CHECKING:
     import argparse
 
-from .. import get_config_str, logger
+from .. import format_table, get_config_str, logger, preload, readiness
 
 
 COMMANDS = {'uwsgi': 'UWSGI command'}
 
+SLOT_ENV = 'RUNLIB_SLOT'
+FRONT_SOCKET = 'uwsgi.socket'
+
+
+def active_slot(rootdir: str):
+    """Return the blue-green slot the front socket symlink points to, or '' if there is none."""
+    try:
+        target = os.readlink(op.join(rootdir, 'var', 'run', FRONT_SOCKET))
+    except OSError:
+        return ''
+    match = re.fullmatch(r'uwsgi\.(\w+)\.socket', target)
+    return match.group(1) if match else ''
+
+
+def current_slot(rootdir: str):
+    """Return the slot set in the environment by a blue-green relink, or the active one."""
+    slot = os.environ.get(SLOT_ENV)
+    return active_slot(rootdir) if slot is None else slot
+
+
+def _runtime_file(rootdir: str, slot: str | None, ext: str):
+    slot = current_slot(rootdir) if slot is None else slot
+    return op.join(rootdir, 'var', 'run', f'uwsgi.{slot}.{ext}' if slot else f'uwsgi.{ext}')
+
+
+def runtime_files(rootdir: str, slot: str | None = None):
+    """Return ``(pidfile, socket)`` paths of the uwsgi instance in *slot* (default: current)."""
+    return _runtime_file(rootdir, slot, 'pid'), _runtime_file(rootdir, slot, 'socket')
+
+
+def read_stats(address: str, timeout: float = 2.0) -> dict[str, Any]:
+    """Read the JSON document served by the uwsgi stats server at *address* (unix path or host:port)."""
+    if address.startswith('/') or ':' not in address:
+        sock = socket_mod.socket(socket_mod.AF_UNIX, socket_mod.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(address)
+        except OSError:
+            sock.close()
+            raise
+    else:
+        host, _, port = address.rpartition(':')
+        sock = socket_mod.create_connection((host or 'localhost', int(port)), timeout=timeout)
+    with sock:
+        chunks = []
+        while chunk := sock.recv(65536):
+            chunks.append(chunk)
+    return json.loads(b''.join(chunks).decode('utf-8', 'replace'))
+
+
+def stats_sample(stats: dict[str, Any], previous: dict[str, Any] | None, elapsed: float) -> dict[str, Any]:
+    """Summarize raw *stats*, computing requests/sec from the *previous* sample taken *elapsed* seconds ago."""
+    before = {worker['id']: worker for worker in (previous or {}).get('workers', [])}
+    workers = []
+    for worker in stats.get('workers', []):
+        old = before.get(worker['id'])
+        rps = None
+        if old is not None and old.get('pid') == worker.get('pid') and elapsed > 0:
+            rps = round(max(worker.get('requests', 0) - old.get('requests', 0), 0) / elapsed, 2)
+        memory = readiness.memory_usage(worker.get('pid') or 0)
+        workers.append({
+            'id': worker['id'],
+            'pid': worker.get('pid'),
+            'status': worker.get('status', ''),
+            'requests': worker.get('requests', 0),
+            'rps': rps,
+            'avg_ms': round(worker.get('avg_rt', 0) / 1000, 2),
+            'rss': worker.get('rss') or memory.get('rss') or readiness.proc_rss(worker.get('pid') or 0),
+            'pss': memory.get('pss'),
+            'uss': memory.get('uss'),
+            'exceptions': worker.get('exceptions', 0),
+            'respawns': worker.get('respawn_count', 0),
+        })
+    sockets = stats.get('sockets', [])
+    master = readiness.memory_usage(stats.get('pid') or 0)
+    return {
+        'time': round(time.time(), 3),
+        'pid': stats.get('pid'),
+        'master_pss': master.get('pss'),
+        'total_pss': (sum(worker['pss'] for worker in workers) + master['pss']
+                      if master and all(worker['pss'] is not None for worker in workers) else None),
+        'listen_queue': stats.get('listen_queue', sum(sock.get('queue', 0) for sock in sockets)),
+        'listen_queue_max': max((sock.get('max_queue', 0) for sock in sockets), default=0),
+        'listen_queue_errors': stats.get('listen_queue_errors', 0),
+        'busy': sum(1 for worker in workers if worker['status'] == 'busy'),
+        'workers': workers,
+    }
+
+
+def _format_table(sample: dict[str, Any]):
+    lines = [f'master pid: {sample["pid"]}  busy: {sample["busy"]}/{len(sample["workers"])}  '
+             f'listen queue: {sample["listen_queue"]}'
+             + (f'/{sample["listen_queue_max"]}' if sample['listen_queue_max'] else '')
+             + f' (overflows: {sample["listen_queue_errors"]})'
+             + (f'  total PSS: {sample["total_pss"] / 2**20:.1f} MB' if sample['total_pss'] is not None else '')]
+    rows = [('WORKER', 'PID', 'STATUS', 'REQUESTS', 'RPS', 'AVG MS', 'RSS MB', 'PSS MB', 'USS MB', 'EXC', 'RESPAWNS')]
+    for worker in sample['workers']:
+        rows.append((str(worker['id']), str(worker['pid']), worker['status'], str(worker['requests']),
+                     '-' if worker['rps'] is None else f'{worker["rps"]:.1f}', f'{worker["avg_ms"]:.1f}',
+                     *('-' if worker[key] is None else f'{worker[key] / 2**20:.1f}' for key in ('rss', 'pss', 'uss')),
+                     str(worker['exceptions']), str(worker['respawns'])))
+    lines.extend(format_table(rows, numeric=True))
+    return '\n'.join(lines)
+
+
+def show_stats(address: str, interval: float, count: int | None, as_json: bool):
+    """Poll the stats server every *interval* seconds, printing *count* samples (None: until interrupted)."""
+    refresh = not as_json and count is None and sys.stdout.isatty()
+    previous, taken = read_stats(address), time.monotonic()
+    shown = 0
+    try:
+        while count is None or shown < count:
+            time.sleep(interval)
+            stats, now = read_stats(address), time.monotonic()
+            sample = stats_sample(stats, previous, now - taken)
+            previous, taken = stats, now
+            if as_json:
+                print(json.dumps(sample), flush=True)
+            else:
+                print(('\033[H\033[2J' if refresh else '') + _format_table(sample), flush=True)
+            shown += 1
+    except KeyboardInterrupt:
+        pass
+
+
+def services(ctl: list[str]) -> dict[str, dict[str, Any]]:
+    """Services run by ``ctl supervise``: uwsgi in the foreground, stopped like ``uwsgi --stop``."""
+    return {'uwsgi': {'command': ctl + ['uwsgi', 'start', '--foreground'],
+                      'stop_signal': signal.SIGINT, 'reload_signal': signal.SIGHUP}}
+
 
 def cmd_uwsgi(args: 'argparse.Namespace'):
     rootdir = get_config_str('ROOTDIR')
 
-    pidfile = op.join(rootdir, 'var', 'run', 'uwsgi.pid')
+    pidfile, default_socket = runtime_files(rootdir)
+    stats_socket = _runtime_file(rootdir, None, 'stats')
     logfile = op.join(rootdir, 'var', 'log', 'uwsgi.log')
 
     command = args.command
@@ -28,15 +164,23 @@ def cmd_uwsgi(args: 'argparse.Namespace'):
         os.chdir(rootdir)
         os.makedirs(op.join('var', 'run'), mode=0o755, exist_ok=True)
         os.makedirs(op.join('var', 'log'), mode=0o755, exist_ok=True)
-        socket = args.socket or op.join(rootdir, 'var', 'run', 'uwsgi.socket')
+        socket = args.socket or default_socket
         call = ['uwsgi', '--logdate', '--manage-script-name',  '--master', '--enable-threads',
-                '--daemonize', logfile, '--pidfile', pidfile,
+                *(() if args.foreground else ('--daemonize', logfile)), '--pidfile', pidfile,
                 '--socket', socket, '--plugin', args.plugin, '--virtualenv', args.venv,
+                '--stats', stats_socket, '--memory-report',
                 '--ini', get_config_str('CONFIG')]
-        if args.app:
+        if args.app and args.preload:
+            mountpoint, _, app = args.app.rpartition('=')
+            call.extend(['--mount', f'{mountpoint or "/"}={preload.__name__}:application',
+                         '--env', f'{preload.APP_ENV}={app}', '--set', 'lazy-apps=false'])
+        elif args.app:
             call.extend(['--mount', args.app])
         if not socket.startswith('/'):
             call.extend(['--protocol', 'http'])
+        if args.foreground:
+            sys.stdout.flush()
+            os.execvp(call[0], call)
         res = subprocess.run(call)
         if res.returncode == 0:
             logger.info('UWSGI process started and daemonized')
@@ -44,12 +188,19 @@ def cmd_uwsgi(args: 'argparse.Namespace'):
             logger.info('UWSGI process start failed with return code %s', res.returncode)
             sys.exit(1)
     elif command == 'stop':
-        res = subprocess.run(['uwsgi', '--stop', op.join(rootdir, 'var', 'run', 'uwsgi.pid')])
+        res = subprocess.run(['uwsgi', '--stop', pidfile])
         if res.returncode == 0:
             logger.info('UWSGI process stopped')
         else:
             logger.info('UWSGI process stop failed with return code %s', res.returncode)
             sys.exit(1)
+    elif command in ('stats', 'top'):
+        count = args.count if args.count is not None else (None if command == 'top' or args.json else 1)
+        try:
+            show_stats(args.stats or stats_socket, args.interval, count, args.json)
+        except (OSError, ValueError) as exc:
+            logger.error('Cannot read UWSGI stats from %s: %s', args.stats or stats_socket, exc)
+            sys.exit(1)
 
 
 def setup_parser(cmd: str, parser: 'argparse.ArgumentParser'):
@@ -59,5 +210,17 @@ def setup_parser(cmd: str, parser: 'argparse.ArgumentParser'):
     parser_start.add_argument('-s', '--socket', help='Socket path')
     parser_start.add_argument('-a', '--app', default='/=app:app', help='App mount')
     parser_start.add_argument('-p', '--plugin', default='python3', help='UWSGI plugin (default: python3)')
+    parser_start.add_argument('--preload', action='store_true', default=False,
+                              help='Load the app in the master and gc.freeze() it before forking workers')
+    parser_start.add_argument('-f', '--foreground', action='store_true', default=False,
+                              help='Run in the foreground, logging to stderr (used by supervise)')
     parser_sub.add_parser('stop', help='Stop UWSGI')
+    for name, help_str in (('stats', 'Show per-worker stats'), ('top', 'Show refreshing per-worker stats')):
+        parser_stats = parser_sub.add_parser(name, help=help_str)
+        parser_stats.add_argument('-S', '--stats', help='Stats server address (default: var/run/uwsgi.stats)')
+        parser_stats.add_argument('-i', '--interval', type=float, default=1.0,
+                                  help='Seconds between samples (default: 1)')
+        parser_stats.add_argument('-n', '--count', type=int,
+                                  help='Number of samples (default: 1 for stats, unlimited for top and --json)')
+        parser_stats.add_argument('--json', action='store_true', default=False, help='Print JSON lines')
     parser.set_defaults(call=cmd_uwsgi, use_venv=False)
@@ -0,0 +1,430 @@
+"""Warm fork-server for ``ctl manage`` and ``ctl flask`` commands.
+
+``ctl zygote run`` imports the app once, through the ``zygote_commands()`` hook of the configured
+modules (Django setup, the Flask app) and the ``[ZYGOTE] PRELOAD`` modules, then listens on a
+unix socket under ``var/run``. A client sends its command, argv, environment and cwd with its
+stdio file descriptors attached; the zygote forks a child running the command on those fds and
+reports its exit status back. Signals received by the client are forwarded to the child.
+
+Before each fork the zygote checks the files of all loaded modules, the directories of loaded
+packages (so new modules are noticed), the paths returned by the ``zygote_watch()`` hook of the
+configured modules and the config; when one has changed it refuses the request (the client then
+runs the command itself), waits for its children and re-executes itself to import the new code.
+SIGHUP does the same.
+"""
+import importlib
+import json
+import os
+from os import path as op
+import re
+import selectors
+import signal
+import socket
+import subprocess
+import sys
+import time
+import traceback
+from typing import Any, Callable, TYPE_CHECKING
+if TYPE_CHECKING:
+    import argparse
+
+from .. import base, get_config_str, logger, readiness, MODULES
+from .uwsgi import current_slot
+
+
+COMMANDS = {'zygote': 'Warm fork-server for manage/flask commands'}
+
+DISABLE_ENV = 'RUNLIB_NO_ZYGOTE'
+FORWARDED_SIGNALS = (signal.SIGINT, signal.SIGTERM, signal.SIGHUP, signal.SIGQUIT, signal.SIGUSR1, signal.SIGUSR2)
+
+
+def socket_path(rootdir: str):
+    slot = current_slot(rootdir)
+    return op.join(rootdir, 'var', 'run', f'zygote.{slot}.sock' if slot else 'zygote.sock')
+
+
+def services(ctl: list[str]) -> dict[str, dict[str, Any]]:
+    """Services run by ``ctl supervise``: the zygote (SIGHUP re-imports the app)."""
+    return {'zygote': {'command': ctl + ['zygote', 'run'], 'stop_signal': signal.SIGTERM,
+                       'reload_signal': signal.SIGHUP}}
+
+
+def call(command: str, args: list[str]) -> int | None:
+    """Run *command* with *args* in a child of the zygote and return its exit code.
+
+    Return None when no zygote serves this release (not enabled, not running, restarting), so the
+    caller runs the command itself.
+    """
+    if 'zygote' not in MODULES or os.environ.get(DISABLE_ENV):
+        return None
+    rootdir = get_config_str('ROOTDIR')
+    sock_path = socket_path(rootdir)
+    if not op.exists(sock_path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(sock_path)
+        request = {'op': 'run', 'command': command, 'args': args, 'env': dict(os.environ), 'cwd': os.getcwd(),
+                   'rootdir': rootdir}
+        socket.send_fds(sock, [json.dumps(request).encode('utf-8') + b'\n'], [0, 1, 2])
+        replies = sock.makefile('rb')
+        reply = json.loads(replies.readline() or b'{}')
+    except (OSError, ValueError) as exc:
+        logger.debug('Zygote not available (%s): %s', sock_path, exc)
+        sock.close()
+        return None
+    if 'pid' not in reply:
+        logger.info('Zygote cannot run %s (%s), running it directly', command, reply.get('error', 'no reply'))
+        sock.close()
+        return None
+    pid = reply['pid']
+    logger.debug('Zygote forked %s (pid %s)', command, pid)
+
+    def forward(signum: int, frame: Any):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+    previous = {signum: signal.signal(signum, forward) for signum in FORWARDED_SIGNALS}
+    try:
+        result = json.loads(replies.readline() or b'{}')
+    finally:
+        for signum, handler in previous.items():
+            signal.signal(signum, handler)
+        sock.close()
+    if 'exit' not in result:
+        logger.error('Lost connection to the zygote running %s (pid %s)', command, pid)
+        return 1
+    return 128 - result['exit'] if result['exit'] < 0 else result['exit']
+
+
+def _warm_up() -> tuple[dict[str, Callable[[list[str]], Any]], list[str]]:
+    """Run the ``zygote_commands()`` hooks and preload modules; return the commands and extra watched paths."""
+    commands: dict[str, Callable[[list[str]], Any]] = {}
+    watched: list[str] = []
+    for module_name in dict.fromkeys(MODULES):
+        module = base.import_module(module_name)
+        hook = getattr(module, 'zygote_commands', None)
+        if hook:
+            try:
+                commands.update(hook())
+                watched.extend(getattr(module, 'zygote_watch', list)())
+            except Exception as exc:
+                logger.warning('Cannot warm up %s: %s', module_name, exc)
+    for module_name in re.split(r'[\s,]+', get_config_str('ZYGOTE.PRELOAD')):
+        if module_name:
+            importlib.import_module(module_name)
+    return commands, watched
+
+
+def _mtimes(paths: list[str]):
+    res: dict[str, int | None] = {}
+    for path in paths:
+        try:
+            res[path] = os.stat(path).st_mtime_ns
+        except OSError:
+            res[path] = None
+    return res
+
+
+def code_files(rootdir: str, extra: list[str] | None = None):
+    """Return the source files of all loaded modules, the directories of loaded packages and the config file."""
+    files = {op.join(rootdir, get_config_str('CONFIG')), *(extra or [])}
+    for module in list(sys.modules.values()):
+        if isinstance(filename := getattr(module, '__file__', None), str):
+            files.add(filename)
+        files.update(path for path in getattr(module, '__path__', None) or () if isinstance(path, str))
+    return sorted(files)
+
+
+def _recv_request(conn: socket.socket):
+    data, fds, _, _ = socket.recv_fds(conn, 65536, 3)
+    try:
+        while data and not data.endswith(b'\n'):
+            chunk = conn.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+        return json.loads(data or b'{}'), fds
+    except (OSError, ValueError):
+        for fd in fds:
+            os.close(fd)
+        raise
+
+
+def _reply(conn: socket.socket, message: dict[str, Any]):
+    try:
+        conn.sendall(json.dumps(message).encode('utf-8') + b'\n')
+    except OSError:
+        pass
+
+
+def _child(call: Callable[[list[str]], Any], request: dict[str, Any], fds: list[int], inherited: list[socket.socket]):
+    """Run *call* in the forked child on the client's stdio, cwd and environment; never returns."""
+    code = 1
+    try:
+        signal.set_wakeup_fd(-1)
+        for signum in (signal.SIGCHLD, signal.SIGTERM, signal.SIGHUP):
+            signal.signal(signum, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        for sock in inherited:
+            sock.close()
+        for target, fd in enumerate(fds):
+            os.dup2(fd, target)
+            os.close(fd)
+        for target, stream in enumerate((sys.stdin, sys.stdout, sys.stderr)):
+            stream.reconfigure(line_buffering=os.isatty(target))  # type: ignore[attr-defined]
+        os.chdir(request['cwd'])
+        os.environ.clear()
+        os.environ.update(request['env'])
+        call(request['args'])
+        code = 0
+    except SystemExit as exc:
+        if exc.code is None or isinstance(exc.code, int):
+            code = exc.code or 0
+        else:
+            print(exc.code, file=sys.stderr)
+    except KeyboardInterrupt:
+        traceback.print_exc()
+        code = 128 + signal.SIGINT
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        for stream in (sys.stdout, sys.stderr):
+            try:
+                stream.flush()
+            except (OSError, ValueError):
+                pass
+        os._exit(code)
+
+
+def _handle_client(conn: socket.socket, state: dict[str, Any], server: socket.socket):
+    conn.settimeout(5)
+    try:
+        request, fds = _recv_request(conn)
+    except (OSError, ValueError) as exc:
+        logger.warning('Bad zygote request: %s', exc)
+        conn.close()
+        return
+    children: dict[int, socket.socket] = state['children']
+    operation = request.get('op')
+    error = None
+    if operation == 'status':
+        _reply(conn, {'pid': os.getpid(), 'rootdir': state['rootdir'], 'commands': sorted(state['commands']),
+                      'uptime': round(time.time() - state['started'], 1), 'served': state['served'],
+                      'running': len(children), 'stale': state['stale']})
+    elif operation == 'stop':
+        state['stopping'] = True
+        _reply(conn, {'ok': True})
+    elif operation != 'run':
+        error = f'Unknown operation: {operation}'
+    elif request.get('command') not in state['commands']:
+        error = f'Command not preloaded: {request.get("command")}'
+    elif request.get('rootdir') != state['rootdir']:
+        error = f'Zygote serves {state["rootdir"]}'
+    elif len(fds) != 3:
+        error = 'Expected stdin, stdout and stderr'
+    elif state['stopping'] or state['stale'] or _mtimes(list(state['mtimes'])) != state['mtimes']:
+        state['stale'] = True
+        error = 'Code changed, restarting'
+    else:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if not pid:
+            _child(state['commands'][request['command']], request, fds, [server, conn, *children.values()])
+        for fd in fds:
+            os.close(fd)
+        conn.settimeout(None)
+        children[pid] = conn
+        state['served'] += 1
+        _reply(conn, {'pid': pid})
+        logger.info('Forked %s %s (pid %s)', request['command'], ' '.join(request['args']), pid)
+        return
+    for fd in fds:
+        os.close(fd)
+    if error:
+        _reply(conn, {'error': error})
+    conn.close()
+
+
+def _reap(children: dict[int, socket.socket]):
+    while True:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            return
+        if not pid:
+            return
+        conn = children.pop(pid, None)
+        if conn:
+            _reply(conn, {'exit': os.waitstatus_to_exitcode(status)})
+            conn.close()
+
+
+def _unlink(path: str):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def run(rootdir: str, sock_path: str, stop_timeout: float):
+    """Warm up, then fork commands for clients until SIGTERM/SIGINT or a stop request.
+
+    On stop, running commands get *stop_timeout* seconds to finish before SIGTERM, then SIGKILL.
+    """
+    argv = [sys.executable] + sys.argv
+    started = time.monotonic()
+    commands, watched = _warm_up()
+    if not commands:
+        logger.error('Nothing to preload: enable the django or flask module')
+        sys.exit(1)
+    state: dict[str, Any] = {
+        'rootdir': rootdir, 'commands': commands, 'children': {}, 'served': 0, 'started': time.time(),
+        'mtimes': _mtimes(code_files(rootdir, watched)), 'stopping': False, 'stale': False}
+    children: dict[int, socket.socket] = state['children']
+    pending: list[int] = []
+    wakeup_r, wakeup_w = os.pipe()
+    os.set_blocking(wakeup_r, False)
+    os.set_blocking(wakeup_w, False)
+    signal.set_wakeup_fd(wakeup_w)
+    for signum in (signal.SIGCHLD, signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+        signal.signal(signum, lambda signum, frame: pending.append(signum))
+
+    os.makedirs(op.dirname(sock_path), mode=0o755, exist_ok=True)
+    if op.exists(sock_path):
+        os.unlink(sock_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(sock_path)
+    server.listen(64)
+    server.setblocking(False)
+    selector = selectors.DefaultSelector()
+    selector.register(wakeup_r, selectors.EVENT_READ)
+    selector.register(server, selectors.EVENT_READ)
+    logger.info('Zygote ready in %.2fs: %s (%s watched paths, socket: %s)', time.monotonic() - started,
+                ' '.join(commands), len(state['mtimes']), sock_path)
+    deadline = None
+    escalation = [signal.SIGTERM, signal.SIGKILL]
+    try:
+        while True:
+            while pending:
+                signum = pending.pop(0)
+                if signum == signal.SIGCHLD:
+                    _reap(children)
+                elif signum == signal.SIGHUP:
+                    state['stale'] = True
+                else:
+                    state['stopping'] = True
+            if (state['stopping'] or state['stale']) and server.fileno() >= 0:
+                logger.info('Zygote %s, waiting for %s commands', 'stopping' if state['stopping'] else 'restarting',
+                            len(children))
+                selector.unregister(server)
+                server.close()
+                _unlink(sock_path)
+            if state['stopping'] and deadline is None:
+                deadline = time.monotonic() + stop_timeout
+            elif deadline is not None and time.monotonic() >= deadline:
+                signum = escalation.pop(0) if len(escalation) > 1 else escalation[0]
+                logger.warning('Sending %s to %s running commands', signal.Signals(signum).name, len(children))
+                for pid in children:
+                    os.kill(pid, signum)
+                deadline = time.monotonic() + stop_timeout
+            if not children and (state['stopping'] or state['stale']):
+                break
+            for key, _ in selector.select(None if deadline is None else max(0.0, deadline - time.monotonic())):
+                if key.fileobj == wakeup_r:
+                    try:
+                        while os.read(wakeup_r, 512):
+                            pass
+                    except BlockingIOError:
+                        pass
+                else:
+                    try:
+                        conn, _ = server.accept()
+                    except BlockingIOError:
+                        continue
+                    _handle_client(conn, state, server)
+    finally:
+        signal.set_wakeup_fd(-1)
+        selector.close()
+        if server.fileno() >= 0:
+            server.close()
+            _unlink(sock_path)
+    if state['stopping']:
+        logger.info('Zygote stopped')
+        return
+    logger.info('Re-executing zygote')
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.execv(argv[0], argv)
+
+
+def request(sock_path: str, operation: str, timeout: float = 5.0) -> dict[str, Any]:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(sock_path)
+        sock.sendall(json.dumps({'op': operation}).encode('utf-8') + b'\n')
+        reply = json.loads(sock.makefile('rb').readline() or b'{}')
+    if 'error' in reply:
+        raise ValueError(reply['error'])
+    return reply
+
+
+def cmd_zygote(args: 'argparse.Namespace'):
+    rootdir = get_config_str('ROOTDIR')
+    sock_path = socket_path(rootdir)
+    stop_timeout = float(get_config_str('ZYGOTE.STOP_TIMEOUT', '30'))
+    command = args.command
+    try:
+        if command == 'run':
+            run(rootdir, sock_path, stop_timeout)
+        elif command == 'start':
+            if readiness.probe(f'unix://{sock_path}'):
+                logger.error('Zygote already running')
+                sys.exit(1)
+            os.makedirs(op.join(rootdir, 'var', 'log'), mode=0o755, exist_ok=True)
+            with open(op.join(rootdir, 'var', 'log', 'zygote.log'), 'ab') as log:
+                proc = subprocess.Popen([sys.executable, op.realpath(sys.argv[0]), 'zygote', 'run'], cwd=rootdir,
+                                        stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT,
+                                        start_new_session=True)
+            if readiness.wait_for(lambda: proc.poll() is not None or readiness.probe(f'unix://{sock_path}'),
+                                  float(get_config_str('ZYGOTE.START_TIMEOUT', '60')),
+                                  'zygote to start') is None or proc.returncode is not None:
+                logger.error('Zygote failed to start, see var/log/zygote.log')
+                sys.exit(1)
+            logger.info('Zygote started (pid %s)', proc.pid)
+        elif command == 'stop':
+            try:
+                pid = request(sock_path, 'status')['pid']
+            except (FileNotFoundError, ConnectionRefusedError):
+                logger.error('Zygote not running (no %s)', sock_path)
+                sys.exit(1)
+            request(sock_path, 'stop')
+            if readiness.wait_for(lambda: not readiness.pid_alive(pid), stop_timeout * 2 + 5,
+                                  f'zygote (pid {pid}) to exit') is None:
+                sys.exit(1)
+            logger.info('Zygote stopped')
+        else:
+            status = request(sock_path, 'status')
+            if args.json:
+                print(json.dumps(status))
+            else:
+                print(f'zygote pid: {status["pid"]}  uptime: {status["uptime"]:.0f}s  commands: '
+                      f'{" ".join(status["commands"])}  served: {status["served"]}  running: {status["running"]}'
+                      + ('  (restarting)' if status['stale'] else ''))
+    except (OSError, ValueError) as exc:
+        logger.error('Zygote request failed (%s): %s', sock_path, exc)
+        sys.exit(1)
+
+
+def setup_parser(cmd: str, parser: 'argparse.ArgumentParser'):
+    parser_sub = parser.add_subparsers(dest='command', help='Zygote operation')
+    parser_sub.required = True
+    parser_sub.add_parser('run', help='Run the zygote in the foreground')
+    parser_sub.add_parser('start', help='Start the zygote in the background')
+    parser_sub.add_parser('stop', help='Stop the zygote once running commands finish (or ZYGOTE.STOP_TIMEOUT)')
+    parser_status = parser_sub.add_parser('status', help='Show zygote status')
+    parser_status.add_argument('--json', action='store_true', default=False, help='Print JSON')
+    parser.set_defaults(call=cmd_zygote)
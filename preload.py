@@ -0,0 +1,38 @@
+"""WSGI entry point preloading the app in the uwsgi master before workers are forked.
+
+Mounted by ``ctl uwsgi start --preload``. The app named in the :data:`APP_ENV` variable is
+imported at module load (in the master, as apps are not lazy), then ``gc.freeze()`` moves every
+object allocated so far to the permanent generation, so garbage collections in the workers don't
+touch them and the pages stay shared copy-on-write.
+"""
+import gc
+import importlib
+import importlib.machinery
+import importlib.util
+import os
+from os import path as op
+from typing import Any
+
+
+APP_ENV = 'RUNLIB_PRELOAD_APP'
+
+
+def load(spec: str) -> Any:
+    """Return the WSGI callable for a uwsgi-style *spec*: ``module[:callable]`` or ``file.py[:callable]``."""
+    target, _, attr = spec.partition(':')
+    if target.endswith(('.py', '.wsgi')):
+        name, filename = op.splitext(op.basename(target))[0], op.abspath(target)
+        module_spec = importlib.util.spec_from_file_location(
+            name, filename, loader=importlib.machinery.SourceFileLoader(name, filename))
+        assert module_spec and module_spec.loader
+        module = importlib.util.module_from_spec(module_spec)
+        module_spec.loader.exec_module(module)
+    else:
+        module = importlib.import_module(target)
+    return getattr(module, attr or 'application')
+
+
+if APP_ENV in os.environ:
+    application = load(os.environ[APP_ENV])
+    gc.collect()
+    gc.freeze()
@@ -0,0 +1,215 @@
+"""Profiling of ``ctl`` commands across the venv re-exec (``ctl --profile``).
+
+The first process only wraps the real run: it starts the same command line with
+``PYTHONPROFILEIMPORTTIME`` set (inherited through the venv re-exec) and a temporary directory in
+:data:`PROFILE_ENV`, relays the child's stderr while keeping the ``import time:`` lines, and writes
+the reports when the child exits. Each process in the chain appends the runlib phases it goes
+through (interpreter startup, package import, ``init``, parser, venv, command) to that directory,
+and the last one runs the command under cProfile. Reports go to
+``var/profile/<time>-<command>/``: ``report.txt`` (phases, slowest imports and functions),
+``phases.json``, ``importtime.txt`` (``-X importtime`` format) and ``command.prof`` (pstats).
+"""
+from contextlib import contextmanager
+import json
+import os
+from os import path as op
+import sys
+import time
+from typing import Any, Callable, Iterator
+
+
+PROFILE_ENV = 'RUNLIB_PROFILE'
+EXEC_ENV = 'RUNLIB_PROFILE_EXEC'
+IMPORTTIME_ENV = 'PYTHONPROFILEIMPORTTIME'
+VALUE_OPTIONS = ('-l', '--loglevel', '--venv')
+IMPORTED = time.time()
+
+_open: list[tuple[str, float]] = []
+
+
+def requested(argv: list[str]):
+    """Return True if the global ``--profile`` option precedes the command in *argv*."""
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg == '--profile':
+            return True
+        elif arg in VALUE_OPTIONS:
+            skip = True
+        elif not arg.startswith('-'):
+            return False
+    return False
+
+
+def active():
+    return bool(os.environ.get(PROFILE_ENV))
+
+
+def record(name: str, started: float, ended: float | None = None, **attrs: Any):
+    """Append phase *name* of this process to the profiled run (no-op when not profiling)."""
+    if not active():
+        return
+    event = {'name': name, 'pid': os.getpid(), 'executable': sys.executable, 'start': started,
+             'duration': round((ended or time.time()) - started, 6), **attrs}
+    with open(op.join(os.environ[PROFILE_ENV], 'phases.jsonl'), 'a') as phases:
+        phases.write(json.dumps(event) + '\n')
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    started = time.time()
+    _open.append((name, started))
+    try:
+        yield
+    finally:
+        _open.pop()
+        record(name, started)
+
+
+def exec_env() -> dict[str, str]:
+    """Close the phases still open before an exec; return the environment the new process needs."""
+    if not active():
+        return {}
+    now = time.time()
+    for name, started in _open:
+        record(name, started, now, status='exec')
+    return {EXEC_ENV: str(now)}
+
+
+def start():
+    """Record the interpreter startup of a process started by the profiled run."""
+    if active() and os.environ.get(EXEC_ENV):
+        record('startup', float(os.environ[EXEC_ENV]), IMPORTED)
+
+
+def run_command(call: Callable[[Any], Any], args: Any, rootdir: str):
+    """Run ``call(args)`` under cProfile, as the command phase of the profiled run."""
+    import cProfile
+
+    os.environ.pop(IMPORTTIME_ENV, None)
+    workdir = os.environ[PROFILE_ENV]
+    with open(op.join(workdir, 'meta.json'), 'w') as meta:
+        json.dump({'rootdir': rootdir, 'command': args.cmd, 'argv': sys.argv[1:]}, meta)
+    profiler = cProfile.Profile()
+    try:
+        with phase('command'):
+            profiler.runcall(call, args)
+    finally:
+        profiler.dump_stats(op.join(workdir, 'command.prof'))
+
+
+def _relay(stream: Any, imports: Any):
+    """Copy the child's stderr to ours, diverting the ``import time:`` lines to *imports*."""
+    prefix = b'import time:'
+    pending = b''
+    while chunk := stream.read1(65536):
+        lines = (pending + chunk).split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            if line.startswith(prefix):
+                imports.write(line + b'\n')
+            else:
+                sys.stderr.buffer.write(line + b'\n')
+        if pending and not prefix.startswith(pending[:len(prefix)]):
+            sys.stderr.buffer.write(pending)
+            pending = b''
+        sys.stderr.buffer.flush()
+    if pending:
+        (imports if pending.startswith(prefix) else sys.stderr.buffer).write(pending)
+
+
+def wrap():
+    """Run this command line again as the profiled run, write the reports and return its exit code.
+
+    The run's stderr is a pipe, even when ours is a terminal: its ``isatty()`` checks see a redirect.
+    """
+    import shutil
+    import signal
+    import subprocess
+    import tempfile
+
+    workdir = tempfile.mkdtemp(prefix='runlib-profile-')
+    started = time.time()
+    env = {**os.environ, PROFILE_ENV: workdir, EXEC_ENV: str(started), IMPORTTIME_ENV: '1'}
+    previous = signal.signal(signal.SIGINT, signal.SIG_IGN)
+    with open(op.join(workdir, 'importtime.txt'), 'wb') as imports:
+        proc = subprocess.Popen([sys.executable] + sys.argv, env=env, stderr=subprocess.PIPE)
+        assert proc.stderr
+        _relay(proc.stderr, imports)
+        code = proc.wait()
+    signal.signal(signal.SIGINT, previous)
+    try:
+        outdir = _report(workdir, started, time.time(), code)
+    except (OSError, ValueError) as exc:
+        print(f'Cannot write profile reports (raw data in {workdir}): {exc}', file=sys.stderr)
+        return code
+    shutil.rmtree(workdir, ignore_errors=True)
+    print(f'Profile written to {outdir}', file=sys.stderr)
+    return code
+
+
+def _imports(filename: str):
+    """Parse ``-X importtime`` output into ``(cumulative_us, self_us, module)`` tuples."""
+    res: list[tuple[int, int, str]] = []
+    with open(filename, errors='replace') as imports:
+        for line in imports:
+            fields = line[len('import time:'):].split('|')
+            if len(fields) == 3 and fields[0].strip().isdigit():
+                res.append((int(fields[1]), int(fields[0]), fields[2].strip()))
+    return res
+
+
+def _report(workdir: str, started: float, ended: float, code: int):
+    import shutil
+
+    try:
+        with open(op.join(workdir, 'meta.json')) as meta_file:
+            meta = json.load(meta_file)
+    except OSError:
+        meta = {'rootdir': os.getcwd(), 'command': 'unknown', 'argv': sys.argv[1:]}
+    try:
+        with open(op.join(workdir, 'phases.jsonl')) as phases_file:
+            events = [json.loads(line) for line in phases_file]
+    except OSError:
+        events = []
+    processes = list(dict.fromkeys((event['pid'], event['executable']) for event in events))
+    phases = [{'name': event['name'], 'process': processes.index((event['pid'], event['executable'])),
+               'start': round(event['start'] - started, 6), 'duration': event['duration'],
+               **{key: val for key, val in event.items()
+                  if key not in ('name', 'pid', 'executable', 'start', 'duration')}} for event in events]
+    summary = {'command': meta['command'], 'argv': meta['argv'], 'release': op.basename(meta['rootdir']),
+               'exit': code, 'total': round(ended - started, 6),
+               'processes': [executable for _, executable in processes], 'phases': phases}
+
+    outdir = op.join(meta['rootdir'], 'var', 'profile', time.strftime('%Y%m%d-%H%M%S-', time.localtime(started))
+                     + meta['command'])
+    os.makedirs(outdir, mode=0o755, exist_ok=True)
+    with open(op.join(outdir, 'phases.json'), 'w') as out:
+        json.dump(summary, out, indent=2, sort_keys=True)
+    for name in ('importtime.txt', 'command.prof'):
+        if op.exists(op.join(workdir, name)):
+            shutil.move(op.join(workdir, name), op.join(outdir, name))
+
+    lines = [f'command: {" ".join(meta["argv"])}  release: {summary["release"]}  exit: {code}  '
+             f'total: {summary["total"] * 1000:.1f} ms', '']
+    for idx, executable in enumerate(summary['processes']):
+        lines.append(f'process {idx}: {executable}')
+    lines.extend(['', f'{"PHASE":<12} {"PROC":>4} {"START MS":>10} {"MS":>10}'])
+    lines.extend(f'{phase["name"]:<12} {phase["process"]:>4} {phase["start"] * 1000:>10.1f} '
+                 f'{phase["duration"] * 1000:>10.1f}' + (f'  ({phase["status"]})' if 'status' in phase else '')
+                 for phase in phases)
+    imports = _imports(op.join(outdir, 'importtime.txt')) if op.exists(op.join(outdir, 'importtime.txt')) else []
+    if imports:
+        lines.extend(['', f'imports: {len(imports)}, slowest (cumulative ms, self ms):'])
+        lines.extend(f'{cumulative / 1000:>10.1f} {self_us / 1000:>10.1f}  {module}'
+                     for cumulative, self_us, module in sorted(imports, reverse=True)[:25])
+    with open(op.join(outdir, 'report.txt'), 'w') as out:
+        out.write('\n'.join(lines) + '\n')
+        if op.exists(op.join(outdir, 'command.prof')):
+            import pstats
+
+            out.write('\ncommand profile (cumulative):\n')
+            pstats.Stats(op.join(outdir, 'command.prof'), stream=out).strip_dirs().sort_stats('cumulative') \
+                .print_stats(40)
+    return outdir
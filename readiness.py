@@ -0,0 +1,201 @@
+"""Process and socket readiness checks.
+
+Probe specs are ``tcp://host:port``, ``unix:///path/to/socket``, ``http://host:port/path`` (or
+``https://``) and ``http+unix:///path/to/socket#/path`` (a ``GET`` over the socket; as the URL
+path names the socket, the request path follows ``#`` and defaults to ``/``); a bare
+``host:port`` is treated as TCP and a bare absolute path as a unix socket.
+``uwsgi://host:port/path`` and ``uwsgi+unix:///path/to/socket#/path`` send a request over the uwsgi
+protocol, so an app behind a uwsgi socket can be checked without going through the front server.
+"""
+import errno
+import http.client
+import os
+import socket
+import struct
+import time
+from typing import Callable
+from urllib.parse import SplitResult, urlsplit
+
+from . import logger
+
+
+def read_pid(pidfile: str) -> int | None:
+    try:
+        with open(pidfile) as pid_file:
+            return int(pid_file.read().strip() or 0) or None
+    except (OSError, ValueError):
+        return None
+
+
+def pid_alive(pid: int):
+    """Return True if *pid* exists and is not a zombie waiting to be reaped."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    try:
+        with open(f'/proc/{pid}/stat') as stat:
+            return stat.read().rpartition(')')[2].split()[0] != 'Z'
+    except (OSError, IndexError):
+        return True
+
+
+def process_uptime(pid: int) -> float | None:
+    """Return seconds since *pid* started, from ``/proc`` (None if unavailable)."""
+    try:
+        with open(f'/proc/{pid}/stat') as stat:
+            started = int(stat.read().rpartition(')')[2].split()[19]) / os.sysconf('SC_CLK_TCK')
+        with open('/proc/stat') as proc_stat:
+            boot = next(int(line.split()[1]) for line in proc_stat if line.startswith('btime '))
+    except (OSError, ValueError, IndexError, StopIteration):
+        return None
+    return max(time.time() - boot - started, 0.0)
+
+
+def proc_rss(pid: int):
+    """Return the resident set size of *pid* in bytes, from ``/proc/<pid>/statm`` (0 if unreadable)."""
+    try:
+        with open(f'/proc/{pid}/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def memory_usage(pid: int) -> dict[str, int]:
+    """Return RSS, PSS, USS and shared bytes of *pid* from ``/proc/<pid>/smaps_rollup`` (empty if unreadable)."""
+    fields: dict[str, int] = {}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as smaps:
+            for line in smaps:
+                key, _, value = line.partition(':')
+                parts = value.split()
+                if len(parts) == 2 and parts[1] == 'kB':
+                    fields[key] = int(parts[0]) * 1024
+    except (OSError, ValueError):
+        return {}
+    private = fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0)
+    return {
+        'rss': fields.get('Rss', 0),
+        'pss': fields.get('Pss', 0),
+        'uss': private,
+        'shared': fields.get('Shared_Clean', 0) + fields.get('Shared_Dirty', 0),
+    }
+
+
+def child_pids(pid: int) -> list[int]:
+    """Return pids of the direct children of *pid* (forked by any of its threads)."""
+    res: list[int] = []
+    try:
+        for task in os.listdir(f'/proc/{pid}/task'):
+            with open(f'/proc/{pid}/task/{task}/children') as children:
+                res.extend(int(child) for child in children.read().split())
+    except (OSError, ValueError):
+        pass
+    return res
+
+
+def _normalize(spec: str):
+    if '://' in spec:
+        return spec
+    return f'unix://{spec}' if spec.startswith('/') else f'tcp://{spec}'
+
+
+def _connect(spec: str, timeout: float) -> socket.socket:
+    url = urlsplit(_normalize(spec))
+    if url.scheme in ('unix', 'http+unix', 'uwsgi+unix'):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(url.path)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+    return socket.create_connection((url.hostname or 'localhost', url.port or 80), timeout=timeout)
+
+
+def _request_target(url: SplitResult):
+    """Return the request path and query of *url*: unix socket URLs carry them after ``#``."""
+    if url.scheme.endswith('+unix'):
+        path, _, query = url.fragment.partition('?')
+        return path or '/', query
+    return url.path or '/', url.query
+
+
+def _uwsgi_packet(url: SplitResult):
+    host, port = url.hostname or 'localhost', str(url.port or '')
+    path, query = _request_target(url)
+    uri = f'{path}?{query}' if query else path
+    params = {
+        'REQUEST_METHOD': 'GET', 'REQUEST_URI': uri, 'PATH_INFO': path, 'QUERY_STRING': query,
+        'SERVER_PROTOCOL': 'HTTP/1.1', 'SERVER_NAME': host, 'SERVER_PORT': port, 'HTTP_HOST': host,
+    }
+    return uwsgi_packet(params)
+
+
+def uwsgi_packet(params: dict[str, str]):
+    """Encode a uwsgi protocol WSGI request (modifier 0) carrying *params* as its variables."""
+    body = b''
+    for key, val in params.items():
+        for item in (key.encode('utf-8'), val.encode('utf-8')):
+            body += struct.pack('<H', len(item)) + item
+    return struct.pack('<BHB', 0, len(body), 0) + body
+
+
+def _uwsgi_status(spec: str, timeout: float):
+    url = urlsplit(spec)
+    with _connect(spec, timeout) as sock:
+        sock.sendall(_uwsgi_packet(url))
+        status = sock.makefile('rb').readline(1024).split()
+    return int(status[1]) if len(status) > 1 and status[1].isdigit() else 599
+
+
+def probe(spec: str, timeout: float = 1.0):
+    """Return True if the service described by *spec* accepts connections (HTTP, uwsgi: answers < 500)."""
+    url = urlsplit(_normalize(spec))
+    try:
+        if url.scheme in ('uwsgi', 'uwsgi+unix'):
+            return _uwsgi_status(spec, timeout) < 500
+        if url.scheme in ('http', 'https', 'http+unix'):
+            conn_cls = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+            conn = conn_cls(url.hostname or 'localhost', url.port, timeout=timeout)
+            path, query = _request_target(url)
+            if url.scheme == 'http+unix':
+                conn.sock = _connect(spec, timeout)
+            try:
+                conn.request('GET', f'{path}?{query}' if query else path, headers={'Connection': 'close'})
+                return conn.getresponse().status < 500
+            finally:
+                conn.close()
+        _connect(spec, timeout).close()
+        return True
+    except (OSError, http.client.HTTPException):
+        return False
+
+
+def socket_released(spec: str):
+    """Return True if nothing listens on *spec* any more."""
+    url = urlsplit(_normalize(spec))
+    if url.scheme in ('unix', 'http+unix', 'uwsgi+unix') and not os.path.exists(url.path):
+        return True
+    try:
+        _connect(spec, 0.5).close()
+    except OSError as exc:
+        return exc.errno in (errno.ECONNREFUSED, errno.ENOENT) or isinstance(exc, ConnectionRefusedError)
+    return False
+
+
+def wait_for(check: Callable[[], bool], timeout: float, what: str, interval: float = 0.05):
+    """Poll *check* until it passes or *timeout* seconds elapse. Return the time waited or None."""
+    started = time.monotonic()
+    delay = interval
+    while True:
+        if check():
+            return time.monotonic() - started
+        if time.monotonic() - started >= timeout:
+            logger.error('Timed out after %.1fs waiting for %s', timeout, what)
+            return None
+        time.sleep(delay)
+        delay = min(delay * 1.5, 0.5)
@@ -0,0 +1,156 @@
+"""Structured model of pip requirements files.
+
+Each file is kept as a list of :class:`Requirement` records, one per physical line, so that
+comments, options and ``-r``/``-c`` includes survive a rewrite untouched.
+"""
+import os
+from os import path as op
+import re
+from typing import NamedTuple
+
+from .inventory import canonical
+
+
+REQ_RE = re.compile(r'''
+    (?P<name>[A-Za-z0-9](?:[A-Za-z0-9._-]*[A-Za-z0-9])?)\s*
+    (?P<extras>\[[^\]]*\])?\s*
+    (?P<spec>(?:===|[<>=!~]=?)[^;]*?|@\s*\S+)?\s*
+    (?P<marker>;.*)?
+''', re.VERBOSE)
+COMMENT_RE = re.compile(r'\s+#')
+INCLUDE_RE = re.compile(r'-(?:r|c|-requirement|-constraint)(?:\s*=?\s*)(?P<path>\S+)')
+
+
+class Requirement(NamedTuple):
+    line: str
+    name: str = ''
+    extras: str = ''
+    spec: str = ''
+    marker: str = ''
+    comment: str = ''
+    include: str = ''
+
+    @property
+    def key(self):
+        return canonical(self.name)
+
+    @property
+    def version(self):
+        """Pinned version for a single ``==`` clause, empty otherwise."""
+        if self.spec.startswith('==') and ',' not in self.spec:
+            return self.spec[2:].strip()
+        return ''
+
+    def format(self, spec: str | None = None):
+        spec = self.spec if spec is None else spec
+        res = f'{self.name}{self.extras}{spec}'
+        if self.marker:
+            res += f' {self.marker}'
+        return res
+
+    def replace_spec(self, other: 'Requirement | None' = None, spec: str | None = None):
+        """Return this line with name/extras/spec/marker taken from *other* or *spec* changed."""
+        src = other or self
+        new = src._replace(spec=src.spec if spec is None else spec,
+                           marker=src.marker or (self.marker if other else ''), comment=self.comment)
+        text = new.format()
+        if new.comment:
+            text += f'  {new.comment}'
+        return new._replace(line=f'{text}\n')
+
+
+def parse_line(line: str) -> Requirement:
+    stripped = line.strip()
+    if not stripped or stripped.startswith('#'):
+        return Requirement(line)
+    content, *rest = COMMENT_RE.split(stripped, 1)
+    comment = f'#{rest[0]}' if rest else ''
+    include = INCLUDE_RE.fullmatch(content)
+    if include:
+        return Requirement(line, comment=comment, include=include.group('path'))
+    if content.startswith('-'):
+        return Requirement(line, comment=comment)
+    match = REQ_RE.fullmatch(content)
+    if not match:
+        return Requirement(line, comment=comment)
+    spec = re.sub(r'\s+', '', match.group('spec') or '')
+    return Requirement(
+        line, name=match.group('name'), extras=re.sub(r'\s+', '', match.group('extras') or ''),
+        spec=f' @ {spec[1:]}' if spec.startswith('@') else spec,
+        marker=(match.group('marker') or '').strip(), comment=comment)
+
+
+def parse(spec: str) -> Requirement:
+    """Parse a requirement given on the command line."""
+    req = parse_line(spec)
+    if not req.name:
+        raise ValueError(f'Invalid requirement: {spec!r}')
+    return req.replace_spec()
+
+
+def load(filename: str, files: dict[str, list[Requirement]] | None = None) -> dict[str, list[Requirement]]:
+    """Load *filename* and its includes, returning ``{path: lines}`` in inclusion order.
+
+    Raises OSError if *filename* itself can't be read; missing includes are skipped.
+    """
+    files = files if files is not None else {}
+    filename = op.abspath(filename)
+    if filename in files:
+        return files
+    with open(filename) as req_file:
+        files[filename] = [parse_line(line) for line in req_file]
+    for req in files[filename]:
+        if req.include:
+            try:
+                load(op.join(op.dirname(filename), req.include), files)
+            except OSError:
+                pass
+    return files
+
+
+def entries(files: dict[str, list[Requirement]]) -> dict[str, tuple[str, Requirement]]:
+    """Return ``{key: (filename, requirement)}`` for all named requirements in *files*."""
+    res: dict[str, tuple[str, Requirement]] = {}
+    for filename, lines in files.items():
+        for req in lines:
+            if req.name:
+                res.setdefault(req.key, (filename, req))
+    return res
+
+
+def add(lines: list[Requirement], req: Requirement):
+    """Insert or replace *req* in *lines*, keeping named requirements sorted. Return True if added."""
+    for pos, line in enumerate(lines):
+        if not line.name:
+            continue
+        if line.key == req.key:
+            lines[pos] = line.replace_spec(req)
+            return False
+        if req.key < line.key:
+            idx = pos
+            break
+    else:
+        named = [pos for pos, line in enumerate(lines) if line.name]
+        idx = named[-1] + 1 if named else len(lines)
+        while idx > 0 and not lines[idx - 1].name and not lines[idx - 1].line.strip():
+            idx -= 1
+    if idx and not lines[idx - 1].line.endswith('\n'):
+        lines[idx - 1] = lines[idx - 1]._replace(line=lines[idx - 1].line + '\n')
+    lines.insert(idx, req)
+    return True
+
+
+def remove(lines: list[Requirement], key: str):
+    lines[:] = [line for line in lines if line.key != key or not line.name]
+
+
+def write(filename: str, lines: list[Requirement]):
+    """Atomically replace *filename* with *lines*."""
+    tmpname = f'{filename}.{os.getpid()}.tmp'
+    with open(tmpname, 'w') as req_file:
+        req_file.write(''.join(line.line for line in lines))
+    try:
+        os.chmod(tmpname, os.stat(filename).st_mode & 0o7777)
+    except OSError:
+        pass
+    os.replace(tmpname, filename)
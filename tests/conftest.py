@@ -0,0 +1,15 @@
+"""Load the checkout as the ``runlib`` package, whatever its directory is called."""
+import importlib.util
+from os import path as op
+import sys
+
+
+ROOT = op.dirname(op.dirname(op.abspath(__file__)))
+
+if 'runlib' not in sys.modules:
+    spec = importlib.util.spec_from_file_location('runlib', op.join(ROOT, '__init__.py'),
+                                                  submodule_search_locations=[ROOT])
+    assert spec and spec.loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['runlib'] = module
+    spec.loader.exec_module(module)
@@ -0,0 +1,103 @@
+import asyncio
+import unittest
+
+from runlib.modules import bench
+
+
+class Writer:
+    def __init__(self):
+        self.data = b''
+
+    def write(self, data: bytes):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+
+def http(response: bytes, requests: list[tuple[str, str]]):
+    """Send *requests* on one connection answered with *response*; return their results and the unread rest."""
+    async def main():
+        reader, writer = asyncio.StreamReader(), Writer()
+        reader.feed_data(response)
+        reader.feed_eof()
+        results = [await bench._http((reader, writer), 'example.com', method, path) for method, path in requests]
+        return results, await reader.read(), writer.data
+    return asyncio.run(main())
+
+
+class ParseRequestsTest(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual(bench.parse_requests(['/', '  ', 'post /api/items 3', '/search?q=x 0.5']), [
+            ('GET', '/', 1.0), ('POST', '/api/items', 3.0), ('GET', '/search?q=x', 0.5)])
+
+    def test_invalid(self):
+        for line in ('GET', 'GET api', '/ 1 2', 'GET / x'):
+            with self.assertRaises(ValueError):
+                bench.parse_requests([line])
+
+
+class SummaryTest(unittest.TestCase):
+    def test_percentile(self):
+        values = [float(val) for val in range(1, 101)]
+        self.assertIsNone(bench.percentile([], 50))
+        self.assertEqual(bench.percentile(values, 50), 50)
+        self.assertEqual(bench.percentile(values, 99), 99)
+        self.assertEqual(bench.percentile(values, 99.9), 100)
+        self.assertEqual(bench.percentile([0.5], 0), 0.5)
+
+    def test_summarize(self):
+        results: list[tuple[int | str, float]] = [(200, 0.002), (200, 0.001), (404, 0.003), ('TimeoutError', 5.0)]
+        summary = bench.summarize(results, 2.0)
+        self.assertEqual((summary['requests'], summary['errors'], summary['rps']), (4, 2, 2.0))
+        self.assertEqual(summary['statuses'], {'200': 2, '404': 1, 'TimeoutError': 1})
+        self.assertEqual(summary['latency_ms'], {'mean': 2.0, 'p50': 2.0, 'p90': 3.0, 'p99': 3.0, 'p99.9': 3.0,
+                                                 'max': 3.0})
+
+    def test_summarize_failures_only(self):
+        summary = bench.summarize([('ConnectionRefusedError', 0.001)], 0.0)
+        self.assertEqual((summary['requests'], summary['errors'], summary['rps']), (1, 1, 0.0))
+        self.assertEqual(set(summary['latency_ms'].values()), {None})
+
+    def test_compare(self):
+        old = {'rps': 100.0, 'errors': 0, 'latency_ms': {'mean': 10.0, 'p99': 20.0}}
+        new = {'rps': 90.0, 'errors': 1, 'latency_ms': {'mean': 10.0, 'p99': 25.0}}
+        rows, regression = bench.compare(old, new)
+        self.assertEqual(rows, [('req/s', 100.0, 90.0, -10.0), ('errors', 0, 1, None),
+                                ('mean ms', 10.0, 10.0, 0.0), ('p99 ms', 20.0, 25.0, 25.0)])
+        self.assertEqual(regression, 25.0)
+        self.assertEqual(bench.compare(new, old)[1], 0)
+        self.assertEqual(bench.compare(old, {**new, 'rps': 50.0})[1], 50.0)
+        old['latency_ms']['p99'] = None
+        rows, regression = bench.compare(old, new)
+        self.assertEqual(rows[-1], ('p99 ms', None, 25.0, None))
+        self.assertEqual(regression, 10.0)
+
+
+class HttpTest(unittest.TestCase):
+    def test_keep_alive(self):
+        results, rest, sent = http(b'HTTP/1.1 200 OK\r\nContent-Length: 5\r\n\r\nhello'
+                                   b'HTTP/1.1 204 No Content\r\n\r\n'
+                                   b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\nextra',
+                                   [('GET', '/'), ('DELETE', '/item'), ('GET', '/missing')])
+        self.assertEqual(results, [(200, True), (204, True), (404, False)])
+        self.assertEqual(rest, b'extra')
+        self.assertEqual(sent.split(b'\r\n\r\n')[0], b'GET / HTTP/1.1\r\nHost: example.com\r\nContent-Length: 0')
+
+    def test_chunked(self):
+        results, rest, _ = http(b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n'
+                                b'5\r\nhello\r\n7;ext=1\r\n, world\r\n0\r\nX-Trailer: 1\r\n\r\n'
+                                b'HTTP/1.1 500 Error\r\nTransfer-Encoding: chunked\r\n\r\n0\r\n\r\nnext',
+                                [('GET', '/'), ('GET', '/')])
+        self.assertEqual(results, [(200, True), (500, True)])
+        self.assertEqual(rest, b'next')
+
+    def test_read_until_close(self):
+        self.assertEqual(http(b'HTTP/1.1 200 OK\r\n\r\nbody until eof', [('GET', '/')])[:2], ([(200, False)], b''))
+        self.assertEqual(http(b'HTTP/1.0 200 OK\r\nContent-Length: 2\r\n\r\nok', [('GET', '/')])[0], [(200, False)])
+        self.assertEqual(http(b'HTTP/1.1 200 OK\r\nContent-Length: 9\r\n\r\nnext', [('HEAD', '/')])[:2],
+                         ([(200, True)], b'next'))
+
+
+if __name__ == '__main__':
+    unittest.main()
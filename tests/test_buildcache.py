@@ -0,0 +1,57 @@
+import os
+from os import path as op
+import tempfile
+import unittest
+
+import runlib
+from runlib import buildcache
+
+
+class RestoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.root = op.join(self.tmpdir.name, 'app')
+        os.makedirs(op.join(self.root, 'build'))
+        runlib.CONFIG.clear()
+        runlib.load_config(op.join(self.root, 'config.ini'), {
+            'ROOTDIR': self.root, 'CONFIG': 'config.ini',
+            'INSTALL.BUILD_CACHE_DIR': op.join(self.tmpdir.name, 'cache')})
+        self.write('src.js', 'source\n')
+        self.write('build/app.js', 'built\n')
+        self.write('build/app.css', 'built\n')
+        self.key = buildcache.cache_key(self.root, 'make', ['src.js'], ['build'])
+        buildcache.store(self.key, self.root, ['build'], 2.0)
+
+    def write(self, name: str, data: str):
+        with open(op.join(self.root, name), 'w') as out:
+            out.write(data)
+
+    def read(self, name: str):
+        with open(op.join(self.root, name)) as src:
+            return src.read()
+
+    def test_hit_replaces_outputs(self):
+        self.write('build/app.js', 'stale\n')
+        self.write('build/extra.js', 'stale\n')
+        meta = buildcache.restore(self.key, self.root, ['build'])
+        self.assertEqual(meta and sorted(meta['files']), ['build/app.css', 'build/app.js'])
+        self.assertEqual(sorted(os.listdir(op.join(self.root, 'build'))), ['app.css', 'app.js'])
+        self.assertEqual(self.read('build/app.js'), 'built\n')
+        self.assertEqual(sorted(os.listdir(self.root)), ['build', 'src.js'])
+
+    def test_damaged_entry_keeps_outputs(self):
+        os.unlink(op.join(buildcache.store_dir(), self.key, 'build', 'app.js'))
+        self.write('build/app.js', 'current\n')
+        with self.assertLogs('runlib', 'WARNING'):
+            self.assertIsNone(buildcache.restore(self.key, self.root, ['build']))
+        self.assertEqual(self.read('build/app.js'), 'current\n')
+        self.assertEqual(sorted(os.listdir(self.root)), ['build', 'src.js'])
+
+    def test_key_follows_inputs(self):
+        self.write('src.js', 'changed\n')
+        self.assertNotEqual(buildcache.cache_key(self.root, 'make', ['src.js'], ['build']), self.key)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,181 @@
+import importlib.util
+import os
+from os import path as op
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+
+import runlib
+from runlib import requirements
+from runlib.modules import env
+
+
+class WheelhouseManifestTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.wheelhouse = op.join(self.tmpdir.name, 'wheelhouse')
+        os.mkdir(self.wheelhouse)
+        self.lock = self.write(self.tmpdir.name, 'requirements.lock', 'pkg==1.0 \\\n    --hash=sha256:aa\n')
+        self.write(self.wheelhouse, 'pkg-1.0-py3-none-any.whl', 'built locally')
+        env.write_wheelhouse_manifest(self.wheelhouse, self.lock)
+        self.write(self.wheelhouse, '.complete', '')
+
+    def write(self, dirname: str, name: str, data: str):
+        with open(op.join(dirname, name), 'w') as out:
+            out.write(data)
+        return op.join(dirname, name)
+
+    def test_matching_wheelhouse(self):
+        env.check_wheelhouse(self.wheelhouse, self.lock)
+
+    def test_changed_wheel(self):
+        self.write(self.wheelhouse, 'pkg-1.0-py3-none-any.whl', 'tampered')
+        with self.assertRaisesRegex(ValueError, 'does not match'):
+            env.check_wheelhouse(self.wheelhouse, self.lock)
+
+    def test_extra_wheel(self):
+        self.write(self.wheelhouse, 'other-2.0-py3-none-any.whl', 'extra')
+        with self.assertRaisesRegex(ValueError, 'other-2.0'):
+            env.check_wheelhouse(self.wheelhouse, self.lock)
+
+    def test_other_lockfile(self):
+        self.write(self.tmpdir.name, 'requirements.lock', 'pkg==1.1\n')
+        with self.assertRaisesRegex(ValueError, 'not built from'):
+            env.check_wheelhouse(self.wheelhouse, self.lock)
+
+    def test_hash_options_stripped(self):
+        lock = '# header\npkg==1.0 \\\n    --hash=sha256:aa \\\n    --hash=sha256:bb\nother @ https://host/o.whl\n'
+        self.assertEqual(env.HASH_OPTION_RE.sub('', lock), '# header\npkg==1.0\nother @ https://host/o.whl\n')
+
+
+def add_dist(site: str, name: str, version: str, requires: tuple[str, ...] = ()):
+    dist_info = op.join(site, f'{name}-{version}.dist-info')
+    os.makedirs(dist_info)
+    with open(op.join(dist_info, 'METADATA'), 'w') as meta:
+        meta.write(f'Metadata-Version: 2.1\nName: {name}\nVersion: {version}\n')
+        meta.writelines(f'Requires-Dist: {req}\n' for req in requires)
+
+
+class UpdatePruneTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        root = self.tmpdir.name
+        self.venv = op.join(root, '.venv')
+        site = op.join(self.venv, 'lib', 'python3.11', 'site-packages')
+        add_dist(site, 'pkg', '1.0')
+        add_dist(site, 'devtool', '2.0')
+        add_dist(site, 'pip', '24.0')
+        self.req = op.join(root, 'requirements.txt')
+        self.lock = op.join(root, 'requirements.lock')
+        with open(self.req, 'w') as req_file:
+            req_file.write('pkg\n')
+        with open(self.lock, 'w') as lock_file:
+            lock_file.write(f'# requirements: {env._requirements_hash(requirements.load(self.req))}\npkg==1.0\n')
+        runlib.CONFIG.clear()
+        runlib.load_config(op.join(root, 'config.ini'), {'ROOTDIR': root, 'CONFIG': 'config.ini'})
+
+    def update(self, prune: bool):
+        with mock.patch.object(env.subprocess, 'check_call') as check_call:
+            env.subcmd_update(self.req, self.lock, self.venv, requirements.load(self.req), prune=prune)
+        return [call.args[0] for call in check_call.call_args_list if 'uninstall' in call.args[0]]
+
+    def test_no_prune_by_default(self):
+        self.assertEqual(self.update(False), [])
+
+    def test_prune(self):
+        self.assertEqual(self.update(True), [['python', '-m', 'pip', 'uninstall', '--yes', 'devtool']])
+        self.assertEqual(self.update(True), [['python', '-m', 'pip', 'uninstall', '--yes', 'devtool']])
+
+    def test_stale_lock_installs_requirements(self):
+        with open(self.req, 'a') as req_file:
+            req_file.write('devtool\n')
+        with mock.patch.object(env.subprocess, 'check_call') as check_call, \
+                mock.patch.object(env.os, 'execlp', side_effect=SystemExit) as execlp, \
+                self.assertLogs('runlib', 'WARNING'), self.assertRaises(SystemExit):
+            env.subcmd_update(self.req, self.lock, self.venv, requirements.load(self.req), prune=True)
+        self.assertEqual(execlp.call_args.args[-2:], ('-r', self.req))
+        check_call.assert_not_called()
+
+
+class LauncherTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.root = op.realpath(self.tmpdir.name)
+        self.venv = op.join(self.root, '.venv')
+        os.makedirs(op.join(self.venv, 'bin'))
+        self.write(op.join(self.venv, 'bin', 'python'), '#!/bin/sh\necho venv "$VIRTUAL_ENV" "$@"\n')
+        self.config = self.write(op.join(self.root, 'config.ini'), '[MAIN]\n')
+        # The sh/python header of the example entry script, with a python part reporting how it ran.
+        with open(op.join(op.dirname(op.dirname(op.abspath(__file__))), 'examples', 'ctl')) as example:
+            header = example.read().partition("\n'''\n")[0]
+        self.script = self.write(op.join(self.root, 'ctl'),
+                                 header + "\n'''\nimport sys\nprint('python', *sys.argv[1:])\n")
+        runlib.CONFIG.clear()
+        runlib.load_config(self.config, {'ROOTDIR': self.root, 'CONFIG': 'config.ini'})
+
+    def write(self, filename: str, data: str):
+        with open(filename, 'w') as out:
+            out.write(data)
+        os.chmod(filename, 0o755)
+        return filename
+
+    def run_script(self, *cmd: str):
+        env = {key: val for key, val in os.environ.items() if key not in ('VIRTUAL_ENV', 'RUNLIB_SCRIPT')}
+        return subprocess.run([*cmd, 'arg'], stdout=subprocess.PIPE, check=True, cwd='/', env=env,
+                              text=True).stdout.strip()
+
+    def update_launcher(self):
+        with mock.patch.object(env.sys, 'argv', [self.script]):
+            env.update_launcher(self.venv)
+
+    def test_launcher(self):
+        direct = 'python arg'
+        in_venv = f'venv {self.venv} {self.script} arg'
+        self.assertEqual(self.run_script(self.script), direct)
+        self.update_launcher()
+        self.assertEqual(self.run_script(self.script), in_venv)
+        self.assertEqual(self.run_script('sh', self.script), in_venv)
+        self.assertEqual(self.run_script('python3', self.script), direct)
+
+        # A changed config.ini (or venv interpreter) no longer matches the fingerprint: run without the shim.
+        stat = os.stat(self.config)
+        os.utime(self.config, (stat.st_atime, stat.st_mtime + 10))
+        self.assertEqual(self.run_script(self.script), direct)
+        self.update_launcher()
+        self.assertEqual(self.run_script(self.script), in_venv)
+
+
+class CompileTest(unittest.TestCase):
+    def test_release_dirs_pruned_at_root_only(self):
+        with tempfile.TemporaryDirectory() as root:
+            sources = ['app.py', 'var/cache.py', 'node_modules/tool.py', 'pkg/var/models.py',
+                       'pkg/node_modules/vendored.py', '.venv/lib/site.py', 'pkg/.git/hook.py']
+            for name in sources:
+                os.makedirs(op.dirname(op.join(root, name)), exist_ok=True)
+                open(op.join(root, name), 'w').close()
+            runlib.CONFIG.clear()
+            runlib.load_config(op.join(root, 'config.ini'), {'ROOTDIR': root, 'CONFIG': 'config.ini'})
+            env.subcmd_compile(root, op.join(root, '.venv'), 1)
+            compiled = [name for name in sources
+                        if op.exists(importlib.util.cache_from_source(op.join(root, name)))]
+        self.assertEqual(compiled, ['app.py', 'pkg/var/models.py', 'pkg/node_modules/vendored.py'])
+
+    def test_invalidation_mode(self):
+        with tempfile.TemporaryDirectory() as root:
+            open(op.join(root, 'app.py'), 'w').close()
+            runlib.CONFIG.clear()
+            runlib.load_config(op.join(root, 'config.ini'), {'ROOTDIR': root, 'CONFIG': 'config.ini'})
+            flags = []
+            for invalidation in (None, 'unchecked-hash'):
+                env.subcmd_compile(root, op.join(root, '.venv'), 1, invalidation)
+                with open(importlib.util.cache_from_source(op.join(root, 'app.py')), 'rb') as pyc:
+                    flags.append(int.from_bytes(pyc.read(8)[4:], 'little'))
+        self.assertEqual(flags, [0b11, 0b01])
+
+
+if __name__ == '__main__':
+    unittest.main()
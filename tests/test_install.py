@@ -0,0 +1,182 @@
+import argparse
+import json
+import os
+from os import path as op
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import runlib
+from runlib import timings
+from runlib.modules import install
+
+
+STUB = '''#!{python}
+import json, os, sys
+with open(os.environ['STUB_LOG'], 'a') as log:
+    log.write(json.dumps([os.path.basename(sys.argv[0])] + sys.argv[1:]) + '\\n')
+'''
+
+
+class SshMasterTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        tmp = self.tmpdir.name
+        bindir = op.join(tmp, 'bin')
+        os.mkdir(bindir)
+        for name in ('ssh', 'rsync'):
+            with open(op.join(bindir, name), 'w') as stub:
+                stub.write(STUB.format(python=sys.executable))
+            os.chmod(op.join(bindir, name), 0o755)
+        self.log = op.join(tmp, 'calls.jsonl')
+        patcher = mock.patch.dict(os.environ, {'STUB_LOG': self.log, 'PATH': f'{bindir}:{os.environ["PATH"]}'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        runlib.CONFIG.clear()
+        runlib.load_config(op.join(tmp, 'config.ini'), {
+            'ROOTDIR': tmp, 'CONFIG': 'config.ini', 'VENV.DIR': '.venv',
+            'INSTALL.SSH_CMD': op.join(bindir, 'ssh')})
+
+    def calls(self):
+        with open(self.log) as log:
+            return [json.loads(line) for line in log]
+
+    def test_one_master_shared_by_all_commands(self):
+        args = argparse.Namespace(skip_build=True, clean=False, replace=False, start_cmd='true', upgrade_cmd='',
+                                  stop_cmd='true', blue_green=False, relink='current')
+        target = install._install_target('web1:/srv/app', args, 'install_scripts')
+        with target['stack']:
+            self.assertTrue(install._deploy_phase(target, 'relink', self.tmpdir.name, 'r1', args))
+            install._do_rsync(f'{self.tmpdir.name}/', 'web1:/srv/app/_installed_/', [], [], target['rsh'])
+            self.assertTrue(install._deploy_phase(target, 'relink', self.tmpdir.name, 'r1', args))
+            before_exit = self.calls()
+        calls = self.calls()
+
+        ssh_calls = [call for call in calls if call[0] == 'ssh']
+        rsync_calls = [call for call in calls if call[0] == 'rsync']
+        masters = [call for call in ssh_calls if '-M' in call]
+        self.assertEqual(len(masters), 1)
+        self.assertIn('-fN', masters[0])
+        control_path = next(arg for arg in masters[0] if arg.startswith('ControlPath='))
+
+        commands = [call for call in before_exit if call[0] == 'ssh' and '-M' not in call]
+        self.assertEqual(len(commands), 2)
+        for call in commands:
+            self.assertIn(control_path, call)
+            self.assertIn('web1', call)
+        self.assertEqual(len(rsync_calls), 1)
+        rsh = next(arg for arg in rsync_calls[0] if arg.startswith('--rsh='))
+        self.assertIn(control_path, rsh)
+
+        self.assertEqual(len(calls), len(before_exit) + 1)
+        self.assertEqual(calls[-1][-3:], ['-O', 'exit', 'web1'])
+        self.assertIn(control_path, calls[-1])
+        self.assertFalse(op.exists(op.dirname(control_path[len('ControlPath='):])))
+
+
+@unittest.skipUnless(shutil.which('rsync'), 'rsync is not installed')
+class ReleaseManifestTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.root = op.join(self.tmpdir.name, 'app')
+        os.makedirs(op.join(self.root, 'build'))
+        self.write('app.py', 'app = None\n')
+        self.write('.gitignore', 'build/\n*.log\n')
+        self.write('build/bundle.js', 'v1\n')
+        self.wheelhouse = op.join(self.tmpdir.name, 'wheelhouse')
+        os.mkdir(self.wheelhouse)
+
+    def write(self, name: str, data: str, root: str | None = None):
+        with open(op.join(root or self.root, name), 'w') as out:
+            out.write(data)
+
+    def digest(self, moves: bool = True):
+        trees = {'': (self.root, ['.git', 'local.cfg'], [])}
+        if moves:
+            trees['static'] = (op.join(self.root, 'build'), ['.git'], [])
+            trees['.wheelhouse'] = (self.wheelhouse, ['.complete'], [])
+        return install.release_manifest(trees)[0]
+
+    def test_shipped_files_only(self):
+        initial = self.digest(False)
+        for name in ('build/bundle.js', 'debug.log', 'local.cfg'):
+            self.write(name, 'changed\n')
+            self.assertEqual(self.digest(False), initial, name)
+        self.write('new.py', '')
+        self.assertNotEqual(self.digest(False), initial)
+
+    def test_moved_and_wheelhouse_files_change_digest(self):
+        initial = self.digest()
+        self.write('build/bundle.js', 'v2\n')
+        moved = self.digest()
+        self.assertNotEqual(moved, initial)
+        self.write('pkg-1.0-py3-none-any.whl', 'wheel', self.wheelhouse)
+        with_wheel = self.digest()
+        self.assertNotEqual(with_wheel, moved)
+        self.write('.complete', '', self.wheelhouse)
+        self.assertEqual(self.digest(), with_wheel)
+
+
+class EvictWheelhousesTest(unittest.TestCase):
+    def test_keeps_recent_and_referenced(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            runlib.CONFIG.clear()
+            runlib.load_config(op.join(tmp, 'config.ini'),
+                               {'ROOTDIR': tmp, 'CONFIG': 'config.ini', 'VENV.DIR': '.venv'})
+            root = op.join(tmp, '.venv', 'wheelhouse')
+            for age, name in enumerate(['e', 'd', 'c', 'b', 'a']):
+                os.makedirs(op.join(root, name))
+                os.utime(op.join(root, name), (1000 - age, 1000 - age))
+            install.evict_wheelhouses(tmp, {op.join(root, 'a')})
+            self.assertEqual(sorted(os.listdir(root)), ['a', 'c', 'd', 'e'])
+
+
+class BlueGreenTest(unittest.TestCase):
+    def test_systemd_units_refused(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            bindir = op.join(tmp, 'bin')
+            os.makedirs(bindir)
+            os.makedirs(op.join(tmp, 'app', '_installed_', 'units'))
+            open(op.join(tmp, 'app', '_installed_', 'units', 'app.service'), 'w').close()
+            with open(op.join(tmp, 'app', '_installed_', 'ctl'), 'w') as ctl:
+                ctl.write('#!/bin/sh\n')
+            os.chmod(op.join(tmp, 'app', '_installed_', 'ctl'), 0o755)
+            with open(op.join(bindir, 'systemctl'), 'w') as stub:
+                stub.write(STUB.format(python=sys.executable))
+            os.chmod(op.join(bindir, 'systemctl'), 0o755)
+            runlib.CONFIG.clear()
+            runlib.load_config(op.join(tmp, 'config.ini'),
+                               {'ROOTDIR': tmp, 'CONFIG': 'config.ini', 'VENV.DIR': '.venv'})
+            log = op.join(tmp, 'calls.jsonl')
+            with mock.patch.dict(os.environ, {'STUB_LOG': log, 'PATH': f'{bindir}:{os.environ["PATH"]}'}):
+                install.do_relink(op.join(tmp, 'app'), lambda cmd: ['bash', '-c', cmd], 'current',
+                                  (f'touch {tmp}/started', '', f'touch {tmp}/stopped'), switch_cmd='')
+            self.assertFalse(op.exists(op.join(tmp, 'started')))
+            self.assertFalse(op.exists(op.join(tmp, 'stopped')))
+            self.assertFalse(op.lexists(op.join(tmp, 'app', 'current')))
+            self.assertFalse(op.exists(log))
+
+
+class RunTimingsTest(unittest.TestCase):
+    def test_banners_and_rsync_log_stats(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            summary, log_file = op.join(tmp, 'timings.json'), op.join(tmp, 'rsync.log')
+            with open(log_file, 'w') as log:
+                log.write('2026/01/01 10:00:00 [42] sent 1,234 bytes  received 56 bytes  total size 7,890\n')
+            script = 'echo " ** Stop cmd **" >&2; printf "prompt without newline? " >&2; echo out'
+            with timings.session('test', summary):
+                res = install._run(['sh', '-c', script], 'relink', stats_file=log_file, stdout=subprocess.DEVNULL)
+            self.assertEqual(res.returncode, 0)
+            with open(summary) as summary_file:
+                phases = {phase['name']: phase for phase in json.load(summary_file)['phases']}
+        self.assertIn('stop', phases)
+        self.assertEqual((phases['relink']['bytes_sent'], phases['relink']['bytes_received']), (1234, 56))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import os
+from os import path as op
+import tempfile
+import unittest
+from unittest import mock
+
+from runlib import inventory
+
+
+def add_dist(site: str, name: str, version: str, requires: tuple[str, ...] = ()):
+    dist_info = op.join(site, f'{name.replace("-", "_")}-{version}.dist-info')
+    os.makedirs(dist_info)
+    with open(op.join(dist_info, 'METADATA'), 'w') as meta:
+        meta.write(f'Metadata-Version: 2.1\nName: {name}\nVersion: {version}\n')
+        meta.writelines(f'Requires-Dist: {req}\n' for req in requires)
+
+
+class InventoryTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.venv = self.tmpdir.name
+        self.site = op.join(self.venv, 'lib', 'python3.11', 'site-packages')
+        add_dist(self.site, 'Django', '5.0', ('asgiref>=3.7', 'sqlparse>=0.3.1', 'argon2-cffi; extra == "argon2"'))
+        add_dist(self.site, 'asgiref', '3.8.1', ('typing_extensions>=4; python_version < "3.11"',))
+        add_dist(self.site, 'sqlparse', '0.5.0')
+        add_dist(self.site, 'typing_extensions', '4.12.2')
+        add_dist(self.site, 'argon2-cffi', '23.1.0')
+        add_dist(self.site, 'Zope.Interface', '6.4', ('zope-event',))
+
+    def test_installed(self):
+        packages = inventory.installed(self.venv)
+        self.assertEqual(packages['django'], ('5.0', 'Django'))
+        self.assertEqual(packages['zope-interface'], ('6.4', 'Zope.Interface'))
+        self.assertEqual(packages['typing-extensions'], ('4.12.2', 'typing_extensions'))
+        self.assertEqual(len(packages), 6)
+        self.assertTrue(op.exists(op.join(self.venv, inventory.CACHE_FILE)))
+
+    def test_cache(self):
+        packages = inventory.installed(self.venv)
+        with mock.patch.object(inventory, '_scan_dirs') as scan:
+            self.assertEqual(inventory.installed(self.venv), packages)
+        scan.assert_not_called()
+
+        add_dist(self.site, 'gunicorn', '22.0')
+        os.utime(self.site, ns=(0, os.stat(self.site).st_mtime_ns + 1))
+        self.assertEqual(inventory.installed(self.venv)['gunicorn'], ('22.0', 'gunicorn'))
+
+    def test_damaged_cache(self):
+        with open(op.join(self.venv, inventory.CACHE_FILE), 'w') as cache:
+            cache.write('{"mtimes": ')
+        self.assertEqual(inventory.installed(self.venv)['sqlparse'], ('0.5.0', 'sqlparse'))
+
+    def test_dependencies(self):
+        self.assertEqual(inventory.dependencies(self.venv, {'django'}),
+                         {'django', 'asgiref', 'sqlparse', 'typing-extensions'})
+        self.assertEqual(inventory.dependencies(self.venv, {'Zope_Interface', 'missing'}), {'zope-interface'})
+        self.assertEqual(inventory.dependencies(self.venv, set()), set())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import io
+import json
+import os
+from os import path as op
+import tempfile
+import unittest
+from unittest import mock
+
+from runlib import profiling
+
+
+class RequestedTest(unittest.TestCase):
+    def test_requested(self):
+        self.assertTrue(profiling.requested(['--profile', 'env', 'update']))
+        self.assertTrue(profiling.requested(['-l', 'DEBUG', '--venv', '.venv', '--profile', 'env']))
+        self.assertFalse(profiling.requested(['env', '--profile']))
+        self.assertFalse(profiling.requested(['--venv', '--profile', 'env']))
+        self.assertFalse(profiling.requested([]))
+
+
+class Chunks:
+    def __init__(self, *chunks: bytes):
+        self.chunks = list(chunks)
+
+    def read1(self, size: int):
+        return self.chunks.pop(0) if self.chunks else b''
+
+
+class RelayTest(unittest.TestCase):
+    def relay(self, *chunks: bytes):
+        stderr, imports = io.TextIOWrapper(io.BytesIO()), io.BytesIO()
+        with mock.patch('sys.stderr', stderr):
+            profiling._relay(Chunks(*chunks), imports)
+        return stderr.buffer.getvalue(), imports.getvalue()
+
+    def test_split_lines(self):
+        stderr, imports = self.relay(b'hello\nimport ti', b'me: 12 | 34 | os\nwor', b'ld\n',
+                                     b'import time: 1 | 1 | x')
+        self.assertEqual(stderr, b'hello\nworld\n')
+        self.assertEqual(imports, b'import time: 12 | 34 | os\nimport time: 1 | 1 | x')
+
+    def test_partial_lines(self):
+        # A prompt without a newline is shown right away, a possible import line is held back.
+        self.assertEqual(self.relay(b'Password: '), (b'Password: ', b''))
+        self.assertEqual(self.relay(b'import', b' time: 5 | 5 | y\n'), (b'', b'import time: 5 | 5 | y\n'))
+
+
+class ReportTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.rootdir = op.join(self.tmpdir.name, 'versions', 'abc123')
+        self.workdir = op.join(self.tmpdir.name, 'work')
+        os.makedirs(self.rootdir)
+        os.mkdir(self.workdir)
+
+    def write(self, name: str, content: str):
+        with open(op.join(self.workdir, name), 'w') as out:
+            out.write(content)
+
+    def test_report(self):
+        self.write('meta.json', json.dumps({'rootdir': self.rootdir, 'command': 'env', 'argv': ['env', 'show']}))
+        events = [
+            {'name': 'venv', 'pid': 10, 'executable': '/usr/bin/python3', 'start': 100.5, 'duration': 0.25,
+             'status': 'exec'},
+            {'name': 'command', 'pid': 10, 'executable': '/srv/.venv/bin/python', 'start': 101.0, 'duration': 0.5},
+        ]
+        self.write('phases.jsonl', ''.join(json.dumps(event) + '\n' for event in events))
+        self.write('importtime.txt', 'import time: self [us] | cumulative | imported package\n'
+                   'import time:       300 |        300 |   json\n'
+                   'import time:      1500 |       2500 | runlib\n')
+
+        outdir = profiling._report(self.workdir, 100.0, 102.0, 3)
+
+        self.assertEqual(op.dirname(outdir), op.join(self.rootdir, 'var', 'profile'))
+        self.assertTrue(op.basename(outdir).endswith('-env'))
+        with open(op.join(outdir, 'phases.json')) as phases_file:
+            summary = json.load(phases_file)
+        self.assertEqual(summary['release'], 'abc123')
+        self.assertEqual((summary['exit'], summary['total']), (3, 2.0))
+        self.assertEqual(summary['processes'], ['/usr/bin/python3', '/srv/.venv/bin/python'])
+        self.assertEqual(summary['phases'], [
+            {'name': 'venv', 'process': 0, 'start': 0.5, 'duration': 0.25, 'status': 'exec'},
+            {'name': 'command', 'process': 1, 'start': 1.0, 'duration': 0.5},
+        ])
+        self.assertTrue(op.exists(op.join(outdir, 'importtime.txt')))
+        self.assertFalse(op.exists(op.join(self.workdir, 'importtime.txt')))
+        with open(op.join(outdir, 'report.txt')) as report_file:
+            report = report_file.read()
+        self.assertIn('command: env show  release: abc123  exit: 3  total: 2000.0 ms', report)
+        self.assertIn('venv            0      500.0      250.0  (exec)', report)
+        self.assertIn('imports: 2, slowest (cumulative ms, self ms):\n       2.5        1.5  runlib\n', report)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import http.server
+from os import path as op
+import socketserver
+import tempfile
+import threading
+import unittest
+
+from runlib import readiness
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    status = 200
+    paths: list[str] = []
+
+    def do_GET(self):
+        self.paths.append(self.path)
+        self.send_response(self.status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class HttpUnixProbeTest(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.path = op.join(tmpdir.name, 'app.socket')
+        self.spec = f'http+unix://{self.path}'
+
+    def serve(self, status: int):
+        self.paths: list[str] = []
+        handler = type('StatusHandler', (Handler,), {'status': status, 'paths': self.paths})
+        server = socketserver.UnixStreamServer(self.path, handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+    def test_probe(self):
+        self.assertFalse(readiness.probe(self.spec))
+        self.assertTrue(readiness.socket_released(self.spec))
+        self.serve(200)
+        self.assertTrue(readiness.probe(self.spec))
+        self.assertFalse(readiness.socket_released(self.spec))
+        self.assertEqual(self.paths, ['/'])
+
+    def test_request_path(self):
+        self.serve(200)
+        self.assertTrue(readiness.probe(f'{self.spec}#/health?full=1'))
+        self.assertEqual(self.paths, ['/health?full=1'])
+        self.assertFalse(readiness.socket_released(f'{self.spec}#/health'))
+
+    def test_server_error(self):
+        self.serve(503)
+        self.assertFalse(readiness.probe(self.spec))
+
+
+class UwsgiPacketTest(unittest.TestCase):
+    def test_unix_request_path(self):
+        packet = readiness._uwsgi_packet(readiness.urlsplit('uwsgi+unix:///run/app.socket#/health?full=1'))
+        self.assertIn(b'\x09\x00PATH_INFO\x07\x00/health', packet)
+        self.assertIn(b'\x0c\x00QUERY_STRING\x06\x00full=1', packet)
+        packet = readiness._uwsgi_packet(readiness.urlsplit('uwsgi+unix:///run/app.socket'))
+        self.assertIn(b'\x09\x00PATH_INFO\x01\x00/', packet)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import os
+from os import path as op
+import tempfile
+import unittest
+
+from runlib import requirements
+
+
+def lines(text: str):
+    return [requirements.parse_line(line) for line in text.splitlines(keepends=True)]
+
+
+def text(reqs: list[requirements.Requirement]):
+    return ''.join(req.line for req in reqs)
+
+
+class ParseTest(unittest.TestCase):
+    def test_requirement(self):
+        req = requirements.parse_line('Django [bcrypt, argon2] >= 4.2, < 5 ; python_version >= "3.10"  # web\n')
+        self.assertEqual((req.name, req.key, req.extras, req.spec, req.marker, req.comment),
+                         ('Django', 'django', '[bcrypt,argon2]', '>=4.2,<5', '; python_version >= "3.10"', '# web'))
+        self.assertEqual(req.version, '')
+        self.assertEqual(requirements.parse_line('pkg==1.0\n').version, '1.0')
+
+    def test_comments(self):
+        self.assertEqual(requirements.parse_line('pkg==1.0\t# pinned\n')[1:6], ('pkg', '', '==1.0', '', '# pinned'))
+        self.assertEqual(requirements.parse_line('pkg==1.0#egg\n').spec, '==1.0#egg')
+        self.assertEqual(requirements.parse_line('  # note\n'), requirements.Requirement('  # note\n'))
+
+    def test_includes_and_options(self):
+        self.assertEqual(requirements.parse_line('-r base.txt  # shared\n')[6], 'base.txt')
+        self.assertEqual(requirements.parse_line('--constraint=c.txt\n').include, 'c.txt')
+        option = requirements.parse_line('--index-url https://pypi.example/simple\n')
+        self.assertEqual((option.name, option.include), ('', ''))
+
+    def test_url_requirement(self):
+        req = requirements.parse('pkg @ https://host/pkg-1.0-py3-none-any.whl#sha256=abc ; os_name == "posix"')
+        self.assertEqual((req.name, req.spec, req.marker),
+                         ('pkg', ' @ https://host/pkg-1.0-py3-none-any.whl#sha256=abc', '; os_name == "posix"'))
+        self.assertEqual(req.line, 'pkg @ https://host/pkg-1.0-py3-none-any.whl#sha256=abc ; os_name == "posix"\n')
+        self.assertEqual(requirements.parse('pkg@file:///src/pkg').format(), 'pkg @ file:///src/pkg')
+
+    def test_invalid(self):
+        for spec in ('-e .', '# comment', '==1.0'):
+            with self.assertRaisesRegex(ValueError, 'Invalid requirement'):
+                requirements.parse(spec)
+
+
+class AddRemoveTest(unittest.TestCase):
+    def test_sorted_insert(self):
+        reqs = lines('# header\nalpha\ngamma  # keep\n')
+        self.assertTrue(requirements.add(reqs, requirements.parse('beta==2')))
+        self.assertTrue(requirements.add(reqs, requirements.parse('zeta')))
+        self.assertEqual(text(reqs), '# header\nalpha\nbeta==2\ngamma  # keep\nzeta\n')
+
+    def test_replace_keeps_comment_and_marker(self):
+        reqs = lines('Gamma>=1 ; python_version < "4"  # keep\n')
+        self.assertFalse(requirements.add(reqs, requirements.parse('gamma==2')))
+        self.assertEqual(text(reqs), 'gamma==2 ; python_version < "4"  # keep\n')
+
+    def test_append_before_trailing_comments(self):
+        reqs = lines('alpha\nbeta\n\n# dev tools, see dev.txt\n-r dev.txt\n\n')
+        requirements.add(reqs, requirements.parse('gamma'))
+        self.assertEqual(text(reqs), 'alpha\nbeta\ngamma\n\n# dev tools, see dev.txt\n-r dev.txt\n\n')
+
+    def test_append_without_newline(self):
+        reqs = lines('# only a comment')
+        requirements.add(reqs, requirements.parse('alpha'))
+        self.assertEqual(text(reqs), '# only a comment\nalpha\n')
+
+    def test_remove(self):
+        reqs = lines('alpha\n-r other.txt\nBeta.Pkg  # gone\n')
+        requirements.remove(reqs, 'beta-pkg')
+        self.assertEqual(text(reqs), 'alpha\n-r other.txt\n')
+
+
+class FileTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def path(self, name: str, data: str | None = None):
+        filename = op.join(self.tmpdir.name, name)
+        if data is not None:
+            with open(filename, 'w') as out:
+                out.write(data)
+        return filename
+
+    def test_load_includes(self):
+        self.path('base.txt', 'alpha==1\n-c missing.txt\n')
+        files = requirements.load(self.path('requirements.txt', '-r base.txt\nalpha==2\nbeta\n'))
+        self.assertEqual(list(files), [self.path('requirements.txt'), self.path('base.txt')])
+        entries = requirements.entries(files)
+        self.assertEqual(sorted(entries), ['alpha', 'beta'])
+        self.assertEqual(entries['alpha'], (self.path('requirements.txt'), files[self.path('requirements.txt')][1]))
+
+    def test_write_round_trip(self):
+        data = '# header\r\nalpha==1\t# pinned\n--hash=sha256:aa \\\n\nbeta'
+        filename = self.path('requirements.txt', data)
+        os.chmod(filename, 0o640)
+        reqs = requirements.load(filename)[filename]
+        requirements.write(filename, reqs)
+        with open(filename, newline='') as req_file:
+            self.assertEqual(req_file.read(), data.replace('\r\n', '\n'))
+        self.assertEqual(os.stat(filename).st_mode & 0o777, 0o640)
+        self.assertEqual(os.listdir(self.tmpdir.name), ['requirements.txt'])
+
+
+if __name__ == '__main__':
+    unittest.main()
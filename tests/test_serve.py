@@ -0,0 +1,115 @@
+import os
+import signal
+import socket
+import time
+import unittest
+import urllib.request
+from wsgiref.util import setup_testing_defaults
+
+from runlib.modules import serve
+
+
+def pid_app(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [str(os.getpid()).encode()]
+
+
+def call(app, path):
+    environ = {'PATH_INFO': path}
+    setup_testing_defaults(environ)
+    statuses = []
+    body = b''.join(app(environ, lambda status, headers: statuses.append(status)))
+    return statuses[0], environ, body
+
+
+class MountedTest(unittest.TestCase):
+    def setUp(self):
+        self.app = serve.mounted(pid_app, '/api/')
+
+    def test_root_mount(self):
+        self.assertIs(serve.mounted(pid_app, '/'), pid_app)
+        self.assertIs(serve.mounted(pid_app, ''), pid_app)
+
+    def test_prefix_moves_to_script_name(self):
+        status, environ, _ = call(self.app, '/api/items/1')
+        self.assertEqual(status, '200 OK')
+        self.assertEqual((environ['SCRIPT_NAME'], environ['PATH_INFO']), ('/api', '/items/1'))
+        status, environ, _ = call(self.app, '/api')
+        self.assertEqual((environ['SCRIPT_NAME'], environ['PATH_INFO']), ('/api', ''))
+
+    def test_outside_mount(self):
+        for path in ('/', '/apix', '/other/api'):
+            status, environ, body = call(self.app, path)
+            self.assertEqual((status, body), ('404 Not Found', b'Not Found'))
+            self.assertEqual(environ['PATH_INFO'], path)
+
+
+class ServeTest(unittest.TestCase):
+    def setUp(self):
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            self.port = sock.getsockname()[1]
+
+    def start(self, workers: int, max_requests: int):
+        pid = os.fork()
+        if not pid:
+            code = 1
+            try:
+                os.setpgid(0, 0)
+                code = 0 if serve.serve(pid_app, '127.0.0.1', self.port, workers, 2, max_requests, 5) else 1
+            finally:
+                os._exit(code)
+        self.addCleanup(self.stop, pid)
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                self.get()
+                return pid
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+
+    def stop(self, pid: int):
+        """Stop the server and any worker it left behind (the server runs in its own process group)."""
+        try:
+            os.killpg(pid, signal.SIGTERM)
+            self.wait(pid)
+        except (ProcessLookupError, ChildProcessError):
+            pass
+        finally:
+            try:
+                os.killpg(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+    def get(self):
+        with urllib.request.urlopen(f'http://127.0.0.1:{self.port}/', timeout=5) as response:
+            self.assertEqual(response.status, 200)
+            return int(response.read())
+
+    def wait(self, pid: int, timeout: float = 10):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            done, status = os.waitpid(pid, os.WNOHANG)
+            if done:
+                return os.waitstatus_to_exitcode(status)
+            time.sleep(0.05)
+        self.fail(f'serve did not stop in {timeout}s')
+
+    def test_workers_recycled(self):
+        self.start(workers=2, max_requests=5)
+        pids = [self.get() for _ in range(60)]
+        # Each worker retires after 5 connections, so 60 requests need several generations of them.
+        self.assertGreater(len(set(pids)), 4)
+
+    def test_sigterm(self):
+        pid = self.start(workers=2, max_requests=0)
+        os.kill(pid, signal.SIGTERM)
+        self.assertEqual(self.wait(pid), 0)
+        with self.assertRaises(OSError):
+            self.get()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import contextlib
+import io
+import os
+from os import path as op
+import tempfile
+import unittest
+
+import runlib
+from runlib.modules import tasks
+
+
+class TasksTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.root = self.tmpdir.name
+        self.cache_file = op.join(self.root, '.venv', tasks.CACHE_FILE)
+        os.mkdir(op.join(self.root, '.venv'))
+
+    def configure(self, section: str):
+        with open(op.join(self.root, 'config.ini'), 'w') as config:
+            config.write(f'[TASKS]\n{section}')
+        runlib.CONFIG.clear()
+        runlib.load_config(op.join(self.root, 'config.ini'), {'ROOTDIR': self.root, 'CONFIG': 'config.ini'})
+        return tasks.load_tasks()
+
+    def write(self, name: str, content: str):
+        with open(op.join(self.root, name), 'w') as out:
+            out.write(content)
+
+    def run_tasks(self, names: list[str], **kwargs):
+        loaded = tasks.load_tasks()
+        with contextlib.redirect_stdout(io.TextIOWrapper(io.BytesIO())):
+            results = tasks.run(self.root, loaded, tasks.closure(loaded, names), self.cache_file, 2, **kwargs)
+        return {name: status for name, (status, _) in results.items()}
+
+
+class LoadTasksTest(TasksTest):
+    def test_load(self):
+        self.assertEqual(self.configure('build = make all\nbuild.deps = gen\nbuild.inputs = src/**, Makefile\n'
+                                        'build.outputs = dist\ngen = ./gen.sh\n'), {
+            'build': {'command': 'make all', 'deps': ['gen'], 'inputs': ['src/**', 'Makefile'], 'outputs': ['dist']},
+            'gen': {'command': './gen.sh', 'deps': [], 'inputs': [], 'outputs': []},
+        })
+
+    def test_invalid(self):
+        for section, message in (('build.deps = gen\n', 'undefined task build'),
+                                 ('build = make\nbuild.needs = gen\n', 'Unknown task option: build.needs'),
+                                 ('build = make\nbuild.deps = gen\n', 'depends on undefined task gen')):
+            with self.assertRaisesRegex(ValueError, message):
+                self.configure(section)
+
+    def test_closure(self):
+        loaded = self.configure('a = true\na.deps = b c\nb = true\nb.deps = c\nc = true\nd = true\n')
+        self.assertEqual(tasks.closure(loaded, ['a']), ['c', 'b', 'a'])
+        self.assertEqual(tasks.closure(loaded, ['d', 'b']), ['d', 'c', 'b'])
+        with self.assertRaisesRegex(ValueError, 'Unknown task: e'):
+            tasks.closure(loaded, ['e'])
+
+    def test_cycle(self):
+        loaded = self.configure('a = true\na.deps = b\nb = true\nb.deps = c\nc = true\nc.deps = b\n')
+        with self.assertRaisesRegex(ValueError, r'Dependency cycle: b -> c -> b'):
+            tasks.closure(loaded, ['a'])
+
+
+class RunTest(TasksTest):
+    def test_cache_skip(self):
+        self.configure('gen = cat in.txt > out.txt && echo run >> log\ngen.inputs = in.txt\ngen.outputs = out.txt\n'
+                       'use = cat out.txt > used.txt\nuse.deps = gen\nuse.inputs = use.sh\nuse.outputs = used.txt\n')
+        self.write('in.txt', 'one\n')
+        self.write('use.sh', '')
+        self.assertEqual(self.run_tasks(['use']), {'gen': 'ok', 'use': 'ok'})
+        self.assertEqual(self.run_tasks(['use']), {'gen': 'cached', 'use': 'cached'})
+        self.assertEqual(self.run_tasks(['use'], force=True), {'gen': 'ok', 'use': 'ok'})
+
+        self.write('in.txt', 'two\n')
+        self.assertEqual(self.run_tasks(['use']), {'gen': 'ok', 'use': 'ok'})
+        with open(op.join(self.root, 'used.txt')) as used:
+            self.assertEqual(used.read(), 'two\n')
+
+        os.remove(op.join(self.root, 'out.txt'))
+        self.assertEqual(self.run_tasks(['gen']), {'gen': 'ok'})
+        with open(op.join(self.root, 'log')) as log:
+            self.assertEqual(log.read().count('run'), 4)
+
+    def test_no_inputs_always_run(self):
+        self.configure('gen = echo run >> log\n')
+        self.assertEqual(self.run_tasks(['gen']), {'gen': 'ok'})
+        self.assertEqual(self.run_tasks(['gen']), {'gen': 'ok'})
+
+    def test_failed_dependency(self):
+        self.configure('fail = exit 3\nafter = touch after\nafter.deps = fail\nother = touch other\n'
+                       'all = true\nall.deps = after other\n')
+        results = self.run_tasks(['all'], keep_going=True)
+        self.assertEqual(results, {'fail': 'exit 3', 'after': 'skipped', 'other': 'ok', 'all': 'skipped'})
+        self.assertFalse(op.exists(op.join(self.root, 'after')))
+        self.assertTrue(op.exists(op.join(self.root, 'other')))
+
+    def test_summary(self):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            tasks._print_summary({'build': ('ok', 1.25), 'a': ('exit 1', 0.0)})
+        self.assertEqual(out.getvalue(), 'TASK   STATUS  TIME\nbuild  ok      1.2s\na      exit 1  0.0s\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import contextlib
+import copy
+import io
+import json
+from os import path as op
+import socket
+import tempfile
+import threading
+import unittest
+
+from runlib.modules import uwsgi
+
+
+with open(op.join(op.dirname(__file__), 'data', 'uwsgi_stats.json')) as recorded:
+    STATS = json.load(recorded)
+
+
+class FakeStatsServer:
+    """Serve *payloads* in turn, one per connection, like the uwsgi stats server on a unix socket."""
+
+    def __init__(self, path: str, payloads: list[dict]):
+        self.payloads = list(payloads)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(path)
+        self.sock.listen()
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def serve(self):
+        for payload in self.payloads:
+            conn, _ = self.sock.accept()
+            with conn:
+                conn.sendall(json.dumps(payload).encode('utf-8'))
+
+    def close(self):
+        self.sock.close()
+
+
+class StatsTest(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.address = op.join(tmpdir.name, 'uwsgi.stats')
+        later = copy.deepcopy(STATS)
+        later['workers'][0]['requests'] += 50
+        later['workers'][0]['status'] = 'idle'
+        self.server = FakeStatsServer(self.address, [STATS, later])
+        self.addCleanup(self.server.close)
+
+    def test_worker_rows(self):
+        first = uwsgi.read_stats(self.address)
+        second = uwsgi.read_stats(self.address)
+        sample = uwsgi.stats_sample(first, None, 0)
+        self.assertEqual(sample['busy'], 1)
+        self.assertEqual((sample['listen_queue'], sample['listen_queue_max'], sample['listen_queue_errors']),
+                         (3, 100, 1))
+        busy, idle = sample['workers']
+        self.assertEqual((busy['id'], busy['pid'], busy['status']), (1, 999991, 'busy'))
+        self.assertEqual((idle['id'], idle['status']), (2, 'idle'))
+        self.assertIsNone(busy['rps'])
+        self.assertEqual((busy['avg_ms'], idle['avg_ms']), (12.5, 4.0))
+        self.assertEqual((busy['rss'], idle['rss']), (52428800, 41943040))
+        self.assertEqual((busy['exceptions'], busy['respawns']), (2, 1))
+
+        sample = uwsgi.stats_sample(second, first, 2.0)
+        self.assertEqual([worker['rps'] for worker in sample['workers']], [25.0, 0.0])
+        self.assertEqual(sample['busy'], 0)
+
+    def test_json_lines(self):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            uwsgi.show_stats(self.address, 0.01, 1, True)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 1)
+        sample = json.loads(lines[0])
+        self.assertEqual(sample['pid'], 999990)
+        self.assertEqual(sample['listen_queue'], 3)
+        self.assertEqual([worker['status'] for worker in sample['workers']], ['idle', 'idle'])
+        self.assertGreater(sample['workers'][0]['rps'], 0)
+        self.assertEqual(sample['workers'][1]['rps'], 0)
+        self.assertEqual(sample['workers'][0]['rss'], 52428800)
+
+    def test_table(self):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            uwsgi.show_stats(self.address, 0.01, 1, False)
+        header, columns, first, second = out.getvalue().splitlines()
+        self.assertIn('busy: 0/2', header)
+        self.assertIn('listen queue: 3/100 (overflows: 1)', header)
+        self.assertEqual(columns.split()[:5], ['WORKER', 'PID', 'STATUS', 'REQUESTS', 'RPS'])
+        self.assertEqual(first.split()[:4], ['1', '999991', 'idle', '1250'])
+        self.assertEqual(second.split()[6], '40.0')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import json
+import os
+from os import path as op
+import tempfile
+import unittest
+
+import runlib
+from runlib import venvcache
+
+
+class VenvCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        tmp = self.tmpdir.name
+        runlib.CONFIG.clear()
+        runlib.load_config(op.join(tmp, 'config.ini'), {
+            'ROOTDIR': tmp, 'CONFIG': 'config.ini', 'VENV.CACHE_DIR': op.join(tmp, 'cache')})
+        self.venv = op.join(tmp, 'app1', '.venv')
+        self.write(self.venv, 'pyvenv.cfg', f'home = /usr/bin\ncommand = python -m venv {self.venv}\n')
+        self.write(self.venv, 'bin/activate', f'VIRTUAL_ENV="{self.venv}"\n')
+        self.write(self.venv, 'lib/python3/site-packages/pkg.py', 'VALUE = 1\n')
+        os.symlink('/usr/bin/python3', op.join(self.venv, 'bin', 'python'))
+
+    def write(self, root: str, name: str, data: str):
+        os.makedirs(op.dirname(op.join(root, name)), exist_ok=True)
+        with open(op.join(root, name), 'w') as out:
+            out.write(data)
+
+    def read(self, root: str, name: str):
+        with open(op.join(root, name)) as src:
+            return src.read()
+
+    def test_store_and_restore_elsewhere(self):
+        venvcache.store('key1', self.venv)
+        entry = op.join(venvcache.store_dir(), 'key1')
+        target = op.join(self.tmpdir.name, 'app2', '.venv')
+        os.makedirs(op.dirname(target))
+        self.assertTrue(venvcache.restore('key1', target))
+        self.assertEqual(self.read(target, 'bin/activate'), f'VIRTUAL_ENV="{target}"\n')
+        self.assertIn(f'venv {target}\n', self.read(target, 'pyvenv.cfg'))
+        self.assertEqual(self.read(entry, 'bin/activate'), f'VIRTUAL_ENV="{self.venv}"\n')
+        self.assertEqual(os.readlink(op.join(target, 'bin', 'python')), '/usr/bin/python3')
+        pkg = 'lib/python3/site-packages/pkg.py'
+        self.assertEqual(os.stat(op.join(target, pkg)).st_ino, os.stat(op.join(entry, pkg)).st_ino)
+        self.assertEqual(os.listdir(op.dirname(target)), ['.venv'])
+
+    def test_miss(self):
+        self.assertFalse(venvcache.restore('missing', op.join(self.tmpdir.name, 'app2', '.venv')))
+
+    def test_damaged_entry(self):
+        venvcache.store('key1', self.venv)
+        os.rename(op.join(venvcache.store_dir(), 'key1', 'bin'), op.join(venvcache.store_dir(), 'key1', 'scripts'))
+        target = op.join(self.tmpdir.name, 'app2', '.venv')
+        os.makedirs(op.dirname(target))
+        with self.assertLogs('runlib', 'WARNING'):
+            self.assertFalse(venvcache.restore('key1', target))
+        self.assertEqual(os.listdir(op.dirname(target)), [])
+
+    def test_evict_least_recently_used(self):
+        root = venvcache.store_dir()
+        for key, used in (('old', 1.0), ('mid', 2.0), ('new', 3.0)):
+            os.makedirs(op.join(root, key))
+            with open(op.join(root, key + venvcache.META_SUFFIX), 'w') as meta:
+                json.dump({'path': self.venv, 'size': 100, 'used': used}, meta)
+        venvcache.evict(250)
+        self.assertEqual(sorted(os.listdir(root)), ['mid', 'mid.json', 'new', 'new.json'])
+        venvcache.evict(10)
+        self.assertEqual(sorted(os.listdir(root)), ['new', 'new.json'])
+
+    def test_parse_size(self):
+        self.assertEqual([venvcache.parse_size(value) for value in ('512', '2K', '1.5MiB', '1gb')],
+                         [512, 2048, 1572864, 1 << 30])
+        with self.assertRaises(ValueError):
+            venvcache.parse_size('lots')
+
+
+if __name__ == '__main__':
+    unittest.main()
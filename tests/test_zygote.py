@@ -0,0 +1,48 @@
+import importlib
+import os
+from os import path as op
+import sys
+import tempfile
+import unittest
+
+import runlib
+from runlib.modules import zygote
+
+
+class CodeFilesTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.root = self.tmpdir.name
+        runlib.CONFIG.clear()
+        runlib.load_config(op.join(self.root, 'config.ini'), {'ROOTDIR': self.root, 'CONFIG': 'config.ini'})
+        self.package = op.join(self.root, 'zygote_app')
+        os.mkdir(self.package)
+        open(op.join(self.package, '__init__.py'), 'w').close()
+        sys.path.insert(0, self.root)
+        self.addCleanup(sys.path.remove, self.root)
+        self.addCleanup(sys.modules.pop, 'zygote_app', None)
+        importlib.import_module('zygote_app')
+        os.utime(self.package, ns=(0, 0))
+
+    def test_new_module_in_package(self):
+        watched = op.join(self.root, 'commands')
+        files = zygote.code_files(self.root, [watched])
+        self.assertIn(self.package, files)
+        self.assertIn(op.join(self.package, '__init__.py'), files)
+        self.assertIn(watched, files)
+        mtimes = zygote._mtimes(files)
+        self.assertIsNone(mtimes[watched])
+        self.assertEqual(zygote._mtimes(files), mtimes)
+        open(op.join(self.package, 'new_command.py'), 'w').close()
+        self.assertNotEqual(zygote._mtimes(files), mtimes)
+
+    def test_watched_directory_created(self):
+        watched = op.join(self.root, 'commands')
+        mtimes = zygote._mtimes(zygote.code_files(self.root, [watched]))
+        os.mkdir(watched)
+        self.assertNotEqual(zygote._mtimes(list(mtimes)), mtimes)
+
+
+if __name__ == '__main__':
+    unittest.main()
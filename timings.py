@@ -0,0 +1,124 @@
+"""Wall-clock phase timings for deploy and service commands.
+
+Phases are recorded only while a :func:`session` is active. The session writes a JSON summary
+and, optionally, a Chrome trace (``chrome://tracing`` / Perfetto) events file when it ends.
+"""
+from contextlib import contextmanager
+import json
+import os
+import sys
+import threading
+import time
+from typing import Any, Iterator
+
+from . import logger
+
+
+_lock = threading.Lock()
+_local = threading.local()
+_events: list[dict[str, Any]] = []
+_active = False
+_origin = 0.0
+
+
+def enabled():
+    return _active
+
+
+def set_host(host: str):
+    """Attribute phases recorded by the current thread to *host*."""
+    _local.host = host
+
+
+@contextmanager
+def phase(name: str, **attrs: Any) -> Iterator[dict[str, Any]]:
+    """Time the enclosed block as phase *name*; the yielded dict collects extra attributes."""
+    record: dict[str, Any] = dict(attrs)
+    if not _active:
+        yield record
+        return
+    started = time.time()
+    status = 'ok'
+    try:
+        yield record
+    except BaseException as exc:
+        status = f'error: {exc.__class__.__name__}'
+        raise
+    finally:
+        returncode = record.get('returncode')
+        if returncode:
+            status = f'exit {returncode}'
+        event = {
+            'name': name,
+            'host': getattr(_local, 'host', ''),
+            'start': round(started - _origin, 6),
+            'duration': round(time.time() - started, 6),
+            'status': record.pop('status', status),
+            'thread': threading.get_ident(),
+        }
+        event.update(record)
+        with _lock:
+            _events.append(event)
+
+
+def _trace(events: list[dict[str, Any]]):
+    threads = {ident: idx for idx, ident in enumerate(dict.fromkeys(event['thread'] for event in events))}
+    return {'traceEvents': [{
+        'name': event['name'] if not event['host'] else f'{event["name"]} [{event["host"]}]',
+        'cat': 'runlib',
+        'ph': 'X',
+        'ts': int((_origin + event['start']) * 1e6),
+        'dur': int(event['duration'] * 1e6),
+        'pid': os.getpid(),
+        'tid': threads[event['thread']],
+        'args': {key: val for key, val in event.items() if key not in ('name', 'start', 'duration', 'thread')},
+    } for event in events], 'displayTimeUnit': 'ms'}
+
+
+def _write(filename: str, data: dict[str, Any]):
+    if filename == '-':
+        json.dump(data, sys.stderr, indent=2)
+        sys.stderr.write('\n')
+    else:
+        with open(filename, 'w') as out:
+            json.dump(data, out, indent=2)
+        logger.info('Timings written to %s', filename)
+
+
+@contextmanager
+def session(command: str, summary: str | None, trace: str | None = None) -> Iterator[None]:
+    """Record phases of *command*, writing the JSON *summary* and Chrome *trace* files at the end.
+
+    Nested sessions (e.g. ``restart`` calling ``stop`` and ``start``) are recorded as phases.
+    """
+    global _active, _origin
+
+    if _active or not (summary or trace):
+        with phase(command):
+            yield
+        return
+    _active, _origin = True, time.time()
+    del _events[:]
+    status = 'ok'
+    try:
+        with phase(command):
+            yield
+    except BaseException as exc:
+        status = f'error: {exc.__class__.__name__}'
+        raise
+    finally:
+        _active = False
+        events = sorted(_events, key=lambda event: event['start'])
+        failed = [event for event in events if event['status'] != 'ok']
+        if failed and status == 'ok':
+            status = 'failed'
+        if summary:
+            _write(summary, {
+                'command': command,
+                'started': _origin,
+                'total': round(time.time() - _origin, 6),
+                'status': status,
+                'phases': [{key: val for key, val in event.items() if key != 'thread'} for event in events],
+            })
+        if trace:
+            _write(trace, _trace(events))
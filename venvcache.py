@@ -0,0 +1,203 @@
+"""Content-addressed store of prebuilt virtualenvs.
+
+Entries are keyed by a hash of the normalized requirements and the interpreter. A hit is
+materialised by hardlinking the stored tree (falling back to ``cp --reflink=auto`` across
+filesystems) and relocating the absolute venv paths in ``bin/`` and ``pyvenv.cfg``.
+"""
+import hashlib
+import json
+import os
+from os import path as op
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import time
+
+from . import get_config_str, logger, requirements
+
+
+META_SUFFIX = '.json'
+SIZE_UNITS = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+
+
+def parse_size(value: str) -> int:
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*', value, re.IGNORECASE)
+    if not match:
+        raise ValueError(f'Invalid size: {value!r}')
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+
+def store_dir():
+    return op.expanduser(get_config_str('VENV.CACHE_DIR', '~/.cache/runlib/venvs'))
+
+
+def store_budget():
+    try:
+        return parse_size(get_config_str('VENV.CACHE_SIZE', '2G'))
+    except ValueError as exc:
+        logger.warning('%s, venv cache disabled', exc)
+        return 0
+
+
+def _normalized_requirements(req_file: str) -> list[str]:
+    try:
+        files = requirements.load(req_file)
+    except OSError:
+        return []
+    res: list[str] = []
+    for lines in files.values():
+        for req in lines:
+            if req.name:
+                res.append(req.format().replace(' ', '').lower())
+            elif not req.include and not req.line.lstrip().startswith('#') and req.line.strip():
+                res.append(req.line.partition(' #')[0].strip())
+    return res
+
+
+def cache_key(req_file: str):
+    digest = hashlib.sha256()
+    digest.update(f'{sys.version}\n{op.realpath(sys.base_prefix)}\n{platform.machine()}\n'.encode('utf-8'))
+    for line in sorted(set(_normalized_requirements(req_file))):
+        digest.update(f'{line}\n'.encode('utf-8'))
+    return digest.hexdigest()[:32]
+
+
+def _tree_size(root: str):
+    total = 0
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            try:
+                total += os.lstat(op.join(dirpath, filename)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def clone_tree(src: str, dst: str):
+    """Clone *src* to *dst* with hardlinks, falling back to a reflink-or-copy."""
+    try:
+        for dirpath, dirnames, filenames in os.walk(src):
+            rel = op.relpath(dirpath, src)
+            target = op.normpath(op.join(dst, rel))
+            os.makedirs(target, exist_ok=True)
+            shutil.copystat(dirpath, target)
+            for name in dirnames + filenames:
+                source = op.join(dirpath, name)
+                if op.islink(source):
+                    os.symlink(os.readlink(source), op.join(target, name))
+                    if name in dirnames:
+                        dirnames.remove(name)
+                elif name in filenames:
+                    os.link(source, op.join(target, name))
+    except OSError as exc:
+        logger.debug('Hardlinking %s failed (%s), copying', src, exc)
+        shutil.rmtree(dst, ignore_errors=True)
+        subprocess.check_call(['cp', '-a', '--reflink=auto', src, dst])
+
+
+def relocate(envpath: str, old: str, new: str):
+    """Rewrite *old* venv path to *new* in scripts and pyvenv.cfg, never touching shared inodes."""
+    old_b, new_b = old.encode('utf-8'), new.encode('utf-8')
+    bindir = op.join(envpath, 'bin')
+    candidates = [op.join(bindir, name) for name in os.listdir(bindir)] + [op.join(envpath, 'pyvenv.cfg')]
+    for filename in candidates:
+        if op.islink(filename) or not op.isfile(filename):
+            continue
+        with open(filename, 'rb') as src:
+            data = src.read()
+        if old_b not in data or b'\0' in data[:1024]:
+            continue
+        tmpname = f'{filename}.relocate'
+        with open(tmpname, 'wb') as dst:
+            dst.write(data.replace(old_b, new_b))
+        shutil.copymode(filename, tmpname)
+        os.replace(tmpname, filename)
+
+
+def _read_meta(key: str):
+    try:
+        with open(op.join(store_dir(), key + META_SUFFIX)) as meta:
+            return json.load(meta)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_meta(key: str, meta: dict[str, object]):
+    with open(op.join(store_dir(), key + META_SUFFIX), 'w') as meta_file:
+        json.dump(meta, meta_file)
+
+
+def restore(key: str, envpath: str):
+    """Materialise cached venv *key* at *envpath*. Return False on a cache miss or a failed restore.
+
+    The entry is cloned and relocated in a temporary directory renamed into place, so a damaged
+    entry never leaves a partial venv behind.
+    """
+    meta = _read_meta(key)
+    entry = op.join(store_dir(), key)
+    if not meta or not op.isdir(entry):
+        return False
+    logger.info('Restoring virtual env from cache: %s', key)
+    tmpname = f'{envpath}.{os.getpid()}.tmp'
+    try:
+        shutil.rmtree(tmpname, ignore_errors=True)
+        clone_tree(entry, tmpname)
+        if meta['path'] != envpath:
+            relocate(tmpname, meta['path'], envpath)
+        os.rename(tmpname, envpath)
+    except (OSError, KeyError, subprocess.CalledProcessError) as exc:
+        logger.warning('Cannot restore virtual env from cache, building it: %s', exc)
+        shutil.rmtree(tmpname, ignore_errors=True)
+        return False
+    meta['used'] = time.time()
+    try:
+        _write_meta(key, meta)
+    except OSError as exc:
+        logger.warning('Cannot update cached virtual env %s: %s', key, exc)
+    return True
+
+
+def store(key: str, envpath: str):
+    """Add the freshly built venv at *envpath* to the store and evict over the budget."""
+    budget = store_budget()
+    if not budget:
+        return
+    root = store_dir()
+    entry = op.join(root, key)
+    tmp_entry = f'{entry}.{os.getpid()}.tmp'
+    try:
+        os.makedirs(root, exist_ok=True)
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+        clone_tree(envpath, tmp_entry)
+        if op.isdir(entry):
+            shutil.rmtree(tmp_entry)
+        else:
+            os.rename(tmp_entry, entry)
+        _write_meta(key, {'path': envpath, 'size': _tree_size(entry), 'used': time.time()})
+    except (OSError, subprocess.CalledProcessError) as exc:
+        logger.warning('Cannot store virtual env in cache: %s', exc)
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+        return
+    evict(budget)
+
+
+def evict(budget: int):
+    """Remove least recently used store entries until the store fits in *budget* bytes."""
+    root = store_dir()
+    entries: list[tuple[float, int, str]] = []
+    for name in os.listdir(root):
+        if not name.endswith(META_SUFFIX):
+            continue
+        key = name[:-len(META_SUFFIX)]
+        meta = _read_meta(key) or {}
+        entries.append((meta.get('used', 0), meta.get('size', 0), key))
+    total = sum(size for _, size, _ in entries)
+    for _, size, key in sorted(entries)[:-1]:
+        if total <= budget:
+            break
+        logger.info('Evicting cached virtual env: %s', key)
+        shutil.rmtree(op.join(root, key), ignore_errors=True)
+        os.unlink(op.join(root, key + META_SUFFIX))
+        total -= size